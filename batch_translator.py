@@ -0,0 +1,184 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import cpp2pas_translator
+import instrumentation
+import translation_cache
+
+STAGES = ('cache', 'lex', 'parse', 'semantic', 'optimize', 'translate', 'write')
+SOURCE_SUFFIXES = ('.cpp',)
+
+
+class FileResult:
+    # Итог трансляции одного файла: время каждой стадии, семантические ошибки и
+    # ошибка, на которой трансляция остановилась (лексер, парсер, ввод-вывод)
+    def __init__(self, source, output):
+        self.source = source
+        self.output = output
+        self.lines = 0
+        self.timings = {}
+        self.errors = []
+        self.failure = None
+        # взят ли результат из кэша (None - кэш не используется)
+        self.cached = None
+
+    @property
+    def ok(self):
+        return self.failure is None and not self.errors
+
+
+class BatchReport:
+    def __init__(self, results, elapsed, jobs):
+        self.results = results
+        self.elapsed = elapsed
+        self.jobs = jobs
+
+    @property
+    def lines(self):
+        return sum(result.lines for result in self.results)
+
+    @property
+    def files_per_second(self):
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.elapsed if self.elapsed else 0.0
+
+    def stage_timings(self):
+        # суммарное время стадий по всем файлам (в процессах-исполнителях)
+        totals = dict.fromkeys(STAGES, 0.0)
+        for result in self.results:
+            for stage, elapsed in result.timings.items():
+                totals[stage] += elapsed
+        return totals
+
+    def summary(self):
+        failed = sum(1 for result in self.results if result.failure)
+        with_errors = sum(1 for result in self.results if result.errors)
+        lines = [f'Файлов: {len(self.results)}, строк: {self.lines}, процессов: {self.jobs}',
+                 f'Время: {self.elapsed:.3f} s, {self.files_per_second:,.1f} files/s, '
+                 f'{self.lines_per_second:,.0f} lines/s',
+                 f'Не оттранслировано: {failed}, с семантическими ошибками: {with_errors}']
+        cached = [result.cached for result in self.results if result.cached is not None]
+        if cached:
+            hits = sum(cached)
+            lines.append(f'Кэш: попаданий {hits}, промахов {len(cached) - hits} ({hits / len(cached):.0%})')
+        timings = self.stage_timings()
+        total = sum(timings.values())
+        for stage, elapsed in timings.items():
+            share = elapsed / total * 100 if total else 0.0
+            lines.append(f'  {stage:>9}: {elapsed:.3f} s ({share:.1f}%)')
+        return '\n'.join(lines)
+
+
+def output_path(source, root=None, output_dir=None):
+    # .pas рядом с исходником или, если задан output_dir, по тому же относительному
+    # пути от корня, в котором исходник нашли
+    base = os.path.splitext(source)[0] + '.pas'
+    if output_dir is None:
+        return base
+    relative = os.path.relpath(base, root) if root else os.path.basename(base)
+    return os.path.join(output_dir, relative)
+
+
+def collect_sources(paths, output_dir=None):
+    # пары (исходник, .pas) для файлов и каталогов из paths; каталоги обходятся рекурсивно
+    tasks = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, filenames in os.walk(path):
+                for filename in sorted(filenames):
+                    if filename.endswith(SOURCE_SUFFIXES):
+                        source = os.path.join(directory, filename)
+                        tasks.append((source, output_path(source, path, output_dir)))
+        else:
+            tasks.append((path, output_path(path, output_dir=output_dir)))
+    return tasks
+
+
+# кэши процесса-исполнителя по (каталог, размер), чтобы размер кэша не
+# пересчитывался сканированием каталога для каждого файла
+_caches = {}
+
+
+def _process_cache(directory, max_size):
+    cache = _caches.get((directory, max_size))
+    if cache is None:
+        cache = _caches[directory, max_size] = translation_cache.TranslationCache(directory, max_size)
+    return cache
+
+
+def translate_file(source, output, optimize=True, cache_dir=None,
+                   cache_size=translation_cache.DEFAULT_MAX_SIZE) -> FileResult:
+    # cpp2pas_translator.process_file для одного файла и запись .pas; время стадий
+    # берётся из PipelineStats, с cache_dir результат сначала ищется в кэше трансляций
+    result = FileResult(source, output)
+    stats = instrumentation.PipelineStats(counters=False)
+    cache = _process_cache(cache_dir, cache_size) if cache_dir is not None else None
+    try:
+        translator, analyzer = cpp2pas_translator.process_file(source, optimize=optimize, cache=cache, stats=stats)
+        if cache is not None:
+            result.cached = isinstance(translator, translation_cache.CachedTranslation)
+        result.errors = analyzer.errors
+        with stats.stage('write'):
+            directory = os.path.dirname(output)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(output, 'w', encoding='utf8') as f:
+                f.write(translator.output)
+    except Exception as e:
+        # трансляция остановилась на последней начатой стадии
+        result.failure = f'{next(reversed(stats.stages), "read")}: {type(e).__name__}: {e}'
+    result.lines = stats.lines
+    result.timings = {name: stage.wall for name, stage in stats.stages.items()}
+    return result
+
+
+def _translate_task(task):
+    return translate_file(*task)
+
+
+def translate_files(paths, *, output_dir=None, jobs=None, optimize=True, cache_dir=None,
+                    cache_size=translation_cache.DEFAULT_MAX_SIZE) -> BatchReport:
+    # Транслирует все .cpp из paths (файлы и каталоги) в процессах ProcessPoolExecutor;
+    # результаты идут в порядке исходников, ошибки одного файла не мешают остальным
+    tasks = [(source, output, optimize, cache_dir, cache_size)
+             for source, output in collect_sources(paths, output_dir)]
+    jobs = jobs or os.cpu_count() or 1
+    start = time.perf_counter()
+    if jobs == 1 or len(tasks) <= 1:
+        results = [_translate_task(task) for task in tasks]
+    else:
+        # мелкие файлы отдаём пачками, чтобы не платить за передачу каждого отдельно
+        chunksize = max(1, len(tasks) // (jobs * 4))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_translate_task, tasks, chunksize=chunksize))
+    return BatchReport(results, time.perf_counter() - start, jobs)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Пакетная трансляция C++ -> Pascal')
+    arg_parser.add_argument('paths', nargs='+', help='исходные файлы и каталоги с .cpp')
+    arg_parser.add_argument('-o', '--output-dir',
+                            help='каталог для .pas с той же структурой, что у исходников (по умолчанию рядом с ними)')
+    arg_parser.add_argument('-j', '--jobs', type=int, help='число процессов (по умолчанию по числу ядер)')
+    arg_parser.add_argument('--no-optimize', dest='optimize', action='store_false',
+                            help='не удалять неиспользуемые переменные')
+    arg_parser.add_argument('--cache-dir', help='каталог кэша трансляций (по умолчанию без кэша)')
+    arg_parser.add_argument('--cache-size', type=int, default=translation_cache.DEFAULT_MAX_SIZE // 2 ** 20,
+                            help='предельный размер кэша в MiB')
+    args = arg_parser.parse_args()
+
+    report = translate_files(args.paths, output_dir=args.output_dir, jobs=args.jobs, optimize=args.optimize,
+                             cache_dir=args.cache_dir, cache_size=args.cache_size * 2 ** 20)
+    for result in report.results:
+        if result.failure:
+            print(f'{result.source}: {result.failure}')
+        for error in result.errors:
+            print(f'{result.source}: {error}')
+    print(report.summary())
+    sys.exit(0 if all(result.ok for result in report.results) else 1)
@@ -0,0 +1,934 @@
+import argparse
+import contextlib
+import gc
+import mmap
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import cpp2pas_translator
+import instrumentation
+import lexer
+import parser
+import semantic_analyzer
+import translation_cache
+from batch_translator import translate_files
+from benchmarks import corpus
+from incremental import IncrementalDocument
+from lexer import Lexer, Token, tokenize
+from parser import Parser
+
+
+def generate_whitespace_source(size=1_000_000):
+    # длинные отступы и комментарии: рекурсивный автомат тратит по кадру стека на символ
+    line = '\t' * 500 + ' ' * 2000 + 'x = x + 1;' + ' ' * 1000 + '// ' + 'comment ' * 200 + '\n'
+    return 'int x;\n' + line * (size // len(line) + 1)
+
+
+def generate_nested_parentheses(depth):
+    # присваивание и условие с depth вложенными скобками
+    return (f'void main()\n{{\n    x = {"(" * depth}a + 1{")" * depth};\n'
+            f'    if ({"(" * depth}a < b{")" * depth}) {{\n        x = 1;\n    }}\n}}\n')
+
+
+def generate_long_literals(size):
+    # строковый литерал, комментарий и идентификатор длиной size символов каждый
+    return (f'string s = "{"a" * size}";\n'
+            f'// {"c" * size}\n'
+            f'{"x" * size} = 1;\n')
+
+
+def measure(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def traced_memory(func, *args, peak=False):
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        size, peak_size = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_size if peak else size, result
+
+
+def lex_list(content):
+    lexer = Lexer(content, engine='table')
+    tokens = [lexer.get_next_token()]
+    while tokens[-1].name != Token.EOF:
+        tokens.append(lexer.get_next_token())
+    return tokens
+
+
+def count_nodes(tree):
+    nodes = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        stack.extend(child for _, child in parser.iter_child_nodes(node) if isinstance(child, parser.Node))
+    return nodes
+
+
+def _without_slots(cls, bases):
+    namespace = {key: value for key, value in vars(cls).items()
+                 if key not in ('__slots__', '__dict__', '__weakref__')
+                 and not isinstance(value, types.MemberDescriptorType)}
+    return type(cls.__name__, bases, namespace)
+
+
+@contextlib.contextmanager
+def dict_based_classes():
+    # временно подменяет Token и все классы узлов такими же классами без __slots__,
+    # чтобы сравнить расход памяти с прежними объектами на __dict__
+    mirrors = {Token: _without_slots(Token, (object,)), parser.Node: _without_slots(parser.Node, (object,))}
+    pending = list(parser.Node.__subclasses__())
+    while pending:
+        cls = pending.pop(0)
+        mirrors[cls] = _without_slots(cls, tuple(mirrors[base] for base in cls.__bases__))
+        pending.extend(cls.__subclasses__())
+    patched = [(lexer, 'Token', Token)]
+    patched.extend((parser, name, value) for name, value in vars(parser).items()
+                   if isinstance(value, type) and value in mirrors)
+    for module, name, value in patched:
+        setattr(module, name, mirrors[value])
+    try:
+        yield
+    finally:
+        for module, name, value in patched:
+            setattr(module, name, value)
+
+
+def allocated_blocks(func, *args):
+    # число блоков памяти, которые остались занятыми после func(*args)
+    gc.collect()
+    before = sys.getallocatedblocks()
+    result = func(*args)
+    return sys.getallocatedblocks() - before, result
+
+
+def read_values(tokens):
+    for token in tokens:
+        token.value
+
+
+def bench_allocations(lines):
+    content = corpus.generate('wide', lines)
+    print(f'Token allocations ({lines} lines)')
+    for title, func in (('Lexer table', lex_list), ('TokenStream', lambda content: list(tokenize(content)))):
+        blocks, tokens = allocated_blocks(func, content)
+        values, _ = allocated_blocks(read_values, tokens)
+        print(f'  {title:>12}: {blocks / len(tokens):.2f} blocks/token, '
+              f'+{values / len(tokens):.2f} blocks/token after reading every value')
+        del tokens
+
+
+def lex_all(content, engine):
+    lexer = Lexer(content, engine=engine)
+    count = 0
+    while lexer.get_next_token().name != Token.EOF:
+        count += 1
+    return count
+
+
+def bench_memory(lines):
+    print(f'Memory ({lines} lines)')
+    content = corpus.generate('wide', lines)
+    for title, classes in (('__dict__', dict_based_classes), ('__slots__', contextlib.nullcontext)):
+        with classes():
+            size, tokens = traced_memory(lex_list, content)
+            token_count = len(tokens)
+            del tokens
+            stream = tokenize(content)
+            size_ast, tree = traced_memory(Parser(stream).parse)
+            node_count = count_nodes(tree)
+            del tree, stream
+        print(f'  {title:>9}: {size / token_count:.1f} bytes/token, '
+              f'{size_ast / node_count:.1f} bytes/node ({node_count} nodes, AST with its tokens)')
+
+
+def lex_lexer(lexer):
+    count = 0
+    while lexer.get_next_token().name != Token.EOF:
+        count += 1
+    return count
+
+
+def lex_file_read(filename):
+    with open(filename, 'r', encoding='utf8') as f:
+        return lex_lexer(Lexer(f.read(), engine='table'))
+
+
+def lex_file_stream(filename):
+    with open(filename, 'r', encoding='utf8') as f:
+        return lex_lexer(Lexer.from_file(f))
+
+
+def lex_file_mmap(filename):
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        return lex_lexer(Lexer.from_file(m))
+
+
+def bench_long_literals(sizes):
+    print('Long literals, comments and identifiers')
+    for size in sizes:
+        content = generate_long_literals(size)
+        timings = []
+        for engine in Lexer.ENGINES:
+            elapsed, _ = measure(lex_all, content, engine)
+            timings.append(f'{engine} {elapsed / len(content) * 1e9:,.1f} ns/char')
+        print(f'  {size:>9} chars: ' + ', '.join(timings))
+
+
+def bench_streaming(lines):
+    with tempfile.NamedTemporaryFile('w', encoding='utf8', suffix='.cpp', delete=False) as f:
+        f.write(corpus.generate('wide', lines))
+    try:
+        print(f'Streaming lexer ({lines} lines, {os.path.getsize(f.name)} bytes)')
+        for title, func in (('f.read()', lex_file_read), ('from_file', lex_file_stream), ('mmap', lex_file_mmap)):
+            elapsed, count = measure(func, f.name, repeat=1)
+            peak, _ = traced_memory(func, f.name, peak=True)
+            print(f'  {title:>10}: {count} tokens, {elapsed:.3f} s, peak {peak / 1024:,.0f} KiB')
+    finally:
+        os.remove(f.name)
+
+
+def bench_lexer_engines(content):
+    print(f'Lexer engines ({len(content)} chars, {content.count(chr(10))} lines)')
+    for engine in Lexer.ENGINES:
+        elapsed, count = measure(lex_all, content, engine)
+        print(f'  {engine:>10}: {count} tokens, {elapsed:.3f} s, {count / elapsed:,.0f} tokens/s, '
+              f'{elapsed / count * 1e9:,.0f} ns/token')
+
+
+def bench_lexer_stress(content):
+    print(f'Lexer stress ({len(content)} chars of whitespace and comments)')
+    for engine in Lexer.ENGINES:
+        try:
+            elapsed, count = measure(lex_all, content, engine, repeat=1)
+        except RecursionError:
+            print(f'  {engine:>10}: RecursionError')
+        else:
+            print(f'  {engine:>10}: {count} tokens, {elapsed:.3f} s, {len(content) / elapsed:,.0f} chars/s')
+
+
+def bench_token_stream(content):
+    print('Token storage')
+    list_size, tokens = traced_memory(lex_list, content)
+    stream_size, stream = traced_memory(tokenize, content)
+    print(f'  list of Token: {list_size / len(tokens):.1f} bytes/token')
+    print(f'   TokenStream: {stream_size / len(stream):.1f} bytes/token')
+    del tokens, stream
+
+    print('End-to-end parse')
+    for title, make_source in (('Lexer fsm', lambda: Lexer(content)),
+                               ('Lexer table', lambda: Lexer(content, engine='table')),
+                               ('TokenStream', lambda: tokenize(content))):
+        elapsed, _ = measure(lambda: Parser(make_source()).parse())
+        print(f'  {title:>12}: {elapsed:.3f} s')
+
+
+def bench_incremental(lines):
+    content = corpus.generate('wide', lines)
+    print(f'Incremental edits ({content.count(chr(10))} lines)')
+    anchor = content.index('float f0 = 0.5;', len(content) // 2)
+    edits = (('in-line edit', anchor + len('float f0 = '), 3, '42.0'),
+             ('new line', anchor, 0, 'int w = 1;\n    '),
+             ('new function', content.rindex('void ', 0, anchor), 0,
+              'void inserted()\n{\n    g0 = 1;\n}\n'))
+    for title, offset, removed, inserted in edits:
+        new_content = content[:offset] + inserted + content[offset + removed:]
+        full, _ = measure(lambda: Parser(tokenize(new_content)).parse())
+        timings = []
+        for _ in range(3):
+            document = IncrementalDocument(content)
+            start = time.perf_counter()
+            document.edit(offset, removed, inserted)
+            timings.append(time.perf_counter() - start)
+        incremental = min(timings)
+        print(f'  {title:>13}: full reparse {full * 1e3:,.1f} ms, incremental {incremental * 1e3:,.2f} ms '
+              f'({full / incremental:,.0f}x)')
+
+
+def parse_with(stream, expressions):
+    return Parser(stream, expressions=expressions).parse()
+
+
+def bench_expressions(statements, depths):
+    # в форме expressions почти каждая строка - оператор с длинным выражением
+    content = corpus.generate('expressions', statements)
+    stream = tokenize(content)
+    print(f'Expression parsing ({statements} lines, {len(stream)} tokens)')
+    for engine in Parser.EXPRESSION_ENGINES:
+        elapsed, _ = measure(parse_with, stream, engine)
+        print(f'  {engine:>10}: {elapsed:.3f} s, {len(stream) / elapsed:,.0f} tokens/s')
+    print(f'Nested parentheses (recursion limit {sys.getrecursionlimit()})')
+    for depth in depths:
+        stream = tokenize(generate_nested_parentheses(depth))
+        timings = []
+        for engine in Parser.EXPRESSION_ENGINES:
+            try:
+                elapsed, _ = measure(parse_with, stream, engine)
+            except RecursionError:
+                timings.append(f'{engine} RecursionError')
+            else:
+                timings.append(f'{engine} {elapsed * 1e3:,.1f} ms')
+        print(f'  depth {depth:>7}: ' + ', '.join(timings))
+
+
+class RecursiveCounter:
+    # рекурсивный обход для сравнения с NodeWalker: как и CountingWalker, вызывает
+    # обработчик на каждом узле, токене и списке
+    def __init__(self):
+        self.visits = 0
+
+    def visit(self, node):
+        self.count(node)
+        if isinstance(node, parser.Node):
+            for field in node._fields:
+                self.visit(getattr(node, field))
+        elif isinstance(node, list):
+            for el in node:
+                self.visit(el)
+
+    def count(self, node):
+        self.visits += 1
+
+
+class GetattrCounter(RecursiveCounter):
+    # диспетчеризация прежнего NodeVisitor: имя обработчика и getattr на каждый элемент
+    def visit(self, node):
+        visitor = getattr(self, 'visit_' + type(node).__name__, None)
+        if visitor is None:
+            return RecursiveCounter.visit(self, node)
+        return visitor(node)
+
+
+class CountingWalker(parser.NodeWalker):
+    # то же, что RecursiveCounter, через NodeWalker
+    def __init__(self):
+        self.visits = 0
+
+    def generic_enter(self, node):
+        self.visits += 1
+
+
+def bench_dispatch(functions):
+    # NodeWalker находит обработчики типа один раз (_plans, _visitors), прежний
+    # NodeVisitor - по имени на каждом элементе
+    tree = Parser(tokenize(corpus.generate_functions(functions))).parse()
+    counter = CountingWalker()
+    counter.visit(tree)
+    visits = counter.visits
+    print(f'Visitor dispatch ({functions} functions, {visits} nodes, tokens and lists)')
+    cases = [('getattr', lambda: GetattrCounter().visit(tree)),
+             ('walk()', lambda: CountingWalker().walk(tree)),
+             ('visit()', lambda: CountingWalker().visit(tree))]
+    for title, func in cases:
+        elapsed, _ = measure(func)
+        print(f'  {title:>8}: {visits / elapsed:,.0f} visits/s')
+
+
+def wrap_in_program(statement):
+    # int a; void main() { statement }
+    def token(name, value):
+        return Token(name, value, 1, 1)
+    main = parser.NodeFunction(token(Token.ID, 'void'), token(Token.ID, 'main'), parser.NodeFormalParams([]),
+                               parser.NodeBlock([statement]))
+    return parser.NodeProgram([parser.NodeDeclaration(token(Token.ID, 'int'), token(Token.ID, 'a')), main])
+
+
+def deep_blocks(depth):
+    # depth вложенных while (a) { ... }
+    statement = parser.NodeAssigning(parser.NodeVar(Token(Token.ID, 'a', 1, 1)), parser.NodeIntLiteral(
+        Token(Token.INT_LITERAL, '1', 1, 1)))
+    for _ in range(depth):
+        statement = parser.NodeWhileConstruction(parser.NodeVar(Token(Token.ID, 'a', 1, 1)),
+                                                 parser.NodeBlock([statement]))
+    return wrap_in_program(statement)
+
+
+def deep_expression(depth):
+    # a = a + a + ... + a: цепочка из depth бинарных операций, вложенных влево
+    var = parser.NodeVar(Token(Token.ID, 'a', 1, 1))
+    op = Token(Token.PLUS, '+', 1, 1)
+    expression = var
+    for _ in range(depth):
+        expression = parser.NodeBinaryOperator(expression, op, var)
+    return wrap_in_program(parser.NodeAssigning(var, expression))
+
+
+def run_analyzer(tree):
+    analyzer = semantic_analyzer.SemanticAnalyzer()
+    analyzer.visit(tree)
+    return analyzer
+
+
+def run_translator(tree):
+    translator = cpp2pas_translator.SourceToSourceTranslator(run_analyzer(tree).scopes)
+    translator.visit(tree)
+    return translator
+
+
+def count_walk(tree):
+    return sum(1 for _ in parser.walk(tree))
+
+
+def bench_traversal(functions, depths):
+    tree = Parser(tokenize(corpus.generate_functions(functions))).parse()
+    counter = CountingWalker()
+    counter.visit(tree)
+    print(f'Traversal ({functions} functions, {counter.visits} nodes, tokens and lists)')
+    recursive, _ = measure(lambda: RecursiveCounter().visit(tree))
+    walker, _ = measure(lambda: CountingWalker().visit(tree))
+    print(f'  recursive {recursive * 1e3:,.1f} ms, NodeWalker {walker * 1e3:,.1f} ms')
+
+    print(f'Deep ASTs (recursion limit {sys.getrecursionlimit()})')
+    cases = [('blocks', deep_blocks, 'recursive count', lambda tree: RecursiveCounter().visit(tree)),
+             ('blocks', deep_blocks, 'walker count', lambda tree: CountingWalker().visit(tree)),
+             ('blocks', deep_blocks, 'walk()', count_walk),
+             ('blocks', deep_blocks, 'semantic', run_analyzer),
+             ('expression', deep_expression, 'semantic', run_analyzer),
+             ('expression', deep_expression, 'translator', run_translator)]
+    for depth in depths:
+        for shape, make_tree, title, func in cases:
+            tree = make_tree(depth)
+            try:
+                elapsed, _ = measure(func, tree, repeat=1)
+            except RecursionError:
+                result = 'RecursionError'
+            else:
+                result = f'{elapsed * 1e3:,.1f} ms'
+            print(f'  {shape:>10} {depth:>7} {title:>16}: {result}')
+
+
+def legacy_repr(node, level=0, parent_field_name=''):
+    # прежний Node.__repr__: рекурсия и склейка строк поддеревьев на каждом уровне
+    if level == 0:
+        res = ''
+    else:
+        res = '|   ' * level
+        res += "|+-"
+    c = str(node.__class__)
+    pos_1 = c.find('.') + 1
+    res += f"{parent_field_name}: {c[pos_1:c.find(chr(39), pos_1)]}\n"
+    for field_name, el in parser.iter_child_nodes(node):
+        if isinstance(el, Token):
+            res += '|   ' * (level + 1)
+            res += "|+-"
+            res += f'{field_name}: {el}\n'
+        else:
+            res += legacy_repr(el, level + 1, field_name)
+    return res
+
+
+def dump_to_devnull(tree, max_depth=None):
+    with open(os.devnull, 'w') as f:
+        parser.dump(tree, f, max_depth)
+
+
+def bench_dump(functions, depths):
+    tree = Parser(tokenize(corpus.generate_functions(functions))).parse()
+    # размер дампа глубокого дерева растёт как квадрат глубины из-за отступов
+    cases = [(f'{functions} functions', tree)] + [(f'blocks depth {depth}', deep_blocks(depth)) for depth in depths]
+    print('AST dump')
+    for title, tree in cases:
+        size = len(repr(tree))
+        timings = []
+        for name, func in (('recursive repr', legacy_repr), ('repr', repr), ('dump', dump_to_devnull),
+                           ('dump depth 3', lambda tree: dump_to_devnull(tree, 3))):
+            try:
+                elapsed, _ = measure(func, tree, repeat=1)
+            except RecursionError:
+                timings.append(f'{name} RecursionError')
+            else:
+                timings.append(f'{name} {elapsed * 1e3:,.1f} ms')
+        print(f'  {title} ({size:,} chars): ' + ', '.join(timings))
+
+
+class ChainedSymbolTable:
+    # прежнее разрешение имён: lookup идёт по цепочке enclosing_scope
+    def __init__(self):
+        self.current_scope = None
+
+    def open_scope(self, scope_name, block=False):
+        enclosing_scope = self.current_scope
+        level = enclosing_scope.scope_level + 1 if enclosing_scope else 0
+        scope = semantic_analyzer.ScopedSymbolTable(scope_name, level, enclosing_scope, block)
+        if enclosing_scope is not None:
+            enclosing_scope.nested_scopes[scope_name] = scope
+        self.current_scope = scope
+        return scope
+
+    def close_scope(self):
+        self.current_scope = self.current_scope.enclosing_scope
+        return self.current_scope
+
+    def insert(self, symbol):
+        self.current_scope.insert(symbol)
+
+    def lookup(self, name, current_scope_only=False, count=False):
+        return self.current_scope.lookup(name, current_scope_only, count)
+
+
+def generate_nested_functions(depth, identifiers=1000):
+    # identifiers глобальных переменных, depth вложенных функций со своей
+    # переменной; в самой глубокой - присваивания из всех глобальных
+    parts = [f'int g{n};\n' for n in range(identifiers)]
+    parts.append('void main()\n{\n')
+    for level in range(depth):
+        parts.append(f'void f{level}()\n{{\nint v{level};\n')
+    parts.extend(f'v{depth - 1} = g{n} + v0;\n' for n in range(identifiers))
+    parts.append('}\n' * depth)
+    parts.append('}\n')
+    return ''.join(parts)
+
+
+class FunctionScopesAnalyzer(semantic_analyzer.SemanticAnalyzer):
+    # без областей видимости блоков if/while/else
+    enter_NodeIfConstruction = enter_NodeWhileConstruction = enter_NodeElseBlock = parser.NodeWalker.generic_enter
+    leave_NodeIfConstruction = leave_NodeWhileConstruction = leave_NodeElseBlock = parser.NodeWalker.generic_leave
+
+
+def analyze_with(tree, symbols_class, analyzer_class=semantic_analyzer.SemanticAnalyzer):
+    analyzer = analyzer_class()
+    analyzer.symbols = symbols_class()
+    analyzer.visit(tree)
+    return analyzer
+
+
+def bench_symbols(depths, identifiers):
+    print(f'Name resolution ({identifiers} global identifiers used in the innermost function)')
+    for depth in depths:
+        tree = Parser(tokenize(generate_nested_functions(depth, identifiers))).parse()
+        chained, old = measure(analyze_with, tree, ChainedSymbolTable)
+        flat, new = measure(analyze_with, tree, semantic_analyzer.SymbolTable)
+        assert old.errors == new.errors
+        print(f'  depth {depth:>5}: enclosing_scope chain {chained * 1e3:,.1f} ms, '
+              f'SymbolTable {flat * 1e3:,.1f} ms ({chained / flat:.2f}x)')
+
+
+def bench_block_scopes(depths):
+    print('Block scopes (while nested N deep, a global variable used at every level)')
+    cases = [('function scopes', semantic_analyzer.SymbolTable, FunctionScopesAnalyzer),
+             ('block scopes', semantic_analyzer.SymbolTable, semantic_analyzer.SemanticAnalyzer),
+             ('block scopes, enclosing_scope chain', ChainedSymbolTable, semantic_analyzer.SemanticAnalyzer)]
+    for depth in depths:
+        tree = deep_blocks(depth)
+        timings = []
+        for title, symbols_class, analyzer_class in cases:
+            try:
+                elapsed, _ = measure(analyze_with, tree, symbols_class, analyzer_class, repeat=1)
+            except RecursionError:
+                timings.append(f'{title} RecursionError')
+            else:
+                timings.append(f'{title} {elapsed * 1e3:,.1f} ms')
+        print(f'  depth {depth:>7}: ' + ', '.join(timings))
+
+
+class LegacyTextTranslator(cpp2pas_translator.SourceToSourceTranslator):
+    # прежний вывод: текст каждого блока заново делится на строки и сдвигается
+    # на каждом уровне вложенности
+    def leave_NodeBlock(self, node, values):
+        self._join_else(node.children, values)
+        results = []
+        for result in values:
+            if result:
+                results.extend(result.splitlines())
+        return 'begin\n' + '\n'.join('   ' + line for line in results) + '\nend'
+
+    def leave_NodeProgram(self, node, values):
+        global_scope, self.current_scope = self.current_scope, self._sym_table_scopes['main']
+        result_str = 'program translated;\n' + self.get_var_section_text()
+        self.current_scope = global_scope
+        functions = self._program_functions(node)
+        has_main = bool(functions) and functions[-1].name.value == 'main'
+        for content in values[:len(values) - has_main]:
+            if content:
+                result_str += '\n'.join('   ' + line for line in content.splitlines())
+        result_str += '\n'
+        if has_main and values[-1]:
+            result_str += '\n'.join(line for line in values[-1].splitlines())
+        self.output = result_str + '. {END OF translated}'
+        self.current_scope = self.current_scope.enclosing_scope
+
+    def leave_NodeFunction(self, node, values):
+        self.current_scope = self.current_scope.enclosing_scope
+        if node.name.value == 'main':
+            return '\n'.join(line for line in values[0].splitlines())
+        result_str = self._function_headers.pop()
+        nested, _ = self._function_children(node)
+        for content in values[:len(nested)]:
+            if content:
+                result_str += '\n'.join('   ' + line for line in content.splitlines())
+            result_str += '\n'
+        result_str += 'begin\n'
+        for content in values[len(nested):]:
+            if content:
+                result_str += '\n'.join('   ' + line for line in content.splitlines())
+        return result_str + f'\nend; {{END OF {node.name.value}}}\n'
+
+    def leave_NodeIfConstruction(self, node, values):
+        header = {parser.NodeIfConstruction: 'if {} then', parser.NodeWhileConstruction: 'while {} do',
+                  parser.NodeElseBlock: 'else  '}[type(node)].format(values[0])
+        return header + '\n' + '\n'.join(line for line in values[-1].splitlines()) + ';'
+
+    leave_NodeWhileConstruction = leave_NodeElseBlock = leave_NodeIfConstruction
+
+
+def generate_long_function(statements, flat=False):
+    # main из statements операторов, каждый десятый - if/else с блоками;
+    # с flat - только присваивания
+    parts = ['int a;\nvoid main()\n{\n']
+    if flat:
+        parts.append('a = a + 1;\n' * statements)
+    for n in range(0 if flat else statements // 10):
+        parts.append('a = a + 1;\n' * 8)
+        parts.append(f'if (a < {n}) {{\na = 1;\n}}\nelse {{\na = 2;\n}}\n')
+    parts.append('}\n')
+    return ''.join(parts)
+
+
+def translate_with(tree, translator_class):
+    translator = translator_class(run_analyzer(tree).scopes)
+    translator.visit(tree)
+    return translator.output
+
+
+def bench_emission(depths, statements):
+    print('Pascal emission')
+    # глубокие случаи с splitlines идут секундами, их хватает замерить один раз
+    cases = [(f'while depth {depth}', deep_blocks(depth), 1) for depth in depths]
+    cases += [(f'main of {count} statements', Parser(tokenize(generate_long_function(count))).parse(), 5)
+              for count in statements]
+    cases += [(f'flat main of {count} statements',
+               Parser(tokenize(generate_long_function(count, flat=True))).parse(), 5)
+              for count in statements]
+    for title, tree, repeat in cases:
+        # замеры чередуются, чтобы оба транслятора попадали в одинаковые условия
+        legacy = writer = float('inf')
+        for _ in range(repeat):
+            elapsed, old = measure(translate_with, tree, LegacyTextTranslator, repeat=1)
+            legacy = min(legacy, elapsed)
+            elapsed, new = measure(translate_with, tree, cpp2pas_translator.SourceToSourceTranslator, repeat=1)
+            writer = min(writer, elapsed)
+        assert old == new
+        print(f'  {title} ({len(new):,} chars): splitlines at every level {legacy * 1e3:,.1f} ms, '
+              f'PascalWriter {writer * 1e3:,.1f} ms ({legacy / writer:.2f}x)')
+
+
+class RegexElseTranslator(cpp2pas_translator.SourceToSourceTranslator):
+    # прежний способ: 'end;' перед else исправлялся регулярным выражением по всему выводу
+    @staticmethod
+    def _join_else(children, values):
+        return values
+
+    def visit(self, node):
+        super().visit(node)
+        self.output = re.sub(r'end;([\s,\n]+)else', r'end\1else', self.output)
+
+
+def generate_if_else_chains(chains, length=3):
+    # chains цепочек if/else из length звеньев с вложенным if в каждом блоке
+    link = 'if (a < {n}) {{\nif (a) {{\na = 1;\n}}\n}}\nelse {{\na = 2;\n}}\n'
+    parts = ['int a;\nvoid main()\n{\n']
+    for n in range(chains):
+        parts.extend(link.format(n=n) for _ in range(length))
+    parts.append('}\n')
+    return ''.join(parts)
+
+
+def bench_else(chains, depths):
+    print("'end else' emission")
+    cases = [(f'{count} if/else chains', Parser(tokenize(generate_if_else_chains(count))).parse())
+             for count in chains]
+    cases += [(f'while depth {depth}', deep_blocks(depth)) for depth in depths]
+    for title, tree in cases:
+        regex, old = measure(translate_with, tree, RegexElseTranslator, repeat=1)
+        structural, new = measure(translate_with, tree, cpp2pas_translator.SourceToSourceTranslator, repeat=1)
+        assert old == new
+        print(f'  {title} ({len(new):,} chars): regex pass {regex * 1e3:,.1f} ms, '
+              f'structural {structural * 1e3:,.1f} ms ({regex / structural:.2f}x)')
+
+
+def translate_to_devnull(tree, scopes):
+    with open(os.devnull, 'w', encoding='utf8') as f:
+        translator = cpp2pas_translator.SourceToSourceTranslator(scopes, stream=f)
+        translator.visit(tree)
+
+
+def translate_to_string(tree, scopes, translator_class=cpp2pas_translator.SourceToSourceTranslator):
+    translator = translator_class(scopes)
+    translator.visit(tree)
+    return translator.output
+
+
+def bench_output_memory(functions):
+    tree = Parser(tokenize(corpus.generate_functions(functions))).parse()
+    scopes = run_analyzer(tree).scopes
+    size = len(translate_to_string(tree, scopes))
+    print(f'Translation peak memory ({functions} functions, {size / 2 ** 20:.1f} MiB of Pascal)')
+    for title, func, args in (('splitlines at every level', translate_to_string, (LegacyTextTranslator,)),
+                              ('output string', translate_to_string, ()),
+                              ('stream', translate_to_devnull, ())):
+        peak, _ = traced_memory(func, tree, scopes, *args, peak=True)
+        elapsed, _ = measure(func, tree, scopes, *args)
+        print(f'  {title:>25}: peak {peak / 2 ** 20:,.1f} MiB, {elapsed * 1e3:,.1f} ms')
+
+
+def lex_and_parse(content):
+    return Parser(tokenize(content)).parse()
+
+
+def analyze_and_translate(tree):
+    analyzer = run_analyzer(tree)
+    return translate_to_string(tree, analyzer.scopes)
+
+
+def bench_serialized_ast(lines):
+    content = corpus.generate('wide', lines)
+    tree = lex_and_parse(content)
+    data = parser.serialize(tree)
+    print(f'Serialized AST ({lines} lines, {len(content) / 2 ** 20:.1f} MiB of source, '
+          f'{len(data) / 2 ** 20:.1f} MiB serialized)')
+    parse_time, _ = measure(lex_and_parse, content)
+    load_time, loaded = measure(parser.deserialize, data)
+    for title, elapsed in (('tokenize + parse', parse_time),
+                           ('serialize', measure(parser.serialize, tree)[0]),
+                           ('deserialize', load_time)):
+        print(f'  {title:>20}: {elapsed:.3f} s')
+    print(f'  deserialize is {parse_time / load_time:.1f}x faster than parsing, '
+          f'same translation: {analyze_and_translate(loaded) == analyze_and_translate(tree)}')
+
+
+def process_with_stats(path):
+    stats = instrumentation.PipelineStats()
+    cpp2pas_translator.process_file(path, stats=stats)
+    return stats
+
+
+def generate_identifiers(identifiers, statements):
+    # identifiers глобальных переменных с длинными именами и main из statements
+    # присваиваний между ними
+    names = [f'identifier_number_{n}_value' for n in range(identifiers)]
+    parts = [f'int {name};\n' for name in names]
+    parts.append('void main()\n{\n')
+    parts.extend(f'{names[n % identifiers]} = {names[n * 7 % identifiers]} + {names[n * 13 % identifiers]};\n'
+                 for n in range(statements))
+    parts.append('}\n')
+    return ''.join(parts)
+
+
+def copy_names(tokens):
+    # у каждого идентификатора своя строка, как у лексера без NameTable
+    for token in tokens:
+        if token.name == Token.ID:
+            token.value = token.value[:1] + token.value[1:]
+    return tokens
+
+
+def tree_tokens(tree):
+    return [node for _, _, node, _ in parser.walk(tree) if isinstance(node, Token)]
+
+
+def bench_names(identifiers, statements):
+    content = generate_identifiers(identifiers, statements)
+    stream = tokenize(content)
+    print(f'Identifier interning ({identifiers} identifiers, {len(stream)} tokens, '
+          f'{len(stream.name_table)} names in NameTable)')
+    shared, _ = traced_memory(list, stream)
+    copied, _ = traced_memory(lambda: copy_names(list(stream)))
+    print(f'  tokens: shared names {shared / len(stream):.1f} bytes/token, '
+          f'a string per identifier {copied / len(stream):.1f} bytes/token')
+    tree = Parser(stream).parse()
+    copied_tree = Parser(stream).parse()
+    copy_names(tree_tokens(copied_tree))
+    shared_time, _ = measure(run_analyzer, tree)
+    copied_time, _ = measure(run_analyzer, copied_tree)
+    print(f'  semantic analysis: shared names {shared_time * 1e3:,.1f} ms, '
+          f'a string per identifier {copied_time * 1e3:,.1f} ms ({copied_time / shared_time:.2f}x)')
+
+
+def bench_instrumentation(functions):
+    with tempfile.NamedTemporaryFile('w', encoding='utf8', suffix='.cpp', delete=False) as f:
+        f.write(corpus.generate_functions(functions))
+    try:
+        print(f'Instrumentation ({functions} functions)')
+        plain, _ = measure(cpp2pas_translator.process_file, f.name)
+        instrumented, stats = measure(process_with_stats, f.name)
+        print(f'  {"without stats":>15}: {plain:.3f} s')
+        print(f'  {"with stats":>15}: {instrumented:.3f} s')
+        for line in str(stats).splitlines():
+            print('    ' + line)
+    finally:
+        os.remove(f.name)
+
+
+def write_corpus(directory, files, functions):
+    # files разных исходников по functions функций (имена функций не повторяются)
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, f'source_{i}.cpp')
+        source = corpus.generate_functions(functions).replace('function_', f'function_{i}_')
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(source)
+        paths.append(path)
+    return paths
+
+
+def bench_cache(files, functions):
+    with tempfile.TemporaryDirectory() as root:
+        sources = os.path.join(root, 'src')
+        cache_dir = os.path.join(root, 'cache')
+        os.makedirs(sources)
+        paths = write_corpus(sources, files, functions)
+        print(f'Translation cache ({files} files x {functions} functions, 1 process)')
+        for title in ('cold', 'warm'):
+            report = translate_files([sources], output_dir=os.path.join(root, 'out'), jobs=1, cache_dir=cache_dir)
+            hits = sum(1 for result in report.results if result.cached)
+            print(f'  {title:>20}: {report.elapsed * 1e3:,.1f} ms, hits {hits}/{files}')
+        with open(paths[0], 'a', encoding='utf8') as f:
+            f.write('// changed\n')
+        report = translate_files([sources], output_dir=os.path.join(root, 'out'), jobs=1, cache_dir=cache_dir)
+        hits = sum(1 for result in report.results if result.cached)
+        print(f'  {"one file changed":>20}: {report.elapsed * 1e3:,.1f} ms, hits {hits}/{files}')
+
+        # вытеснение: кэш на половину записей
+        cache = translation_cache.TranslationCache(cache_dir)
+        size = sum(entry_size for _, entry_size, _ in cache.entries())
+        cache = translation_cache.TranslationCache(os.path.join(root, 'small'), size // 2)
+        for path in paths:
+            cpp2pas_translator.process_file(path, cache=cache)
+        print(f'  {"cache of half size":>20}: {cache.stats}, entries {len(cache.entries())}')
+
+
+def run_lexer(args):
+    bench_lexer_engines(corpus.generate_functions(args.functions))
+    bench_lexer_stress(generate_whitespace_source())
+    bench_token_stream(corpus.generate_functions(args.functions))
+
+
+def run_literals(args):
+    bench_long_literals(args.literal_sizes)
+
+
+def run_expressions(args):
+    bench_expressions(args.statements, args.depths)
+
+
+def run_dispatch(args):
+    bench_dispatch(args.functions)
+
+
+def run_traversal(args):
+    bench_traversal(args.functions, args.depths)
+
+
+def run_dump(args):
+    bench_dump(args.functions, [500, 1000])
+
+
+def run_symbols(args):
+    bench_symbols([1, 10, 100, 500], args.functions * 5)
+    bench_block_scopes(args.depths)
+
+
+def run_emission(args):
+    bench_emission([100, 500, 1000], [10_000, 100_000])
+    bench_output_memory(args.functions * 10)
+
+
+def run_else(args):
+    bench_else([1000, 10_000], [1000, 3000])
+
+
+def run_instrumentation(args):
+    bench_instrumentation(args.functions)
+
+
+def run_names(args):
+    bench_names(args.functions, args.statements)
+
+
+def run_ast(args):
+    bench_serialized_ast(100_000)
+
+
+def run_cache(args):
+    bench_cache(20, args.functions // 10)
+
+
+def run_incremental(args):
+    bench_incremental(args.incremental_lines)
+
+
+def run_memory(args):
+    for lines in args.lines:
+        bench_memory(lines)
+
+
+def run_allocations(args):
+    for lines in args.lines:
+        bench_allocations(lines)
+
+
+def run_streaming(args):
+    for lines in args.lines:
+        bench_streaming(lines)
+
+
+SUITES = {
+    'lexer': run_lexer,
+    'expressions': run_expressions,
+    'incremental': run_incremental,
+    'dispatch': run_dispatch,
+    'traversal': run_traversal,
+    'dump': run_dump,
+    'symbols': run_symbols,
+    'names': run_names,
+    'emission': run_emission,
+    'else': run_else,
+    'literals': run_literals,
+    'cache': run_cache,
+    'ast': run_ast,
+    'instrumentation': run_instrumentation,
+    'memory': run_memory,
+    'allocations': run_allocations,
+    'streaming': run_streaming,
+}
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Бенчмарки транслятора')
+    arg_parser.add_argument('suites', nargs='*', metavar='suite',
+                            help=f"наборы замеров: {', '.join(SUITES)} (по умолчанию все)")
+    arg_parser.add_argument('--functions', type=int, default=150,
+                            help='число функций в синтетическом исходнике (форма wide из benchmarks.corpus)')
+    arg_parser.add_argument('--lines', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help='размеры синтетических исходников в строках для замеров памяти и потокового чтения')
+    arg_parser.add_argument('--statements', type=int, default=20_000,
+                            help='число операторов в исходнике для замеров разбора выражений')
+    arg_parser.add_argument('--depths', type=int, nargs='+', default=[100, 1000, 10_000, 100_000],
+                            help='глубины вложенности скобок и деревьев для обхода')
+    arg_parser.add_argument('--incremental-lines', type=int, default=50_000,
+                            help='размер исходника в строках для замеров инкрементального разбора')
+    arg_parser.add_argument('--literal-sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                            help='длины строковых литералов, комментариев и идентификаторов')
+    args = arg_parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            arg_parser.error(f"неизвестный набор замеров '{suite}'")
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10_000))
+    for suite in args.suites or SUITES:
+        SUITES[suite](args)
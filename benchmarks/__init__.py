@@ -0,0 +1,2 @@
+from benchmarks.corpus import CorpusGenerator, SHAPES, generate, generate_functions, write_corpus
+from benchmarks.suite import compare, run
@@ -0,0 +1,69 @@
+import argparse
+import json
+import sys
+
+from benchmarks import corpus, suite
+
+
+def command_run(args):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10_000))
+    report = suite.run(args.shapes, args.lines, args.repeat, args.seed, log=print)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'Результаты записаны в {args.output}')
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf8') as f:
+            print('\n'.join(suite.compare(json.load(f), report, args.threshold)))
+
+
+def command_compare(args):
+    with open(args.baseline, 'r', encoding='utf8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf8') as f:
+        current = json.load(f)
+    print('\n'.join(suite.compare(baseline, current, args.threshold)))
+
+
+def command_corpus(args):
+    for path in corpus.write_corpus(args.directory, args.shapes, args.lines, args.files, args.seed):
+        print(path)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                         description='Воспроизводимые замеры транслятора на синтетическом C++')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    def add_corpus_arguments(command):
+        command.add_argument('--shapes', nargs='+', choices=list(corpus.SHAPES), default=list(corpus.SHAPES),
+                             help='формы исходников: wide - много коротких блоков, deep - глубокая '
+                                  'вложенность, expressions - длинные выражения')
+        command.add_argument('--seed', type=int, default=0, help='seed генератора')
+
+    run_command = commands.add_parser('run', help='замерить стадии и сохранить результаты в JSON')
+    add_corpus_arguments(run_command)
+    run_command.add_argument('--lines', type=int, nargs='+', default=[10_000],
+                             help='размеры исходников в строках')
+    run_command.add_argument('--repeat', type=int, default=5, help='число прогонов каждой стадии')
+    run_command.add_argument('-o', '--output', help='файл для результатов в JSON')
+    run_command.add_argument('--baseline', help='JSON прежнего прогона для сравнения')
+    run_command.add_argument('--threshold', type=float, default=0.05,
+                             help='относительное изменение, начиная с которого оно помечается')
+    run_command.set_defaults(func=command_run)
+
+    compare_command = commands.add_parser('compare', help='сравнить два сохранённых прогона')
+    compare_command.add_argument('baseline')
+    compare_command.add_argument('current')
+    compare_command.add_argument('--threshold', type=float, default=0.05)
+    compare_command.set_defaults(func=command_compare)
+
+    corpus_command = commands.add_parser('corpus', help='записать синтетические исходники в каталог')
+    add_corpus_arguments(corpus_command)
+    corpus_command.add_argument('--lines', type=int, default=10_000, help='размер исходников в строках')
+    corpus_command.add_argument('directory')
+    corpus_command.add_argument('--files', type=int, default=1, help='исходников каждой формы')
+    corpus_command.set_defaults(func=command_corpus)
+
+    args = arg_parser.parse_args()
+    args.func(args)
@@ -0,0 +1,146 @@
+import os
+import random
+
+# Формы синтетических исходников: statements - простых операторов в блоке,
+# branches - составных операторов (while/if/if-else) в блоке, depth - глубина их
+# вложенности, terms - операндов в выражении
+SHAPES = {
+    'wide': {'statements': 10, 'branches': 2, 'depth': 2, 'terms': 4},
+    'deep': {'statements': 2, 'branches': 1, 'depth': 60, 'terms': 3},
+    'expressions': {'statements': 6, 'branches': 1, 'depth': 1, 'terms': 60},
+}
+
+GLOBALS = 'int g0, g1;\nfloat g2;\nstring s0;\n'
+MAIN = 'void main()\n{\n    cin >> g0;\n    cout << g0 << g1 << s0;\n}\n'
+_INT_VARS = ('v0', 'v1', 'v2', 'p0', 'g0', 'g1')
+_RELATIONS = ('<', '>', '<=', '>=', '==', '!=')
+_OPERATORS = ('+', '-', '*', '+', '-', '/')
+
+
+class CorpusGenerator:
+    # Детерминированный генератор C++ из подмножества, которое разбирает Parser:
+    # глобальные объявления, функции с параметрами, вложенные while/if/else,
+    # cin/cout, комментарии и длинные выражения. Все имена объявлены, так что
+    # семантический анализ и трансляция проходят целиком. Один и тот же seed и
+    # параметры дают один и тот же текст
+    def __init__(self, seed=0, statements=10, branches=2, depth=2, terms=4):
+        self.random = random.Random(seed)
+        self.statements = statements
+        self.branches = branches
+        self.depth = depth
+        self.terms = terms
+        self._temps = 0
+
+    @classmethod
+    def shape(cls, name, seed=0):
+        return cls(seed, **SHAPES[name])
+
+    def source(self, lines):
+        # программа примерно из lines строк: функции добавляются, пока не наберётся размер
+        parts = [GLOBALS]
+        count = GLOBALS.count('\n') + MAIN.count('\n')
+        n = 0
+        while count < lines:
+            function = self.function(n)
+            parts.append(function)
+            count += function.count('\n')
+            n += 1
+        parts.append(MAIN)
+        return ''.join(parts)
+
+    def program(self, functions):
+        # программа ровно из functions функций
+        return GLOBALS + ''.join(self.function(n) for n in range(functions)) + MAIN
+
+    def function(self, n):
+        lines = [f'void function_{n}(int p0, float p1)', '{',
+                 '    int v0 = 1, v1 = 2, v2;',
+                 '    float f0 = 0.5;']
+        self.block(lines, 1, self.depth)
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def block(self, lines, level, depth):
+        indent = '    ' * level
+        rnd = self.random
+        compound = set(rnd.sample(range(self.statements + self.branches), self.branches)) if depth else set()
+        for i in range(self.statements + (self.branches if depth else 0)):
+            if i not in compound:
+                lines.append(indent + self.statement())
+                continue
+            kind = rnd.choice(('while', 'if', 'if-else'))
+            head = 'while' if kind == 'while' else 'if'
+            lines.append(f'{indent}{head} ({self.condition()}) {{')
+            self.nested_block(lines, level + 1, depth - 1)
+            if kind == 'if-else':
+                # ветка else без вложенных операторов: иначе размер функции рос бы
+                # как 2 ** depth
+                lines.append(indent + '}')
+                lines.append(indent + 'else {')
+                self.nested_block(lines, level + 1, 0)
+            lines.append(indent + '}')
+
+    def nested_block(self, lines, level, depth):
+        # во вложенном блоке своя переменная, видимая только в нём
+        self._temps += 1
+        temp = f't{self._temps}'
+        lines.append(f"{'    ' * level}int {temp} = {self.expression()};")
+        lines.append(f"{'    ' * level}{temp} = {temp} + 1;")
+        self.block(lines, level, depth)
+
+    def statement(self):
+        rnd = self.random
+        kind = rnd.random()
+        if kind < 0.55:
+            return f'{rnd.choice(("v0", "v1", "v2"))} = {self.expression()};'
+        if kind < 0.65:
+            return f'f0 = f0 * {rnd.randint(1, 9)}.5 + p1;'
+        if kind < 0.8:
+            return f"cout << {rnd.choice(_INT_VARS)} << 'value {rnd.randint(0, 999)}' << f0;"
+        if kind < 0.9:
+            return f'cin >> {rnd.choice(("v0", "v1", "v2"))};'
+        return f'// comment {rnd.randint(0, 10 ** 6)}'
+
+    def expression(self, terms=None):
+        rnd = self.random
+        terms = terms or rnd.randint(max(1, self.terms // 2), self.terms)
+        parts = [self.operand()]
+        for _ in range(terms - 1):
+            operand = self.operand()
+            if rnd.random() < 0.15:
+                operand = f'({operand} {rnd.choice(_OPERATORS)} {self.operand()})'
+            parts.append(f'{rnd.choice(_OPERATORS)} {operand}')
+        return ' '.join(parts)
+
+    def operand(self):
+        rnd = self.random
+        return rnd.choice(_INT_VARS) if rnd.random() < 0.7 else str(rnd.randint(0, 100))
+
+    def condition(self):
+        rnd = self.random
+        first = f'({rnd.choice(_INT_VARS)} {rnd.choice(_RELATIONS)} {self.expression(2)})'
+        if rnd.random() < 0.5:
+            return first
+        second = f'({rnd.choice(_INT_VARS)} {rnd.choice(_RELATIONS)} {self.operand()})'
+        return f'{first} {rnd.choice(("&&", "||"))} {second}'
+
+
+def generate(shape='wide', lines=10_000, seed=0):
+    return CorpusGenerator.shape(shape, seed).source(lines)
+
+
+def generate_functions(functions=100, shape='wide', seed=0):
+    return CorpusGenerator.shape(shape, seed).program(functions)
+
+
+def write_corpus(directory, shapes=tuple(SHAPES), lines=10_000, files=1, seed=0):
+    # files исходников каждой формы: <каталог>/<форма>_<номер>.cpp; возвращает пути
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for shape in shapes:
+        for i in range(files):
+            path = os.path.join(directory, f'{shape}_{i}.cpp')
+            with open(path, 'w', encoding='utf8') as f:
+                f.write(generate(shape, lines, seed + i))
+            paths.append(path)
+    return paths
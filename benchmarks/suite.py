@@ -0,0 +1,130 @@
+import datetime
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cpp2pas_translator
+import lexer
+import parser
+import semantic_analyzer
+
+from benchmarks import corpus
+
+STAGES = ('lex', 'parse', 'semantic', 'translate', 'end_to_end')
+
+
+def timings(func, *args, repeat=5):
+    # времена repeat прогонов func(*args) и результат последнего
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def summary(times):
+    ordered = sorted(times)
+    return {'min': ordered[0], 'median': ordered[len(ordered) // 2], 'max': ordered[-1], 'runs': times}
+
+
+def analyze(tree):
+    analyzer = semantic_analyzer.SemanticAnalyzer()
+    analyzer.visit(tree)
+    return analyzer
+
+
+def translate(tree, scopes):
+    translator = cpp2pas_translator.SourceToSourceTranslator(scopes)
+    translator.visit(tree)
+    return translator.output
+
+
+def bench_source(content, repeat=5):
+    # время каждой стадии по отдельности на уже готовом входе предыдущей и всего
+    # process_file на файле с content
+    stages = {}
+    times, tokens = timings(lexer.tokenize, content, repeat=repeat)
+    stages['lex'] = summary(times)
+    times, tree = timings(lambda: parser.Parser(tokens).parse(), repeat=repeat)
+    stages['parse'] = summary(times)
+    times, analyzer = timings(analyze, tree, repeat=repeat)
+    stages['semantic'] = summary(times)
+    times, output = timings(translate, tree, analyzer.scopes, repeat=repeat)
+    stages['translate'] = summary(times)
+    with tempfile.NamedTemporaryFile('w', encoding='utf8', suffix='.cpp', delete=False) as f:
+        f.write(content)
+    try:
+        times, _ = timings(cpp2pas_translator.process_file, f.name, repeat=repeat)
+    finally:
+        os.remove(f.name)
+    stages['end_to_end'] = summary(times)
+    nodes = sum(1 for _, _, node, _ in parser.walk(tree) if isinstance(node, parser.Node))
+    return {
+        'chars': len(content),
+        'lines': content.count('\n'),
+        'tokens': len(tokens) - tokens.names.count(lexer.Token.NEWLINE),
+        'nodes': nodes,
+        'errors': analyzer.error_count,
+        'output_chars': len(output),
+        'stages': stages,
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def run(shapes=tuple(corpus.SHAPES), sizes=(10_000,), repeat=5, seed=0, log=None):
+    # замеры для каждой формы и размера; результат - словарь, который можно
+    # сохранить в JSON и сравнить с другим прогоном через compare
+    results = {}
+    for shape in shapes:
+        for lines in sizes:
+            content = corpus.generate(shape, lines, seed)
+            name = f'{shape}_{lines}'
+            results[name] = dict(bench_source(content, repeat), shape=shape, size=lines)
+            if log is not None:
+                stages = results[name]['stages']
+                log(f'{name:>20}: ' + ', '.join(f'{stage} {stages[stage]["min"] * 1e3:,.1f} ms'
+                                                for stage in STAGES))
+    return {
+        'commit': git_commit(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'recursion_limit': sys.getrecursionlimit(),
+        'seed': seed,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.05):
+    # строки отчёта: отношение минимальных времён стадий current / baseline для
+    # замеров, которые есть в обоих прогонах; изменения больше threshold помечены
+    lines = [f'{baseline.get("commit") or "?"} -> {current.get("commit") or "?"}']
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if base['chars'] != result['chars']:
+            lines.append(f'  {name}: исходники различаются, сравнение пропущено')
+            continue
+        cells = []
+        for stage in STAGES:
+            old, new = base['stages'][stage]['min'], result['stages'][stage]['min']
+            ratio = new / old if old else float('inf')
+            mark = '+' if ratio > 1 + threshold else '-' if ratio < 1 - threshold else ' '
+            cells.append(f'{stage} {ratio:.2f}x{mark}')
+        lines.append(f'  {name:>20}: ' + ', '.join(cells))
+    return lines
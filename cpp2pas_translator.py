@@ -1,10 +1,19 @@
+from __future__ import annotations
+
+import contextlib
+import io
 import re
 import typing
 
+import instrumentation
+import optimizer
 import parser
 import lexer
 import semantic_analyzer as san
 
+if typing.TYPE_CHECKING:
+    import translation_cache
+
 builtins_translate = {'float': 'real',
                       'int': 'integer',
                       'char': 'char',
@@ -17,121 +26,309 @@ operators_translate = {'==': '=',
                        }
 
 
-class SourceToSourceTranslator(san.NodeVisitor):
-    def __init__(self, sym_table_scopes, optimize=False):
+INDENT = '   '
+# разрывы строк, которые кроме '\n' понимает str.splitlines
+_LINE_BREAKS = re.compile('\r\n|[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+# операторы сравнения: после них в Pascal выражение может начинаться со знака
+_COMPARISONS = frozenset(('=', '<', '>', '<=', '>=', '!='))
+
+
+def _starts_negative(node):
+    # выражение начинается с унарного минуса или отрицательного литерала (после
+    # свёртки констант); в Pascal знак не может стоять сразу за '+', '*' и т.п.
+    while isinstance(node, parser.NodeBinaryOperator):
+        node = node.left
+    if type(node) is parser.NodeUnaryMinus:
+        return True
+    return type(node) in (parser.NodeIntLiteral, parser.NodeFloatLiteral) and node.value.value[:1] == '-'
+
+
+# операторы, текст которых - фрагмент [заголовок, блок, ';']
+_BLOCK_STATEMENTS = (parser.NodeIfConstruction, parser.NodeWhileConstruction, parser.NodeElseBlock)
+
+
+class Indented:
+    # Фрагмент content, каждая строка которого при выводе получает отступ INDENT:
+    # '\n'.join(INDENT + line for line in content.splitlines())
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        self.content = content
+
+
+class PascalWriter:
+    # Выводит текст программы, собранный транслятором из фрагментов: строк, списков
+    # фрагментов и Indented. Фрагмент узла только ссылается на фрагменты дочерних,
+    # а отступы расставляются здесь за один проход по счётчику уровня, поэтому
+    # каждая строка пишется в stream один раз, а не копируется на каждом уровне
+    # вложенности
+    _CLOSE = object()
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else io.StringIO()
+
+    def getvalue(self):
+        return self.stream.getvalue()
+
+    def write(self, fragment):
+        # текст фрагмента собирается в список и пишется в stream одним вызовом
+        parts = []
+        write = parts.append
+        close = self._CLOSE
+        # число открытых Indented
+        level = 0
+        # перевод строки и отступ для каждого уровня
+        newlines = ['\n']
+        # сколько последних открытых Indented ещё ничего не вывели: если такой
+        # закроется пустым, отступ для него не нужен
+        pending_starts = 0
+        # перевод строки выводится, только если за ним в том же Indented что-то есть
+        pending_newline = False
+        stack = [fragment]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                if not item:
+                    continue
+                if level and not item.isprintable() and _LINE_BREAKS.search(item):
+                    item = _LINE_BREAKS.sub('\n', item)
+                if pending_newline:
+                    write(newlines[level])
+                elif pending_starts:
+                    write(INDENT * pending_starts)
+                pending_starts = 0
+                # последний перевод строки откладывается, остальные получают отступ
+                # уровня одной заменой, без цикла по строкам
+                pending_newline = item[-1] == '\n'
+                if pending_newline:
+                    item = item[:-1]
+                if level:
+                    item = item.replace('\n', newlines[level])
+                write(item)
+            elif type(item) is list:
+                stack.extend(reversed(item))
+            elif item is close:
+                if pending_starts:
+                    pending_starts -= 1
+                else:
+                    pending_newline = False
+                level -= 1
+            else:
+                if level + 1 == len(newlines):
+                    newlines.append(newlines[-1] + INDENT)
+                content = item.content
+                if type(content) is not str:
+                    level += 1
+                    pending_starts += 1
+                    stack.append(close)
+                    stack.append(content)
+                    continue
+                # Indented из одной строки выводится сразу, без уровня в стеке:
+                # пустая ничего не выводит, у непустой последний перевод строки
+                # отбрасывается при закрытии
+                if not content:
+                    continue
+                if not content.isprintable() and _LINE_BREAKS.search(content):
+                    content = _LINE_BREAKS.sub('\n', content)
+                if pending_newline:
+                    write(newlines[level + 1])
+                    pending_newline = False
+                else:
+                    write(INDENT * (pending_starts + 1))
+                pending_starts = 0
+                if content[-1] == '\n':
+                    content = content[:-1]
+                write(content.replace('\n', newlines[level + 1]))
+        if pending_newline:
+            write('\n')
+        self.stream.write(''.join(parts))
+
+
+class SourceToSourceTranslator(parser.NodeWalker):
+    # Текст узла собирается в leave_* из текстов дочерних элементов; в enter_*
+    # переключаются области видимости и выбираются дочерние элементы в нужном порядке.
+    # Тексты операторов с вложенными блоками - фрагменты для PascalWriter (списки
+    # строк и Indented), остальные - строки
+    # С stream текст программы пишется в этот текстовый поток по мере обхода функций
+    # верхнего уровня (в памяти одновременно только текст одной функции), output
+    # остаётся None; без него весь текст оказывается в output
+    def __init__(self, sym_table_scopes, optimize=False, stream=None):
         self.current_scope = None
         self.output = None
+        self.stream = stream
+        self._writer = None
         self._sym_table_scopes = sym_table_scopes
         self._optimize = optimize
         self.log: typing.List[str]
         self.log = []
+        # заголовки и секции var функций, в которые вошли, но ещё не вышли
+        self._function_headers = []
+        # число функций (и main), в которые вошли, но ещё не вышли
+        self._function_depth = 0
+        # узел NodeVar/NodeID -> имя переменной блока, переименованной анализатором
+        # (VarSymbol.pascal_name)
+        self._renamed = {}
+
+    def generic_leave(self, node, values):
+        return '\n'.join(values)
+
+    def enter_NodeBlock(self, node: parser.NodeBlock):
+        return node.children
+
+    @staticmethod
+    def _join_else(children, values):
+        # if/while/else, за которым следует else, заканчивается 'end' без ';'
+        previous = None
+        for index, (child, content) in enumerate(zip(children, values)):
+            if not content:
+                continue
+            if previous is not None and type(child) is parser.NodeElseBlock:
+                values[previous] = values[previous][:-1]
+            previous = index if isinstance(child, _BLOCK_STATEMENTS) else None
+        return values
+
+    def leave_NodeBlock(self, node: parser.NodeBlock, values):
+        self._join_else(node.children, values)
+
+        # подряд идущие однострочные тексты сдвигаются одним Indented
+        contents = []
+        lines = []
+        for content in values:
+            if content:
+                if type(content) is str and content.isprintable():
+                    lines.append(content)
+                    continue
+                if lines:
+                    contents.append('\n'.join(lines))
+                    lines = []
+                contents.append(content)
+        if lines:
+            contents.append('\n'.join(lines))
+            if len(contents) == 1:
+                # блок только из однострочных операторов - одна строка, отступ
+                # ставится сразу: в ней нет вложенных блоков, которые пришлось бы
+                # сдвигать на каждом уровне
+                return f'begin\n{INDENT}' + contents[0].replace('\n', '\n' + INDENT) + '\nend'
+
+        result = ['begin\n']
+        for content in contents:
+            if len(result) > 1:
+                result.append('\n')
+            result.append(Indented(content))
+        result.append('\nend')
+        return result
+
+    @staticmethod
+    def _program_functions(node):
+        # сначала все функции, кроме main, затем main - тело программы
+        functions = [func for func in node.block
+                     if isinstance(func, parser.NodeFunction) and func.name.value != 'main']
+        for func in node.block:
+            if isinstance(func, parser.NodeFunction) and func.name.value == 'main':
+                functions.append(func)
+                break
+        return functions
 
-    def output_clean(self):
-        # dirty hack, but working
-        self.output = re.sub(r'end;([\s,\n]+)else', r'end\1else', self.output)
-
-    def generic_visit(self, node):
-        if isinstance(node, parser.Node):
-            result = []
-            for field in node._fields:
-                result.append(self.visit(getattr(node, field)))
-            return '\n'.join(result)
-        else:
-            raise Exception('No visit_{} method'.format(type(node).__name__))
-
-    def visit_NodeBlock(self, node: parser.NodeBlock):
-
-        result_str = 'begin\n'
-        results=[]
-        for el in node.children:
-            result = self.visit(el)
-            if result:
-                results.extend(result.splitlines())
-
-        result_str += '\n'.join('   ' + line for line in results)
-        result_str +=  '\nend'
-        return result_str
-
-        # return '\n'.join('   ' + line for line in results)
-
-    def visit_NodeProgram(self, node):
-        program_name = 'translated'
-        result_str = f'program {program_name};\n'
-
+    def enter_NodeProgram(self, node):
         global_scope = self._sym_table_scopes['global']
         self.current_scope = global_scope
 
+        program_name = 'translated'
+        self._writer = PascalWriter(self.stream)
         # looking for variable declaration in main
         self.current_scope = self._sym_table_scopes['main']
-        result_str += self.get_var_section_text()
+        self._writer.write([f'program {program_name};\n', self.get_var_section_text()])
 
         self.current_scope = global_scope
-        # first visit subtree, looking only for nested functions
-        for func in node.block:
-            if isinstance(func, parser.NodeFunction):
-                if func.name.value != 'main':
-                    content = self.visit(func)
-                    if content:
-                        result_str += '\n'.join('   ' + line for line in content.splitlines())
+        # functions except main are written in leave_NodeFunction
+        return self._program_functions(node)
 
-        # second  visit subtree looking for main to make it program body
+    def leave_NodeProgram(self, node, values):
+        program_name = 'translated'
+        functions = self._program_functions(node)
+        has_main = bool(functions) and functions[-1].name.value == 'main'
+
+        # then main as program body
         # result_str += 'begin\n'
-        result_str += '\n'
-        for func in node.block:
-            if isinstance(func, parser.NodeFunction):
-                if func.name.value == 'main':
-                    block = self.visit(func)
-                    if block:
-                        result_str += '\n'.join('' + line for line in block.splitlines())
-                    break
-        result_str += '.'
-        result_str += ' {END OF %s}' % program_name
-        self.output = result_str
+        result = ['\n']
+        if has_main:
+            block = values[-1]
+            if block:
+                result.append(block)
+        result.append('.')
+        result.append(' {END OF %s}' % program_name)
+        self._writer.write(result)
+        if self.stream is None:
+            self.output = self._writer.getvalue()
 
         self.current_scope = self.current_scope.enclosing_scope
 
+    def _var_records(self):
+        # переменные функции вместе с объявленными в её блоках if/while/else:
+        # в Pascal они все попадают в секцию var функции, в порядке объявления
+        records = [record for record in self.current_scope._symbols.values() if isinstance(record, san.VarSymbol)]
+        block_records = []
+        scopes = [nested for nested in self.current_scope.nested_scopes.values() if nested.block]
+        while scopes:
+            scope = scopes.pop()
+            block_records.extend(record for record in scope._symbols.values() if isinstance(record, san.VarSymbol))
+            scopes.extend(nested for nested in scope.nested_scopes.values() if nested.block)
+        if block_records:
+            records.extend(block_records)
+            records.sort(key=lambda record: record.id)
+        return records
+
     def get_var_section_text(self):
         # making var section
         var_str = []
         record: san.VarSymbol
-        for name, record in self.current_scope._symbols.items():
-            if isinstance(record, san.VarSymbol):
-                if self._optimize:
-                    if record.hit_count < 1:
-                        self.log.append(
-                            '*' * 20 + f"removed: Unused variable declaration '{name}'" \
-                            + f" in scope '{self.current_scope.scope_name}' ")
-                    else:
-                        var_str.append(
-                            f'var {record.name}: {builtins_translate.get(record.type.name, record.type.name)};')
-
+        # one var per Pascal name: block variables that share a name and type share it
+        records = {}
+        hit_counts = {}
+        for record in self._var_records():
+            records.setdefault(record.pascal_name, record)
+            hit_counts[record.pascal_name] = hit_counts.get(record.pascal_name, 0) + record.hit_count
+        for name, record in records.items():
+            if self._optimize:
+                if hit_counts[name] < 1:
+                    self.log.append(
+                        '*' * 20 + f"removed: Unused variable declaration '{name}'" \
+                        + f" in scope '{self.current_scope.scope_name}' ")
                 else:
                     var_str.append(
-                        f'var {record.name}: {builtins_translate.get(record.type.name, record.type.name)};')
+                        f'var {name}: {builtins_translate.get(record.type.name, record.type.name)};')
+
+            else:
+                var_str.append(
+                    f'var {name}: {builtins_translate.get(record.type.name, record.type.name)};')
         if var_str:
             return '\n'.join(var_str)
         else:
             return ''
 
-    def visit_main(self, node):
+    @staticmethod
+    def _function_children(node):
+        # вложенные функции, затем операторы тела; операторы выводятся, только если
+        # последний элемент тела - не функция и не объявление
+        children = node.block.children
+        nested = [func for func in children if isinstance(func, parser.NodeFunction)]
+        if children and not isinstance(children[-1], (parser.NodeFunction, parser.NodeDeclaration)):
+            return nested, children
+        return nested, []
+
+    def enter_NodeFunction(self, node: parser.NodeFunction):
+        func_name = node.name.value
         # Scope for parameters and local variables
-        func_name = func_name = node.name.value
         func_scope = self._sym_table_scopes[func_name]
         self.current_scope = func_scope
-        result_str = ''
-        # result_str += self.get_var_section_text()
-        block = self.visit(node.block)
-        if block:
-            result_str = '\n'.join(line for line in block.splitlines())
-        # result_str += '' # ; не нужен перед последним end.
-
-        self.current_scope = self.current_scope.enclosing_scope
-        return result_str
-
-    def visit_NodeFunction(self, node: parser.NodeFunction):
-        func_name = node.name.value
+        self._function_depth += 1
+        for record in self._var_records():
+            if record.references:
+                self._renamed.update(dict.fromkeys(record.references, record.pascal_name))
         if func_name == 'main':
-            return self.visit_main(node)  # special case
+            return (node.block,)  # special case
 
         result_str = '\n'
         ret_type = node.ret_type.value
@@ -140,10 +337,6 @@ class SourceToSourceTranslator(san.NodeVisitor):
         else:
             result_str += f'function {func_name}'
 
-        # Scope for parameters and local variables
-        func_scope = self._sym_table_scopes[func_name]
-        self.current_scope = func_scope
-
         # function/procedure formal parameters
         result_str += '('
         if node.formal_params.params:
@@ -164,53 +357,82 @@ class SourceToSourceTranslator(san.NodeVisitor):
         result_str += '\n'
         # filling var section
         result_str += self.get_var_section_text()
+        self._function_headers.append(result_str)
 
-        # first visit subtree, looking only for nested functions
-        for func in node.block.children:
-            if isinstance(func, parser.NodeFunction):
-                content = self.visit(func)
-                if content:
-                    result_str += '\n'.join('   ' + line for line in content.splitlines())
-                result_str += '\n'
+        nested, body = self._function_children(node)
+        return nested + body
 
-        result_str += 'begin\n'
-        for non_func in node.block.children:
+    def leave_NodeFunction(self, node: parser.NodeFunction, values):
+        func_name = node.name.value
+        self._function_depth -= 1
+        if func_name == 'main':
+            # текст блока не заканчивается переводом строки, и splitlines его не меняет
+            result = values[0]
+            # result_str += '' # ; не нужен перед последним end.
 
-            if (not isinstance(func, parser.NodeFunction)) and (not isinstance(func, parser.NodeDeclaration)):
-                content = self.visit(non_func)
-                if content:
-                    result_str += '\n'.join('   ' + line for line in content.splitlines())
+            self.current_scope = self.current_scope.enclosing_scope
+            return result
 
-        result_str += '\nend'
-        result_str += f'; {{END OF {func_name}}}'
-        result_str += '\n'
+        result = [self._function_headers.pop()]
+        nested, _ = self._function_children(node)
+
+        # first nested functions
+        for content in values[:len(nested)]:
+            if content:
+                result.append(Indented(content))
+            result.append('\n')
+
+        result.append('begin\n')
+        for content in self._join_else(node.block.children, values[len(nested):]):
+            if content:
+                result.append(Indented(content))
+
+        result.append('\nend')
+        result.append(f'; {{END OF {func_name}}}')
+        result.append('\n')
 
         # indent function text
         # result_str = '\n'.join('   ' + line for line in result_str.splitlines())
 
         self.current_scope = self.current_scope.enclosing_scope
 
-        return result_str
+        if not self._function_depth:
+            # top-level function goes to the output right away
+            self._writer.write(Indented(result))
+            return None
+        return result
 
-    def visit_NodeDeclaration(self, node):
+    enter_NodeDeclaration = parser.NodeWalker.skip_children
+
+    def leave_NodeDeclaration(self, node, values):
 
         return None  # no need to something special, all check must be made in semantic analyzer
 
-    def visit_NodeAssigning(self, node):
-        t2 = self.visit(node.right_side)
-        t1 = self.visit(node.left_side)
+    enter_NodeAssigning = parser.EnterFields('right_side', 'left_side')
+
+    def leave_NodeAssigning(self, node, values):
+        t2, t1 = values
         return '%s %s %s;' % (t1, ':=', t2)
 
-    def visit_NodeBinaryOperator(self, node: parser.NodeBinaryOperator):
-        t1 = self.visit(node.left)
-        t2 = self.visit(node.right)
+    enter_NodeBinaryOperator = parser.EnterFields('left', 'right')
+
+    def leave_NodeBinaryOperator(self, node: parser.NodeBinaryOperator, values):
+        t1, t2 = values
         op = operators_translate.get(node.op.value, node.op.value)
+        if op not in _COMPARISONS and _starts_negative(node.right):
+            # 'x - (-5)', а не 'x - -5'
+            t2 = f'({t2})'
         if op in {'and', 'or', '=', '<', '>', '<=', '>='}:
             return '(%s %s %s)' % (t1, op, t2)
         else:
             return '%s %s %s' % (t1, op, t2)
 
-    def visit_NodeIfConstruction(self, node: parser.NodeIfConstruction):
+    def leave_NodeUnaryMinus(self, node, values):
+        if isinstance(node.operand, parser.NodeBinaryOperator):
+            return f'-({values[0]})'
+        return f'-{values[0]}'
+
+    def leave_NodeIfConstruction(self, node: parser.NodeIfConstruction, values):
         match node.__class__:
             case parser.NodeIfConstruction:
                 op = 'if'
@@ -224,79 +446,205 @@ class SourceToSourceTranslator(san.NodeVisitor):
         if op == 'else':
             condition = ''
         else:
-            condition = self.visit(node.condition)
-        result_str = f'{op} {condition} {block_begin}\n'
+            condition = values[0]
+        result = [f'{op} {condition} {block_begin}\n']
 
-        block = self.visit(node.block)
+        # текст блока не заканчивается переводом строки, и splitlines его не меняет
+        block = values[-1]
+        if type(block) is str:
+            return f'{result[0]}{block};'
         if block:
-            result_str += '\n'.join('' + line for line in block.splitlines())
+            result.append(block)
         # block = self.visit(node.block)
         # result_str += block + ';'
-        result_str += ';'
-        return result_str
-
-    visit_NodeWhileConstruction = visit_NodeIfConstruction
-    visit_NodeElseBlock = visit_NodeIfConstruction
-
-    def visit_NodeVar(self, node):
-        return f'{node.name.value}'
-
-        var_name = node.name.value
-        var_symbol = self.current_scope.lookup(var_name)
-        if var_symbol is None:
-            raise Exception(
-                "Error: Symbol(identifier) not found '%s'" % var_name
-            )
-        scope_level = str(var_symbol.scope.scope_level)
-        return '<%s:%s>' % (var_name + scope_level, var_symbol.type.name)
+        result.append(';')
+        return result
+
+    leave_NodeWhileConstruction = leave_NodeIfConstruction
+
+    @staticmethod
+    def _is_else_if(node):
+        # else, блок которого - только if и, возможно, его else
+        children = node.block.children
+        return (0 < len(children) <= 2 and type(children[0]) is parser.NodeIfConstruction
+                and (len(children) == 1 or type(children[1]) is parser.NodeElseBlock))
+
+    def enter_NodeElseBlock(self, node: parser.NodeElseBlock):
+        if self._is_else_if(node):
+            return node.block.children
+        return None
+
+    def leave_NodeElseBlock(self, node: parser.NodeElseBlock, values):
+        if not self._is_else_if(node):
+            return self.leave_NodeIfConstruction(node, values)
+        # цепочка else if выводится без begin/end и нового уровня отступа: её
+        # текст растёт линейно с длиной цепочки, а не квадратично
+        self._join_else(node.block.children, values)
+        result = ['else ', values[0]]
+        if len(values) > 1:
+            result.append('\n')
+            result.append(values[1])
+        return result
+
+    enter_NodeVar = parser.NodeWalker.skip_children
+
+    def leave_NodeVar(self, node, values):
+        return self._renamed.get(node) or node.name.value
 
     # visit_NodeFunctionCall = visit_NodeVar
 
-    def visit_NodeCin(self, node: parser.NodeCin):
-        var_name = node.variables[0].name.value
+    enter_NodeCin = parser.NodeWalker.skip_children
+
+    def leave_NodeCin(self, node: parser.NodeCin, values):
+        var = node.variables[0]
+        var_name = self._renamed.get(var) or var.name.value
         return f'readln({var_name});'
 
-    def visit_NodeCout(self, node: parser.NodeCout):
+    def enter_NodeCout(self, node: parser.NodeCout):
         result = []
         for el in node.variables:
             if isinstance(el, parser.NodeID):
-                result.append(self.visit(el.name))
+                if el in self._renamed:
+                    result.append(lexer.Token(el.name.name, self._renamed[el], el.name.lineno, el.name.pos))
+                else:
+                    result.append(el.name)
             else:
-                result.append(self.visit(el.value))
-        return f'writeln({", ".join(result)});'
+                result.append(el.value)
+        return result
+
+    def leave_NodeCout(self, node: parser.NodeCout, values):
+        return f'writeln({", ".join(values)});'
         # return f'writeln({", ".join(el.name.value for el in node.variables)});'
 
-    def visit_NodeReturnStatement(self, node: parser.NodeReturnStatement):
-        return f'Exit({self.visit(node.expression)});'
+    enter_NodeReturnStatement = parser.EnterFields('expression')
 
-    def visit_NodeComment(self, node: parser.NodeComment):
+    def leave_NodeReturnStatement(self, node: parser.NodeReturnStatement, values):
+        return f'Exit({values[0]});'
+
+    enter_NodeComment = parser.NodeWalker.skip_children
+
+    def leave_NodeComment(self, node: parser.NodeComment, values):
         return f"{{{node.comment.value}}}"
 
-    def visit_list(self, node):
-        result = []
-        for el in node:
-            text = self.visit(el);
-            if text:
-                result.append(text)
-        return '\n'.join(result)
+    def leave_list(self, node, values):
+        return '\n'.join(text for text in values if text)
 
-    def visit_Token(selfself, node: lexer.Token):
+    def leave_Token(selfself, node: lexer.Token, values):
         # print(node)
         if node.name in {lexer.Token.STRING_LITERAL_1, lexer.Token.STRING_LITERAL_2}:
             return f"'{node.value}'"
         return f'{node.value}'
 
 
-def process_file(filename, *, verbose=False, optimize=True) -> SourceToSourceTranslator:
-    with open(filename, 'r', encoding='utf8') as f:
-        parser_obj = parser.Parser(lexer.Lexer(f.read()))
-        tree = parser_obj.parse()
-        semantic_analyzer = san.SemanticAnalyzer(verbose=verbose)
+def fold_constants(tree, source_translator, semantic_analyzer):
+    # свёртка констант и удаление мёртвых ветвей до трансляции; строки об удалённом
+    # попадают в журнал оптимизации транслятора
+    folder = optimizer.ConstantFolder()
+    folder.visit(tree)
+    source_translator.log.extend(folder.log)
+    source_translator.log.append(str(folder))
+    if folder.removed:
+        # обращения к переменным из удалённого кода остались в hit_count, и такие
+        # переменные попали бы в секции var: анализ повторяется по оптимизированному
+        # дереву (только если что-то удалено). Ошибки, которых не было в исходном
+        # дереве, - ошибки оптимизации, они добавляются к ошибкам semantic_analyzer
+        analyzer = san.SemanticAnalyzer()
+        analyzer.visit(tree)
+        for error in analyzer.errors:
+            if error not in semantic_analyzer.errors:
+                semantic_analyzer.error_count += 1
+                semantic_analyzer.errors.append(error)
+        source_translator._sym_table_scopes = analyzer.scopes
+    return folder
+
+
+def translate_source(file, *, verbose=False, optimize=True, output=None, stats=None):
+    if stats is not None:
+        return _translate_source_instrumented(file, stats, verbose=verbose, optimize=optimize, output=output)
+    parser_obj = parser.Parser(lexer.Lexer.from_file(file))
+    tree = parser_obj.parse()
+    semantic_analyzer = san.SemanticAnalyzer(verbose=verbose)
+    semantic_analyzer.visit(tree)
+    source_translator = SourceToSourceTranslator(semantic_analyzer.scopes, optimize=optimize, stream=output)
+    if optimize:
+        fold_constants(tree, source_translator, semantic_analyzer)
+    source_translator.visit(tree)
+    return source_translator, semantic_analyzer
+
+
+def _translate_source_instrumented(file, stats, *, verbose, optimize, output):
+    # тот же конвейер, но потоковый лексер (Lexer.from_file, как в translate_source)
+    # читает весь исходник отдельной стадией, чтобы её время не смешивалось с разбором,
+    # а таблица символов и обходчики считают обращения
+    with stats.stage('lex'):
+        tokens = lexer.RecordedTokens(lexer.Lexer.from_file(file))
+    stats.tokens += len(tokens)
+    stats.lines += tokens.lines
+    with stats.stage('parse'):
+        tree = parser.Parser(tokens).parse()
+    semantic_analyzer = san.SemanticAnalyzer(verbose=verbose)
+    if stats.counters:
+        stats.count_nodes(tree)
+        semantic_analyzer.symbols = instrumentation.InstrumentedSymbolTable(stats)
+        semantic_analyzer.visit_counts = {}
+    with stats.stage('semantic'):
         semantic_analyzer.visit(tree)
-        source_translator = SourceToSourceTranslator(semantic_analyzer.scopes, optimize=optimize)
+    stream = instrumentation.CountingStream(output) if output is not None else None
+    source_translator = SourceToSourceTranslator(semantic_analyzer.scopes, optimize=optimize, stream=stream)
+    if stats.counters:
+        stats.add_visits('semantic', semantic_analyzer.visit_counts)
+        source_translator.visit_counts = {}
+    if optimize:
+        with stats.stage('optimize'):
+            folder = fold_constants(tree, source_translator, semantic_analyzer)
+        stats.folded += folder.folded
+        stats.removed_nodes += folder.removed
+    with stats.stage('translate'):
         source_translator.visit(tree)
-        source_translator.output_clean()
-        return source_translator, semantic_analyzer
+    if stats.counters:
+        stats.add_visits('translate', source_translator.visit_counts)
+    stats.output_bytes += stream.bytes if stream is not None else len(source_translator.output.encode('utf8'))
+    return source_translator, semantic_analyzer
+
+
+def process_file(filename, *, verbose=False, optimize=True, output=None, cache=None,
+                 stats=None) -> tuple[SourceToSourceTranslator | translation_cache.CachedTranslation,
+                                      san.SemanticAnalyzer | translation_cache.CachedTranslation]:
+    # Возвращает пару (транслятор, анализатор). Из них гарантированно есть только
+    # output и log у первого и errors и error_count у второго: при попадании в cache
+    # оба элемента пары - одна и та же запись translation_cache.CachedTranslation без
+    # таблиц символов и дерева.
+    # output - текстовый поток, в который транслятор пишет программу по мере обхода.
+    # cache - translation_cache.TranslationCache: при промахе результат сохраняется,
+    # а в output программа пишется уже целиком.
+    # stats - instrumentation.PipelineStats, в который собираются время стадий и счётчики
+    if cache is None:
+        with open(filename, 'r', encoding='utf8') as f:
+            return translate_source(f, verbose=verbose, optimize=optimize, output=output, stats=stats)
+
+    with contextlib.nullcontext() if stats is None else stats.stage('cache'):
+        with open(filename, 'rb') as f:
+            source = f.read()
+        key = cache.key(source, optimize=optimize, verbose=verbose)
+        cached = cache.get(key)
+    if cached is None:
+        # те же переводы строк, что при чтении в текстовом режиме
+        with io.TextIOWrapper(io.BytesIO(source), encoding='utf8') as f:
+            source_translator, semantic_analyzer = translate_source(f, verbose=verbose, optimize=optimize,
+                                                                    stats=stats)
+        with contextlib.nullcontext() if stats is None else stats.stage('cache'):
+            cache.put(key, source_translator.output, semantic_analyzer.errors, source_translator.log)
+    else:
+        source_translator = semantic_analyzer = cached
+        if stats is not None:
+            stats.lines += len(source.splitlines())
+            stats.output_bytes += len(cached.output.encode('utf8'))
+        if verbose:
+            for error in cached.errors:
+                print(error)
+    if output is not None:
+        output.write(source_translator.output)
+    return source_translator, semantic_analyzer
 
 
 if __name__ == '__main__':
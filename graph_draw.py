@@ -1,25 +1,27 @@
 from graphviz import Digraph
-from lexer import Lexer, Token
-from parser import Parser, iter_child_nodes
+from lexer import Token, tokenize
+from parser import Parser, walk
 import ast
 # Create a Graphviz Digraph object
 dot = Digraph()
 
-# Define a function to recursively add nodes to the Digraph
+# Define a function to add the node and all its descendants to the Digraph
+# (explicit-stack traversal, so deep trees don't hit the recursion limit)
 def add_node(node, field_name, parent=None):
-    if isinstance(node, Token):
-        node_name = f'{field_name}:\n {node}'
-    else:
-        node_name = f'{field_name}:\n {node.__class__.__name__}'
-    dot.node(str(id(node)), node_name)
-    if parent:
-        dot.edge(str(id(parent)), str(id(node)))
-    for field_name, child in iter_child_nodes(node):
-        add_node(child, field_name, node)
+    for _, field_name, node, node_parent in walk(node, field_name):
+        if isinstance(node, Token):
+            node_name = f'{field_name}:\n {node}'
+        else:
+            node_name = f'{field_name}:\n {node.__class__.__name__}'
+        dot.node(str(id(node)), node_name)
+        if node_parent is None:
+            node_parent = parent
+        if node_parent is not None:
+            dot.edge(str(id(node_parent)), str(id(node)))
 
 
 with open("file.cpp", 'r', encoding='utf8') as f:
-    pars = Parser(Lexer(f.read()))
+    pars = Parser(tokenize(f.read()))
 
 tree = pars.parse()
 
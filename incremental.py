@@ -0,0 +1,90 @@
+import bisect
+
+from lexer import Token, tokenize
+from parser import Node, NodeProgram, Parser, iter_child_nodes
+
+
+class IncrementalDocument:
+    # Исходник, его поток токенов и AST, которые обновляются после правки текста:
+    # заново лексируется только повреждённый участок (TokenStream.edit), а заново
+    # разбираются только затронутые им операторы верхнего уровня (функции,
+    # объявления), остальные узлы NodeProgram переиспользуются
+    def __init__(self, content):
+        self.content = content
+        self.tokens = tokenize(content)
+        # для каждого оператора верхнего уровня - полуинтервал индексов его токенов
+        self.spans = []
+        statements, _ = self.__parse_statements(0, self.spans)
+        self.tree = NodeProgram(statements)
+
+    def __parse_statements(self, index, spans, reusable=None):
+        # разбирает операторы верхнего уровня, начиная с токена index, пока не дойдёт
+        # до начала оператора из reusable; возвращает разобранные операторы и индекс
+        # токена, на котором остановился (None, если дошёл до конца файла)
+        reader = self.tokens.reader(skip_newlines=True)
+        reader.index = index
+        parser = Parser(reader)
+        parser.next_token()
+        if index == 0 and parser.token.name == Token.EOF:
+            parser.error("Пустой файл!")
+        statements = []
+        while parser.token.name != Token.EOF:
+            begin = reader.index - 1
+            if reusable and begin in reusable:
+                return statements, begin
+            statement = parser.program_statement()
+            if statement:
+                statements.append(statement)
+                # на EOF reader.index не сдвигается дальше, текущий токен - он сам
+                end = reader.index if parser.token.name == Token.EOF else reader.index - 1
+                spans.append((begin, end))
+        return statements, None
+
+    def edit(self, offset, removed, inserted) -> NodeProgram:
+        tokens, first, old_end, new_end = self.tokens.edit(offset, removed, inserted)
+        index_delta = new_end - old_end
+
+        # операторы, целиком лежащие до повреждённых токенов, не меняются
+        kept = bisect.bisect_right([end for _, end in self.spans], first)
+        restart = self.spans[kept - 1][1] if kept else 0
+        # операторы целиком после повреждённых токенов переиспользуются, если разбор
+        # дойдёт ровно до начала одного из них (с учётом сдвига индексов)
+        reusable = {begin + index_delta: number for number, (begin, _) in enumerate(self.spans)
+                    if begin >= old_end}
+
+        old_tokens, self.tokens = self.tokens, tokens
+        spans = self.spans[:kept]
+        try:
+            parsed, stop = self.__parse_statements(restart, spans, reusable)
+        except RuntimeError:
+            self.tokens = old_tokens
+            raise
+        statements = self.tree.block[:kept] + parsed
+
+        if stop is not None:
+            number = reusable[stop]
+            line_delta = tokens.lines[-1] - old_tokens.lines[-1]
+            for statement, (begin, end) in zip(self.tree.block[number:], self.spans[number:]):
+                if line_delta:
+                    shift_lines(statement, line_delta)
+                statements.append(statement)
+                spans.append((begin + index_delta, end + index_delta))
+
+        self.content = tokens.content
+        self.spans = spans
+        self.tree = NodeProgram(statements)
+        return self.tree
+
+
+def shift_lines(node: Node, line_delta):
+    # сдвигает номера строк всех токенов поддерева, общие токены - один раз
+    seen = set()
+    stack = [node]
+    while stack:
+        for _, child in iter_child_nodes(stack.pop()):
+            if isinstance(child, Token):
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    child.lineno += line_delta
+            else:
+                stack.append(child)
@@ -0,0 +1,159 @@
+import contextlib
+import json
+import time
+
+import parser
+import semantic_analyzer
+
+
+class StageStats:
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+
+    def as_dict(self):
+        return {'wall': self.wall, 'cpu': self.cpu, 'calls': self.calls}
+
+
+class PipelineStats:
+    # Счётчики одного прогона конвейера lex -> parse -> семантика -> трансляция:
+    # время стадий (настенное и процессорное), число токенов и узлов AST, обращения
+    # к таблице символов, входы обходчиков в узлы каждого типа и размер результата.
+    # Заполняется, если передать его в cpp2pas_translator.process_file(stats=...);
+    # без него конвейер ничего не считает. С counters=False считаются только время
+    # стадий, строки исходника и размер результата: анализатор и транслятор обходят
+    # дерево без счётчиков, с той же скоростью, что и без stats
+    def __init__(self, counters=True):
+        self.counters = counters
+        self.stages = {}
+        self.lines = 0
+        self.tokens = 0
+        self.nodes = 0
+        self.node_types = {}
+        self.symbol_lookups = 0
+        self.symbol_misses = 0
+        # суммарная и наибольшая длина цепочки видимых объявлений искомого имени
+        self.lookup_chain_total = 0
+        self.lookup_chain_max = 0
+        # стадия -> {тип элемента AST: число входов обходчика}
+        self.visits = {}
+        # свёрнутые операции и удалённые узлы AST (optimizer.ConstantFolder)
+        self.folded = 0
+        self.removed_nodes = 0
+        self.output_bytes = 0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageStats()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall += time.perf_counter() - wall
+            stage.cpu += time.process_time() - cpu
+            stage.calls += 1
+
+    @property
+    def wall(self):
+        return sum(stage.wall for stage in self.stages.values())
+
+    @property
+    def cpu(self):
+        return sum(stage.cpu for stage in self.stages.values())
+
+    @property
+    def mean_lookup_chain(self):
+        return self.lookup_chain_total / self.symbol_lookups if self.symbol_lookups else 0.0
+
+    def count_nodes(self, tree):
+        node_types = self.node_types
+        for _, _, node, _ in parser.walk(tree):
+            if isinstance(node, parser.Node):
+                name = type(node).__name__
+                node_types[name] = node_types.get(name, 0) + 1
+                self.nodes += 1
+
+    def add_visits(self, stage, visit_counts):
+        visits = self.visits.setdefault(stage, {})
+        for node_type, count in visit_counts.items():
+            visits[node_type.__name__] = visits.get(node_type.__name__, 0) + count
+
+    def as_dict(self):
+        return {
+            'stages': {name: stage.as_dict() for name, stage in self.stages.items()},
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'lines': self.lines,
+            'tokens': self.tokens,
+            'nodes': self.nodes,
+            'node_types': self.node_types,
+            'symbol_lookups': self.symbol_lookups,
+            'symbol_misses': self.symbol_misses,
+            'lookup_chain_mean': self.mean_lookup_chain,
+            'lookup_chain_max': self.lookup_chain_max,
+            'visits': self.visits,
+            'folded': self.folded,
+            'removed_nodes': self.removed_nodes,
+            'output_bytes': self.output_bytes,
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.as_dict(), ensure_ascii=False, indent=indent)
+
+    def dump_json(self, file):
+        # file - путь или текстовый поток
+        if hasattr(file, 'write'):
+            file.write(self.to_json())
+            return
+        with open(file, 'w', encoding='utf8') as f:
+            f.write(self.to_json())
+
+    def __str__(self):
+        wall = self.wall
+        lines = [f'Время: {wall:.3f} s (CPU {self.cpu:.3f} s)']
+        for name, stage in self.stages.items():
+            share = stage.wall / wall * 100 if wall else 0.0
+            lines.append(f'  {name:>9}: {stage.wall:.3f} s, CPU {stage.cpu:.3f} s ({share:.1f}%)')
+        lines.append(f'Строк: {self.lines}, токенов: {self.tokens}, узлов AST: {self.nodes}, '
+                     f'результат: {self.output_bytes} байт')
+        lines.append(f'Поиск имён: {self.symbol_lookups} (не найдено {self.symbol_misses}), '
+                     f'цепочка в среднем {self.mean_lookup_chain:.2f}, не длиннее {self.lookup_chain_max}')
+        if self.folded or self.removed_nodes:
+            lines.append(f'Оптимизация: свёрнуто операций {self.folded}, удалено узлов {self.removed_nodes}')
+        for stage, visits in self.visits.items():
+            lines.append(f'Обход {stage}: {sum(visits.values())} входов в узлы')
+        return '\n'.join(lines)
+
+
+class InstrumentedSymbolTable(semantic_analyzer.SymbolTable):
+    # SymbolTable, считающая поиски имён в stats; длина цепочки - число видимых
+    # объявлений имени во вложенных областях (стек в _bindings)
+    def __init__(self, stats: PipelineStats):
+        super().__init__()
+        self.stats = stats
+
+    def lookup(self, name, current_scope_only=False, count=False):
+        stats = self.stats
+        stats.symbol_lookups += 1
+        chain = len(self._bindings.get(name, ()))
+        stats.lookup_chain_total += chain
+        if chain > stats.lookup_chain_max:
+            stats.lookup_chain_max = chain
+        symbol = super().lookup(name, current_scope_only, count)
+        if symbol is None:
+            stats.symbol_misses += 1
+        return symbol
+
+
+class CountingStream:
+    # текстовый поток-обёртка, считающий байты записанного текста в UTF-8
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode('utf8'))
+        return self.stream.write(text)
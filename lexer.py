@@ -1,4 +1,13 @@
+from __future__ import annotations
+
+import bisect
+import codecs
+import collections
+import io
+import re
+import string
 import sys
+from array import array
 
 
 class Token:
@@ -24,6 +33,7 @@ class Token:
         DL: "DL '<<'",
         DG: "DG '>>'",
         EQ: "EQ '=='",
+        NEQ: "NEQ '!='",
         PLUS: "PLUS '+'",
         MINUS: "MINUS '-'",
         ASTERISK: "ASTERISK '*'",
@@ -71,33 +81,264 @@ class Token:
         'const': CONST,
     }
 
-    def __init__(self, token, value, lineno, pos):
+    # Значение хранится в _value; у ленивого токена (start >= 0) там лежит исходник,
+    # а значение комментария или строки, начинающихся в content[start], вырезается
+    # при первом обращении к value
+    __slots__ = ('name', 'lineno', 'pos', '_value', '_start')
+
+    def __init__(self, token, value, lineno, pos, start=-1):
         self.name = token
-        self.value = value
+        self._value = value
         self.lineno = lineno
         self.pos = pos
+        self._start = start
+
+    @property
+    def value(self):
+        if self._start < 0:
+            return self._value
+        value = self._value = _scan_value(self._value, self.name, self._start)
+        self._start = -1
+        return value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._start = -1
+
+    def __reduce__(self):
+        # без ссылки на весь исходник
+        return Token, (self.name, self.value, self.lineno, self.pos)
 
     def __repr__(self):
         return f'({self.token_names[self.name]}, {self.value}, ({self.lineno}, {self.pos}))'
 
 
+# Движок 'table': вид токена определяется по первому символу через таблицу _FIRST_CHAR,
+# границы идентификаторов, чисел, строк и комментариев ищутся регулярками и str.find
+_SCAN_OPERATOR, _SCAN_PAIR, _SCAN_ID, _SCAN_NUMBER, _SCAN_STRING, _SCAN_SLASH, _SCAN_NEWLINE = range(7)
+
+_FIRST_CHAR = {char: _SCAN_OPERATOR for char in '+-*%(){}[];,'}
+_FIRST_CHAR.update({char: _SCAN_PAIR for char in '=<>!&|'})
+_FIRST_CHAR.update({char: _SCAN_ID for char in string.ascii_letters + '_'})
+_FIRST_CHAR.update({char: _SCAN_NUMBER for char in string.digits})
+_FIRST_CHAR.update({'"': _SCAN_STRING, "'": _SCAN_STRING, '/': _SCAN_SLASH, '\n': _SCAN_NEWLINE})
+
+_WHITESPACE_PATTERN = re.compile(r'[ \t]+')
+_ID_PATTERN = re.compile(r'[^\W\d]\w*')
+_NUMBER_PATTERN = re.compile(r'\d+(\.\d*)?')
+
+# Движок 'iterative': односимвольные операторы и состояния автомата по первому символу
+_SINGLE_CHAR_OPERATORS = frozenset('+-*%(){}[];,')
+_START_STATES = {
+    '/': Token.SLASH,
+    '=': Token.ASSIGN,
+    '<': Token.L,
+    '>': Token.G,
+    '&': Token.AND,
+    '|': Token.OR,
+    '!': Token.NEQ,
+    '"': Token.STRING_LITERAL_1,
+    "'": Token.STRING_LITERAL_2,
+}
+
+_OPERATORS = {
+    '+': Token.PLUS,
+    '-': Token.MINUS,
+    '*': Token.ASTERISK,
+    '/': Token.SLASH,
+    '%': Token.PERCENT,
+    '(': Token.LBR,
+    ')': Token.RBR,
+    '{': Token.LCBR,
+    '}': Token.RCBR,
+    '[': Token.LSBR,
+    ']': Token.RSBR,
+    ';': Token.SEMI,
+    ',': Token.COMMA,
+    '=': Token.ASSIGN,
+    '<': Token.L,
+    '>': Token.G,
+    '&': Token.LINK,
+    '<<': Token.DL,
+    '>>': Token.DG,
+    '<=': Token.LE,
+    '>=': Token.GE,
+    '==': Token.EQ,
+    '!=': Token.NEQ,
+    '&&': Token.AND,
+    '||': Token.OR,
+    '/*': Token.COMMENTSTART,
+}
+
+# на сколько позиция токена левее позиции чтения лексера сразу после него
+_POS_SHIFT = [0] * (Token.NEWLINE + 1)
+for _name in (Token.ID, Token.INT_LITERAL, Token.FLOAT_LITERAL, Token.DSLASH, *Token.KEYWORDS.values()):
+    _POS_SHIFT[_name] = 1
+_POS_SHIFT[Token.STRING_LITERAL_1] = _POS_SHIFT[Token.STRING_LITERAL_2] = 2
+_POS_SHIFT = tuple(_POS_SHIFT)
+
+
+# значения токенов, которые всегда пишутся одинаково: одна общая строка на вид токена
+_FIXED_VALUES = [None] * (Token.NEWLINE + 1)
+for _text, _name in (*_OPERATORS.items(), *Token.KEYWORDS.items()):
+    _FIXED_VALUES[_name] = sys.intern(_text)
+_FIXED_VALUES[Token.NEWLINE] = sys.intern('\\n')
+_FIXED_VALUES[Token.EOF] = ''
+_FIXED_VALUES = tuple(_FIXED_VALUES)
+
+# вид токена ключевого слова по его номеру в NameTable
+_KEYWORD_KINDS = tuple(Token.KEYWORDS.values())
+_KEYWORD_COUNT = len(_KEYWORD_KINDS)
+
+
+class NameTable:
+    # Имена одной единицы трансляции: каждое ключевое слово и идентификатор хранится
+    # одной строкой, общей для всех его вхождений, и получает плотный номер.
+    # Ключевые слова занимают первые номера, поэтому один поиск в словаре и находит
+    # общую строку, и отличает ключевое слово от идентификатора
+    def __init__(self):
+        self.names = list(Token.KEYWORDS)
+        self.ids = {name: name_id for name_id, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, name_id):
+        return self.names[name_id]
+
+    def intern(self, name) -> int:
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def kind(self, name_id):
+        # вид токена: ключевое слово или Token.ID
+        return _KEYWORD_KINDS[name_id] if name_id < len(_KEYWORD_KINDS) else Token.ID
+
+
+def _token_value(content, name, start, end):
+    value = _FIXED_VALUES[name]
+    if value is None:
+        if name == Token.STRING_LITERAL_1 or name == Token.STRING_LITERAL_2:
+            return content[start + 1:end - 1]
+        if name == Token.DSLASH:
+            return content[start + 2:end]
+        value = content[start:end]
+    return value
+
+
+# значения, которые вырезаются из исходника только при обращении: текст комментариев
+# парсер не читает, а строковые литералы бывают длинными. Идентификаторы и числа
+# парсер читает сразу, для них отложенное значение означало бы лишний поиск конца
+_LAZY_VALUES = frozenset((Token.STRING_LITERAL_1, Token.STRING_LITERAL_2, Token.DSLASH))
+
+
+def _scan_value(content, name, start):
+    # значение комментария или строкового литерала, начинающегося в content[start]
+    if name == Token.DSLASH:
+        end = content.find('\n', start)
+        return content[start + 2:end] if end >= 0 else content[start + 2:]
+    return content[start + 1:content.index(content[start], start + 1)]
+
+
+def _span_token(content, name, start, end, lineno, pos):
+    # Token для content[start:end]: постоянное значение берётся из _FIXED_VALUES,
+    # значения из _LAZY_VALUES вырезаются только при обращении к value
+    value = _FIXED_VALUES[name]
+    if value is not None:
+        return Token(name, value, lineno, pos)
+    if name in _LAZY_VALUES:
+        return Token(name, content, lineno, pos, start)
+    return Token(name, content[start:end], lineno, pos)
+
 
 class Lexer:
-    def __init__(self, content):
+    # 'fsm'   - посимвольный конечный автомат (get_next_token)
+    # 'table' - таблица переходов по первому символу токена (_FIRST_CHAR)
+    # 'iterative' - тот же автомат, что и 'fsm', но без рекурсии
+    ENGINES = ('fsm', 'table', 'iterative')
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, content, engine='fsm', name_table=None):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown lexer engine '{engine}', expected one of {self.ENGINES}")
         self.content = content
+        # общие строки и номера идентификаторов; номер последнего прочитанного -
+        # self.name_id
+        self.name_table = name_table if name_table is not None else NameTable()
+        self._name_ids = self.name_table.ids
+        self.name_id = 0
         self.cursor = 0
         self.lineno = 1
         self.pos = 1
         self.state = None
         self.char = None
         self.length = len(content)-1
+        self.engine = engine
+        # номер строки и индекс её начала для позиции self.cursor (движок 'table')
+        self._line = 1
+        self._line_start = 0
+        # потоковый режим (from_file): источник, декодер и индекс известного
+        # перевода строки в буфере не раньше self.cursor
+        self._source = None
+        self._decoder = None
+        self._eof = True
+        self._newline = sys.maxsize
+        if engine == 'table':
+            self.get_next_token = self.__get_next_token_table
+        elif engine == 'iterative':
+            self.get_next_token = self.__get_next_token_iterative
 
-    def ___init__(self, file):
-        self.file = file
-        self.lineno = 1
-        self.pos = 1
-        self.state = None
-        self.char = None
+    @classmethod
+    def from_file(cls, file, chunk_size=CHUNK_SIZE, encoding='utf8', name_table=None) -> Lexer:
+        # Потоковый режим движка 'table': исходник читается из текстового или двоичного
+        # файла либо mmap кусками по chunk_size символов/байт. В self.content хранится
+        # только окно от начала текущего токена до конца строки после него, так что
+        # память ограничена размером куска и самой длинной строкой (строковым литералом)
+        lexer = cls('', engine='table', name_table=name_table)
+        lexer._source = file
+        lexer._chunk_size = chunk_size
+        lexer._encoding = encoding
+        lexer._eof = False
+        lexer._newline = -1
+        lexer.get_next_token = lexer.__get_next_token_stream
+        return lexer
+
+    def __read_chunk(self):
+        # отбрасывает уже разобранную часть буфера и дочитывает следующий кусок
+        data = self._source.read(self._chunk_size)
+        if self._decoder is None:
+            # \r\n переводятся в \n, как при чтении файла в текстовом режиме
+            decoder = None
+            if not isinstance(data, str):
+                decoder = codecs.getincrementaldecoder(self._encoding)()
+            self._decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+        self._eof = not data
+        text = self._decoder.decode(data, final=self._eof)
+        dropped = self.cursor
+        self.content = self.content[dropped:] + text
+        self.length = len(self.content) - 1
+        self.cursor = 0
+        self._line_start -= dropped
+        self._newline -= dropped
+
+    def __fill_line(self):
+        # дочитывает источник, пока после self.cursor не окажется перевод строки
+        # или конец файла: любой токен, кроме строкового литерала, заканчивается до него
+        searched = self.cursor
+        while True:
+            newline = self.content.find('\n', searched)
+            if newline >= 0:
+                self._newline = newline
+                return
+            if self._eof:
+                self._newline = sys.maxsize
+                return
+            searched = len(self.content) - self.cursor
+            self.__read_chunk()
 
 
     def __get_next_char(self):
@@ -111,6 +352,291 @@ class Lexer:
                 self.lineno += 1
                 self.pos = 1
 
+    def __get_char_at(self, index):
+        # то же, что вызывать __get_next_char, пока текущим не станет content[index],
+        # но переводы строк считаются за один проход без посимвольного цикла
+        end = min(index, self.length) + 1
+        newline = self.content.rfind('\n', self.cursor, end)
+        if newline < 0:
+            self.pos += end - self.cursor
+        else:
+            self.lineno += self.content.count('\n', self.cursor, end)
+            self.pos = end - newline
+        self.cursor = end
+        self.char = self.content[index] if index <= self.length else ''
+
+    def __seek(self, index):
+        # выставляет lineno/pos такими же, какими их оставил бы __get_next_char,
+        # прочитав символ content[index]; переводы строк до index уже учтены в _line
+        if index > self.length:
+            self.lineno = self._line
+            self.pos = index - self._line_start + 1
+        elif self.content[index] == '\n':
+            self.lineno = self._line + 1
+            self.pos = 1
+        else:
+            self.lineno = self._line
+            self.pos = index - self._line_start + 2
+
+    def __error_at_eof(self, start, msg):
+        newlines = self.content.count('\n', start)
+        if newlines:
+            self._line += newlines
+            self._line_start = self.content.rfind('\n') + 1
+        self.__seek(self.length + 1)
+        self.error(msg)
+
+    def __fill_token(self):
+        # дочитывает источник, пока очередной токен и символ сразу после него (от него
+        # зависят lineno/pos) не окажутся в буфере целиком: после __fill_line там есть
+        # перевод строки, до которого заканчивается любой токен, кроме самого перевода
+        # строки и строкового литерала
+        if self._newline < self.cursor:
+            self.__fill_line()
+        content = self.content
+        start = self.cursor
+        if start <= self.length and content[start] in ' \t':
+            start = _WHITESPACE_PATTERN.match(content, start).end()
+        quote = content[start:start + 1]
+        if quote == '\n':
+            start -= self.cursor
+            while self.cursor + start >= self.length and not self._eof:
+                self.__read_chunk()
+            return
+        if quote != '"' and quote != "'":
+            return
+        searched = start + 1 - self.cursor
+        while not self._eof:
+            end = self.content.find(quote, self.cursor + searched)
+            if 0 <= end < self.length:
+                return
+            searched = len(self.content) - self.cursor
+            if end >= 0:
+                searched -= 1
+            self.__read_chunk()
+
+    def __scan_stream(self):
+        # __scan_table для потокового режима (from_file)
+        self.__fill_token()
+        return self.__scan_table()
+
+    def __scan_table(self):
+        # находит границы очередного токена [start, end) и выставляет lineno/pos,
+        # значение токена из исходника не вырезается. Весь токен и символ после
+        # него должны быть в self.content: в потоковом режиме их дочитывает __fill_token
+        content = self.content
+        start = self.cursor
+        if start <= self.length and content[start] in ' \t':
+            start = self.cursor = _WHITESPACE_PATTERN.match(content, start).end()
+        if start > self.length:
+            self.__seek(start)
+            return Token.EOF, start, start
+        char = content[start]
+        scan = _FIRST_CHAR.get(char)
+        if scan is None:
+            if char.isalpha():
+                scan = _SCAN_ID
+            elif char.isdecimal():
+                scan = _SCAN_NUMBER
+            else:
+                self.__seek(start)
+                self.error("Неожиданный символ")
+
+        if scan == _SCAN_ID:
+            end = _ID_PATTERN.match(content, start).end()
+            text = content[start:end]
+            name_id = self._name_ids.get(text)
+            if name_id is None:
+                name_id = self.name_table.intern(text)
+            self.name_id = name_id
+            name = _KEYWORD_KINDS[name_id] if name_id < _KEYWORD_COUNT else Token.ID
+        elif scan == _SCAN_OPERATOR:
+            end = start + 1
+            name = _OPERATORS[char]
+        elif scan == _SCAN_PAIR:
+            end = start + 2
+            name = _OPERATORS.get(content[start:end])
+            if name is None or end > self.length + 1:
+                if char == '!':
+                    self.__seek(start + 1)
+                    self.error("Ожидался оператор !=")
+                elif char == '|':
+                    self.__seek(start + 1)
+                    self.error("Ожидался оператор ||")
+                end = start + 1
+                name = _OPERATORS[char]
+        elif scan == _SCAN_NEWLINE:
+            end = self._line_start = start + 1
+            self._line += 1
+            name = Token.NEWLINE
+        elif scan == _SCAN_NUMBER:
+            match = _NUMBER_PATTERN.match(content, start)
+            end = match.end()
+            if end <= self.length and (content[end].isalpha() or content[end] == '_'):
+                self.cursor = end
+                self.__seek(end)
+                self.error("Неверная запись идентификатора!")
+            name = Token.FLOAT_LITERAL if match.lastindex else Token.INT_LITERAL
+        elif scan == _SCAN_STRING:
+            end = content.find(char, start + 1) + 1
+            if not end:
+                # незакрытая строка - автомат дочитал бы файл до конца
+                self.__error_at_eof(start, 'Ожидалась закрывающая кавычка!')
+            newlines = content.count('\n', start, end)
+            if newlines:
+                self._line += newlines
+                self._line_start = content.rfind('\n', start, end) + 1
+            name = Token.STRING_LITERAL_1 if char == '"' else Token.STRING_LITERAL_2
+        else:
+            second = content[start + 1:start + 2]
+            if second == '/':
+                end = content.find('\n', start)
+                if end < 0:
+                    end = self.length + 1
+                name = Token.DSLASH
+            elif second == '*':
+                end = start + 2
+                name = Token.COMMENTSTART
+            else:
+                end = start + 1
+                name = Token.SLASH
+        self.cursor = end
+        self.__seek(end)
+        return name, start, end
+
+    def __get_next_token_table(self):
+        # то же, что __scan_table, но сразу создаёт Token: в горячем цикле лексера по
+        # исходнику в памяти нет ни лишнего вызова, ни кортежа границ
+        content = self.content
+        start = self.cursor
+        if start <= self.length and content[start] in ' \t':
+            start = self.cursor = _WHITESPACE_PATTERN.match(content, start).end()
+        if start > self.length:
+            self.__seek(start)
+            return Token(Token.EOF, '', self.lineno, self.pos)
+        char = content[start]
+        scan = _FIRST_CHAR.get(char)
+        if scan is None:
+            if char.isalpha():
+                scan = _SCAN_ID
+            elif char.isdecimal():
+                scan = _SCAN_NUMBER
+            else:
+                self.__seek(start)
+                self.error("Неожиданный символ")
+
+        if scan == _SCAN_ID:
+            end = self.cursor = _ID_PATTERN.match(content, start).end()
+            text = content[start:end]
+            name_id = self._name_ids.get(text)
+            if name_id is None:
+                name_id = self.name_table.intern(text)
+            self.name_id = name_id
+            self.__seek(end)
+            if name_id < _KEYWORD_COUNT:
+                return Token(_KEYWORD_KINDS[name_id], self.name_table.names[name_id], self.lineno, self.pos - 1)
+            return Token(Token.ID, self.name_table.names[name_id], self.lineno, self.pos - 1)
+        elif scan == _SCAN_OPERATOR:
+            name = _OPERATORS[char]
+            end = start + 1
+        elif scan == _SCAN_PAIR:
+            end = start + 2
+            name = _OPERATORS.get(content[start:end])
+            if name is None or end > self.length + 1:
+                if char == '!':
+                    self.__seek(start + 1)
+                    self.error("Ожидался оператор !=")
+                elif char == '|':
+                    self.__seek(start + 1)
+                    self.error("Ожидался оператор ||")
+                end = start + 1
+                name = _OPERATORS[char]
+        elif scan == _SCAN_NEWLINE:
+            end = self.cursor = self._line_start = start + 1
+            self._line += 1
+            self.__seek(end)
+            return Token(Token.NEWLINE, _FIXED_VALUES[Token.NEWLINE], self.lineno, self.pos)
+        elif scan == _SCAN_NUMBER:
+            match = _NUMBER_PATTERN.match(content, start)
+            end = self.cursor = match.end()
+            self.__seek(end)
+            if end <= self.length and (content[end].isalpha() or content[end] == '_'):
+                self.error("Неверная запись идентификатора!")
+            name = Token.FLOAT_LITERAL if match.lastindex else Token.INT_LITERAL
+            return Token(name, match.group(), self.lineno, self.pos - 1)
+        elif scan == _SCAN_STRING:
+            end = content.find(char, start + 1) + 1
+            if not end:
+                # незакрытая строка - автомат дочитал бы файл до конца
+                self.__error_at_eof(start, 'Ожидалась закрывающая кавычка!')
+            newlines = content.count('\n', start, end)
+            if newlines:
+                self._line += newlines
+                self._line_start = content.rfind('\n', start, end) + 1
+            self.cursor = end
+            self.__seek(end)
+            name = Token.STRING_LITERAL_1 if char == '"' else Token.STRING_LITERAL_2
+            return Token(name, content, self.lineno, self.pos - 2, start)
+        else:
+            second = content[start + 1:start + 2]
+            if second == '/':
+                end = content.find('\n', start)
+                if end < 0:
+                    end = self.length + 1
+                self.cursor = end
+                self.__seek(end)
+                return Token(Token.DSLASH, content, self.lineno, self.pos - 1, start)
+            elif second == '*':
+                end = start + 2
+                name = Token.COMMENTSTART
+            else:
+                end = start + 1
+                name = Token.SLASH
+        self.cursor = end
+        self.__seek(end)
+        return Token(name, _FIXED_VALUES[name], self.lineno, self.pos)
+
+    def __get_next_token_stream(self):
+        name, start, end = self.__scan_stream()
+        if name == Token.ID:
+            return Token(name, self.name_table.names[self.name_id], self.lineno, self.pos - 1)
+        # self.content - окно, которое заменяется с каждым куском: ленивый токен
+        # держал бы его в памяти, поэтому значение сразу
+        return Token(name, _token_value(self.content, name, start, end), self.lineno, self.pos - _POS_SHIFT[name])
+
+    def spans(self):
+        # токены движка 'table' в виде (вид, начало, конец) без создания Token;
+        # lineno/pos лексера соответствуют последнему выданному токену, name_id -
+        # последнему идентификатору
+        scan = self.__scan_table if self._source is None else self.__scan_stream
+        while True:
+            span = scan()
+            yield span
+            if span[0] == Token.EOF:
+                return
+
+    def restart_at(self, index):
+        # продолжает разбор движком 'table' с токена, начинающегося в content[index]
+        self.cursor = index
+        self._line = self.content.count('\n', 0, index) + 1
+        self._line_start = self.content.rfind('\n', 0, index) + 1
+
+    def tokenize_all(self) -> TokenStream:
+        # лексический анализ всего оставшегося исходника за один проход движком 'table'
+        if self._source is not None:
+            raise ValueError('tokenize_all() requires the whole source, not a streaming Lexer.from_file()')
+        stream = TokenStream(self.content, self.name_table)
+        names, starts, ends = stream.names.append, stream.starts.append, stream.ends.append
+        lines, positions, name_ids = stream.lines.append, stream.positions.append, stream.name_ids.append
+        for name, start, end in self.spans():
+            names(name)
+            starts(start)
+            ends(end)
+            lines(self.lineno)
+            positions(self.pos)
+            name_ids(self.name_id if name == Token.ID else 0)
+        return stream
+
     def error(self, msg):
         #print(f'Ошибка лексического анализа ({self.lineno}, {self.pos}): {msg}')
         #sys.exit(1)
@@ -194,7 +720,7 @@ class Lexer:
                 elif self.char.isalpha() or self.char == '_':
                     self.state = Token.ID
                     return self.get_next_token()
-                elif self.char.isdigit():
+                elif self.char.isdecimal():
                     self.state = Token.INT_LITERAL
                     return self.get_next_token()
                 elif self.char == '&':
@@ -254,65 +780,35 @@ class Lexer:
                 else:
                     self.state = None
                     return Token(Token.G, ">", self.lineno, self.pos)
-            case Token.STRING_LITERAL_1:
-                self.__get_next_char()
-                string_literal_1 = ""
-                while self.char != '"':
-                    if self.char == '':  # если достигнут конец файла
-                        self.error('Ожидалась закрывающая кавычка!')
-                    string_literal_1 += self.char
-                    self.__get_next_char()
-                self.__get_next_char()
-                self.state = None
-                # self.pos минус 2 потому что токен оканчивается за 2 символа
-                # до текущего положения чтения (оно сейчас указывает на символ
-                # после кавычки, а не на последний символ строки)
-                return Token(Token.STRING_LITERAL_1, string_literal_1, self.lineno, self.pos - 2)
-            case Token.STRING_LITERAL_2:
-                self.__get_next_char()
-                string_literal_2 = ''
-                while self.char != "'":
-                    if self.char == '':  # если достигнут конец файла
-                        self.error('Ожидалась закрывающая кавычка!')
-                    string_literal_2 += self.char
-                    self.__get_next_char()
-                self.__get_next_char()
+            case Token.STRING_LITERAL_1 | Token.STRING_LITERAL_2:
+                end = self.content.find(self.char, self.cursor)
+                if end < 0:  # если достигнут конец файла
+                    self.__get_char_at(self.length + 1)
+                    self.error('Ожидалась закрывающая кавычка!')
+                string_literal = self.content[self.cursor:end]
+                # читаем символ после закрывающей кавычки
+                self.__get_char_at(end + 1)
+                name = self.state
                 self.state = None
                 # self.pos минус 2 потому что токен оканчивается за 2 символа
                 # до текущего положения чтения (оно сейчас указывает на символ
                 # после кавычки, а не на последний символ строки)
-                return Token(Token.STRING_LITERAL_2, string_literal_2, self.lineno, self.pos - 2)
+                return Token(name, string_literal, self.lineno, self.pos - 2)
             case Token.INT_LITERAL:
-                int_literal = ""
-                while self.char.isdigit():
-                    int_literal += self.char
-                    self.__get_next_char()
-                if self.char == '.':
-                    self.state = Token.FLOAT_LITERAL
-                    float_literal = int_literal + '.'
-                    self.__get_next_char()
-                    while self.char.isdigit():
-                        float_literal += self.char
-                        self.__get_next_char()
+                match = _NUMBER_PATTERN.match(self.content, self.cursor - 1)
+                self.__get_char_at(match.end())
                 if self.char.isalpha() or self.char == '_':
                     self.error("Неверная запись идентификатора!")
-                if self.state == Token.INT_LITERAL:
-                    self.state = None
-                    return Token(Token.INT_LITERAL, int_literal, self.lineno, self.pos - 1)
-                if self.state == Token.FLOAT_LITERAL:
-                    self.state = None
-                    return Token(Token.FLOAT_LITERAL, float_literal, self.lineno, self.pos - 1)
+                self.state = None
+                name = Token.FLOAT_LITERAL if match.lastindex else Token.INT_LITERAL
+                return Token(name, match.group(), self.lineno, self.pos - 1)
             case Token.ID:
-                id = self.char
-                self.__get_next_char()
-                while self.char.isalpha() or self.char.isdigit() or self.char == '_':
-                    id += self.char
-                    self.__get_next_char()
+                match = _ID_PATTERN.match(self.content, self.cursor - 1)
+                self.__get_char_at(match.end())
                 self.state = None
-                if id in Token.KEYWORDS:
-                    return Token(Token.KEYWORDS[id], id, self.lineno, self.pos - 1)
-                else:
-                    return Token(Token.ID, id, self.lineno, self.pos - 1)
+                self.name_id = name_id = self.name_table.intern(match.group())
+                return Token(self.name_table.kind(name_id), self.name_table.names[name_id], self.lineno,
+                             self.pos - 1)
             case Token.AND:
                 self.__get_next_char()
                 if self.char == '&':
@@ -335,14 +831,300 @@ class Lexer:
                     self.__get_next_char()
                     return Token(Token.COMMENTEND, "/*", self.lineno, self.pos)
             case Token.DSLASH:
-
-                self.__get_next_char()
-                text = ''
-                while self.char != '\n':
-                    text += self.char
-                    self.__get_next_char()
+                end = self.content.find('\n', self.cursor)
+                if end < 0:  # комментарий в последней строке файла
+                    end = self.length + 1
+                text = self.content[self.cursor:end]
+                self.__get_char_at(end)
                 self.state = None
                 return Token(Token.DSLASH, text, self.lineno, self.pos - 1)
 
+    def __get_next_token_iterative(self):
+        # тот же автомат, что и get_next_token, но пропуск пробелов и переходы
+        # между состояниями выполняются в цикле, а не рекурсивным вызовом
+        get_next_char = self.__get_next_char
+        while True:
+            match self.state:
+                case None:
+                    char = self.char
+                    if char is None or char == ' ' or char == '\t':
+                        get_next_char()
+                    elif char == '\n':
+                        get_next_char()
+                        return Token(Token.NEWLINE, "\\n", self.lineno, self.pos)
+                    elif char == '':
+                        return Token(Token.EOF, "", self.lineno, self.pos)
+                    elif char in _SINGLE_CHAR_OPERATORS:
+                        get_next_char()
+                        return Token(_OPERATORS[char], char, self.lineno, self.pos)
+                    elif char in _START_STATES:
+                        self.state = _START_STATES[char]
+                    elif char.isalpha() or char == '_':
+                        self.state = Token.ID
+                    elif char.isdecimal():
+                        self.state = Token.INT_LITERAL
+                    else:
+                        self.error("Неожиданный символ")
+                case Token.SLASH:
+                    get_next_char()
+                    if self.char == '/':
+                        self.state = Token.DSLASH
+                    elif self.char == '*':
+                        self.state = None
+                        get_next_char()
+                        return Token(Token.COMMENTSTART, "/*", self.lineno, self.pos)
+                    else:
+                        self.state = None
+                        return Token(Token.SLASH, "/", self.lineno, self.pos)
+                case Token.ASSIGN | Token.L | Token.G | Token.AND | Token.OR | Token.NEQ:
+                    first = self.char
+                    get_next_char()
+                    self.state = None
+                    pair = first + self.char
+                    if self.char and pair in _OPERATORS:
+                        get_next_char()
+                        return Token(_OPERATORS[pair], pair, self.lineno, self.pos)
+                    elif first == '!':
+                        self.error("Ожидался оператор !=")
+                    elif first == '|':
+                        self.error("Ожидался оператор ||")
+                    return Token(_OPERATORS[first], first, self.lineno, self.pos)
+                case Token.STRING_LITERAL_1 | Token.STRING_LITERAL_2:
+                    end = self.content.find(self.char, self.cursor)
+                    if end < 0:  # если достигнут конец файла
+                        self.__get_char_at(self.length + 1)
+                        self.error('Ожидалась закрывающая кавычка!')
+                    literal = self.content[self.cursor:end]
+                    self.__get_char_at(end + 1)
+                    name = self.state
+                    self.state = None
+                    return Token(name, literal, self.lineno, self.pos - 2)
+                case Token.INT_LITERAL:
+                    match = _NUMBER_PATTERN.match(self.content, self.cursor - 1)
+                    self.__get_char_at(match.end())
+                    if self.char.isalpha() or self.char == '_':
+                        self.error("Неверная запись идентификатора!")
+                    self.state = None
+                    name = Token.FLOAT_LITERAL if match.lastindex else Token.INT_LITERAL
+                    return Token(name, match.group(), self.lineno, self.pos - 1)
+                case Token.ID:
+                    match = _ID_PATTERN.match(self.content, self.cursor - 1)
+                    self.__get_char_at(match.end())
+                    self.state = None
+                    self.name_id = name_id = self.name_table.intern(match.group())
+                    return Token(self.name_table.kind(name_id), self.name_table.names[name_id], self.lineno,
+                                 self.pos - 1)
+                case Token.DSLASH:
+                    end = self.content.find('\n', self.cursor)
+                    if end < 0:  # комментарий в последней строке файла
+                        end = self.length + 1
+                    text = self.content[self.cursor:end]
+                    self.__get_char_at(end)
+                    self.state = None
+                    return Token(Token.DSLASH, text, self.lineno, self.pos - 1)
+
+def _stream_token(stream, index, name, lineno, pos):
+    if name == Token.ID:
+        return Token(name, stream.name_table.names[stream.name_ids[index]], lineno, pos)
+    return _span_token(stream.content, name, stream.starts[index], stream.ends[index], lineno, pos)
+
+
+class TokenStream:
+    # Поток токенов в колонках: вид токена, границы в исходнике, строка и позиция
+    # лексера после токена лежат в параллельных массивах, а значение вырезается
+    # из исходника только при обращении. Значение идентификатора - общая строка
+    # из name_table по номеру в колонке name_ids (у остальных токенов там 0)
+    def __init__(self, content, name_table=None):
+        self.content = content
+        self.name_table = name_table if name_table is not None else NameTable()
+        self.names = array('H')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.lines = array('I')
+        self.positions = array('I')
+        self.name_ids = array('I')
+
+    def __len__(self):
+        return len(self.names)
+
+    def value(self, index):
+        name = self.names[index]
+        if name == Token.ID:
+            return self.name_table.names[self.name_ids[index]]
+        return _token_value(self.content, name, self.starts[index], self.ends[index])
+
+    def __getitem__(self, index):
+        name = self.names[index]
+        return _stream_token(self, index, name, self.lines[index], self.positions[index] - _POS_SHIFT[name])
+
+    def __iter__(self):
+        for index in range(len(self.names)):
+            yield self[index]
+
+    def reader(self, skip_newlines=False) -> TokenStreamReader:
+        return TokenStreamReader(self, skip_newlines)
+
+    def edit(self, offset, removed, inserted) -> tuple[TokenStream, int, int, int]:
+        # Поток токенов для исходника, в котором removed символов начиная с offset
+        # заменены на inserted. Заново лексируется только участок от последнего токена,
+        # начинающегося до offset, и до первого перевода строки после правки, совпавшего
+        # с переводом строки старого потока: дальше токены те же, только сдвинуты.
+        # Возвращает (поток, first, old_end, new_end): старые токены [first, old_end)
+        # заменены новыми [first, new_end), токены с old_end перенесены со сдвигом
+        content = self.content[:offset] + inserted + self.content[offset + removed:]
+        delta = len(inserted) - removed
+        first = max(bisect.bisect_left(self.starts, offset) - 1, 0)
+
+        stream = TokenStream(content, self.name_table)
+        for column in ('names', 'starts', 'ends', 'lines', 'positions', 'name_ids'):
+            getattr(stream, column).extend(getattr(self, column)[:first])
+
+        lexer = Lexer(content, engine='table', name_table=self.name_table)
+        lexer.restart_at(self.starts[first])
+        edit_end = offset + len(inserted)
+        for name, start, end in lexer.spans():
+            stream.names.append(name)
+            stream.starts.append(start)
+            stream.ends.append(end)
+            stream.lines.append(lexer.lineno)
+            stream.positions.append(lexer.pos)
+            stream.name_ids.append(lexer.name_id if name == Token.ID else 0)
+            if name == Token.NEWLINE and start >= edit_end:
+                old = bisect.bisect_left(self.starts, start - delta)
+                if old < len(self.starts) and self.starts[old] == start - delta and self.names[old] == name:
+                    break
+        else:
+            return stream, first, len(self.names), len(stream.names)
+
+        old_end, new_end = old + 1, len(stream.names)
+        line_delta = lexer.lineno - self.lines[old]
+        stream.names.extend(self.names[old_end:])
+        stream.starts.extend(map(delta.__add__, self.starts[old_end:]))
+        stream.ends.extend(map(delta.__add__, self.ends[old_end:]))
+        if line_delta:
+            stream.lines.extend(map(line_delta.__add__, self.lines[old_end:]))
+        else:
+            stream.lines.extend(self.lines[old_end:])
+        stream.positions.extend(self.positions[old_end:])
+        stream.name_ids.extend(self.name_ids[old_end:])
+        return stream, first, old_end, new_end
+
+
+class TokenStreamReader:
+    # Отдаёт токены TokenStream по одному через тот же интерфейс, что и Lexer
+    # (get_next_token, lineno, pos), чтобы поток можно было передать в Parser.
+    # С skip_newlines переводы строк пропускаются прямо по массиву имён, не создавая
+    # для них Token, а peek(n) смотрит вперёд без отдельного буфера
+    def __init__(self, stream: TokenStream, skip_newlines=False):
+        self.stream = stream
+        self.skip_newlines = skip_newlines
+        self.index = 0
+        self.lineno = 1
+        self.pos = 1
+
+    def get_next_token(self):
+        index = self.index
+        stream = self.stream
+        names = stream.names
+        name = names[index]
+        if self.skip_newlines:
+            while name == Token.NEWLINE:
+                index += 1
+                name = names[index]
+        # после EOF продолжаем отдавать EOF, как и Lexer
+        self.index = index + 1 if name != Token.EOF else index
+        self.lineno = lineno = stream.lines[index]
+        self.pos = pos = stream.positions[index]
+        return _stream_token(stream, index, name, lineno, pos - _POS_SHIFT[name])
+
+    def peek(self, n=1):
+        # n-й токен после текущего, не сдвигая текущий
+        stream = self.stream
+        names = stream.names
+        index = self.index
+        for _ in range(n):
+            name = names[index]
+            while self.skip_newlines and name == Token.NEWLINE:
+                index += 1
+                name = names[index]
+            if name != Token.EOF:
+                index += 1
+        index -= name != Token.EOF
+        return stream[index]
+
+
+class TokenBuffer:
+    # Слой между Lexer (или другим источником с тем же интерфейсом) и Parser:
+    # отбрасывает переводы строк и хранит прочитанные вперёд токены для peek(n).
+    # lineno и pos - состояние источника сразу после чтения текущего токена, как у
+    # Lexer, чтобы сообщения об ошибках не зависели от заглядывания вперёд
+    def __init__(self, source):
+        self.source = source
+        self.lookahead = collections.deque()
+        self.lineno = source.lineno
+        self.pos = source.pos
+
+    def __read_token(self):
+        # следующий токен источника, кроме NEWLINE
+        source = self.source
+        token = source.get_next_token()
+        while token.name == Token.NEWLINE:
+            token = source.get_next_token()
+        return token
+
+    def get_next_token(self):
+        if self.lookahead:
+            token, self.lineno, self.pos = self.lookahead.popleft()
+            return token
+        token = self.__read_token()
+        self.lineno = self.source.lineno
+        self.pos = self.source.pos
+        return token
+
+    def peek(self, n=1):
+        # n-й токен после текущего, не сдвигая текущий
+        lookahead = self.lookahead
+        source = self.source
+        while len(lookahead) < n:
+            lookahead.append((self.__read_token(), source.lineno, source.pos))
+        return lookahead[n - 1][0]
+
+
+class RecordedTokens:
+    # Все токены источника (например, потокового Lexer.from_file) до EOF, кроме
+    # переводов строк, вместе с его lineno и pos после каждого. Отдаёт их заново через
+    # интерфейс Lexer, чтобы лексер и парсер можно было замерить по отдельности
+    def __init__(self, source):
+        records = []
+        token = source.get_next_token()
+        while token.name != Token.EOF:
+            if token.name != Token.NEWLINE:
+                records.append((token, source.lineno, source.pos))
+            token = source.get_next_token()
+        records.append((token, source.lineno, source.pos))
+        self.records = records
+        self.index = 0
+        self.lineno = 1
+        self.pos = 1
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def lines(self):
+        # число строк исходника, как у str.splitlines: EOF в начале строки - после
+        # последнего перевода строки
+        eof = self.records[-1][0]
+        return eof.lineno - (eof.pos == 1)
+
+    def get_next_token(self):
+        index = self.index
+        token, self.lineno, self.pos = self.records[index]
+        # после EOF продолжаем отдавать EOF, как и Lexer
+        if index + 1 < len(self.records):
+            self.index = index + 1
+        return token
 
 
+def tokenize(content, name_table=None) -> TokenStream:
+    return Lexer(content, name_table=name_table).tokenize_all()
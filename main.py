@@ -1,23 +1,15 @@
 from lexer import Lexer, Token
-from parser import Parser
+from parser import Parser, dump
 
 with open("file.cpp", 'r', encoding='utf8') as f:
-    lex = Lexer(f.read())
-    pars = Parser(lex)
-    #
+    tokens = Lexer(f.read()).tokenize_all()
 
 # Вывод лексера
-with open("file.cpp", 'r', encoding='utf8') as f:
-
-    lex = Lexer(f.read())
-t = lex.get_next_token()
-while t.name != Token.EOF:
-     print(t)
-     t = lex.get_next_token()
-print(t)
+for t in tokens:
+    print(t)
 
 
 
-ast = pars.parse()
+ast = Parser(tokens).parse()
 
-print(ast)
+dump(ast)
@@ -0,0 +1,250 @@
+import math
+import operator
+
+import parser
+from lexer import Token
+
+# результат вне диапазона int в C++ - переполнение, такие выражения не сворачиваются
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+
+_RELATIONS = {
+    Token.L: operator.lt,
+    Token.G: operator.gt,
+    Token.LE: operator.le,
+    Token.GE: operator.ge,
+    Token.EQ: operator.eq,
+    Token.NEQ: operator.ne,
+}
+
+
+def _int_div(a, b):
+    # деление int в C++ отбрасывает дробную часть (округление к нулю)
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def fold_arithmetic(op, a, b):
+    # значение a op b по правилам C++ или None, если его нельзя вычислить заранее
+    if op == Token.PLUS:
+        result = a + b
+    elif op == Token.MINUS:
+        result = a - b
+    elif op == Token.ASTERISK:
+        result = a * b
+    elif op == Token.SLASH or op == Token.PERCENT:
+        if not b:
+            return None
+        if isinstance(a, float) or isinstance(b, float):
+            # % для float в C++ не определён
+            if op == Token.PERCENT:
+                return None
+            result = a / b
+        elif op == Token.SLASH:
+            result = _int_div(a, b)
+        else:
+            result = a - _int_div(a, b) * b
+    else:
+        return None
+    if isinstance(result, float):
+        return result if math.isfinite(result) else None
+    return result if INT_MIN <= result <= INT_MAX else None
+
+
+def literal_value(node):
+    # число из литерала или None; 010 в C++ - восьмеричная запись, такие не трогаем
+    if isinstance(node, parser.NodeIntLiteral):
+        text = node.value.value
+        return int(text) if text == '0' or not text.startswith('0') else None
+    if isinstance(node, parser.NodeFloatLiteral):
+        return float(node.value.value)
+    return None
+
+
+def count_nodes(node):
+    return sum(1 for _, _, el, _ in parser.walk(node) if isinstance(el, parser.Node))
+
+
+def first_token(node):
+    for _, _, el, _ in parser.walk(node):
+        if isinstance(el, Token):
+            return el
+    return None
+
+
+class ConstantFolder(parser.NodeWalker):
+    # Оптимизация AST между семантическим анализом и трансляцией:
+    # - арифметика (+ - * / % и унарный минус) над литералами int/float заменяется
+    #   литералом с результатом, вычисленным по правилам C++;
+    # - if, условие которого известно заранее, заменяется операторами своего блока
+    #   или удаляется вместе со следующим за ним else (если выполняемый блок объявляет
+    #   переменные, if остаётся); while с ложным условием удаляется;
+    # - операторы блока после return удаляются (вложенные функции и комментарии остаются).
+    # Дерево меняется на месте. folded - число свёрнутых операций, removed - число
+    # удалённых узлов, в log - строка на каждый удалённый оператор
+    def __init__(self):
+        self.folded = 0
+        self.removed = 0
+        self.log = []
+        # значения условий (сравнений, && || !), известные заранее
+        self._conditions = {}
+
+    def __str__(self):
+        return f'Свёрнуто операций: {self.folded}, удалено узлов: {self.removed}'
+
+    def value(self, node):
+        if isinstance(node, (parser.NodeBinaryOperator, parser.NodeNot)):
+            return self._conditions.get(node)
+        return literal_value(node)
+
+    def generic_leave(self, node, values):
+        # дочерние элементы могли замениться литералами
+        if values and isinstance(node, parser.Node):
+            for field, value in zip(node._fields, values):
+                setattr(node, field, value)
+        return node
+
+    def leave_list(self, node, values):
+        node[:] = values
+        return node
+
+    enter_NodeProgram = enter_NodeFunction = parser.EnterFields('block')
+
+    def leave_NodeFunction(self, node, values):
+        node.block = values[0]
+        return node
+
+    skip = parser.NodeWalker.skip_children
+
+    # в объявлениях, вводе-выводе и листьях дерева сворачивать нечего, их токены
+    # обходить незачем
+    enter_NoneType = enter_NodeDeclaration = enter_NodeFormalParams = skip
+    enter_NodeCin = enter_NodeCout = enter_NodeComment = skip
+    enter_NodeVar = enter_NodeID = enter_NodeIntLiteral = enter_NodeFloatLiteral = enter_NodeStringLiteral = skip
+
+    enter_NodeBinaryOperator = parser.EnterFields('left', 'right')
+
+    def literal(self, value, token: Token):
+        if isinstance(value, float):
+            return parser.NodeFloatLiteral(Token(Token.FLOAT_LITERAL, repr(value), token.lineno, token.pos))
+        return parser.NodeIntLiteral(Token(Token.INT_LITERAL, str(value), token.lineno, token.pos))
+
+    def leave_NodeBinaryOperator(self, node, values):
+        node.left, node.right = left, right = values
+        a, b = self.value(left), self.value(right)
+        name = node.op.name
+        if name in _RELATIONS:
+            if a is not None and b is not None:
+                self._conditions[node] = _RELATIONS[name](a, b)
+        elif name == Token.AND or name == Token.OR:
+            # правый операнд не вычисляется, если левый уже решил результат
+            if a is not None and bool(a) == (name == Token.OR):
+                self._conditions[node] = bool(a)
+            elif a is not None and b is not None:
+                self._conditions[node] = bool(b)
+        elif a is not None and b is not None:
+            result = fold_arithmetic(name, a, b)
+            if result is not None:
+                self.folded += 1
+                return self.literal(result, left.value)
+        return node
+
+    def leave_NodeUnaryMinus(self, node, values):
+        node.operand = operand = values[0]
+        value = literal_value(operand)
+        if value is None or isinstance(value, int) and -value < INT_MIN:
+            return node
+        self.folded += 1
+        return self.literal(-value, operand.value)
+
+    def leave_NodeNot(self, node, values):
+        node.operand = operand = values[0]
+        value = self.value(operand)
+        if value is not None:
+            self._conditions[node] = not value
+        return node
+
+    def remove(self, node, reason):
+        self.removed += count_nodes(node)
+        token = first_token(node)
+        where = f' at line {token.lineno}' if token else ''
+        self.log.append('*' * 20 + f'removed: {reason}{where}')
+
+    def leave_NodeBlock(self, node, values):
+        children = values[0]
+        removed, log_size = self.removed, len(self.log)
+        statements = []
+        # решено ли заранее, выполнялся ли предыдущий if: тогда от него зависит
+        # следующий за ним else
+        taken = None
+        returned = False
+        for index, child in enumerate(children):
+            if returned and not isinstance(child, (parser.NodeFunction, parser.NodeComment)):
+                self.remove(child, 'unreachable code after return')
+                continue
+            kind = type(child)
+            if kind is parser.NodeElseBlock and taken is not None:
+                if taken:
+                    self.remove(child, 'else of an always true if')
+                else:
+                    returned = self.inline(child, statements, 'else of an always false if')
+                taken = None
+                continue
+            taken = None
+            if kind is parser.NodeIfConstruction:
+                taken = self.value(child.condition)
+                if taken is not None:
+                    taken = bool(taken)
+                    # выполняемый блок: блок if или следующего за ним else
+                    executed = child if taken else self._else_of(children, index)
+                    if executed is not None and self._declares(executed):
+                        # его объявления слились бы с одноимёнными переменными
+                        # объемлющего блока: такой if остаётся как есть
+                        statements.append(child)
+                        taken = None
+                        continue
+                    if taken:
+                        returned = self.inline(child, statements, 'if with an always true condition')
+                    else:
+                        self.remove(child, 'if with an always false condition')
+                    continue
+            elif kind is parser.NodeWhileConstruction:
+                condition = self.value(child.condition)
+                if condition is not None and not condition:
+                    self.remove(child, 'while with an always false condition')
+                    continue
+            elif kind is parser.NodeReturnStatement:
+                returned = True
+            statements.append(child)
+        # транслятор не выводит операторы функции, тело которой заканчивается
+        # объявлением или вложенной функцией: если так стало только после удаления,
+        # блок остаётся прежним
+        tail = (parser.NodeDeclaration, parser.NodeFunction)
+        if statements and isinstance(statements[-1], tail) and not isinstance(children[-1], tail):
+            self.removed = removed
+            del self.log[log_size:]
+            return node
+        children[:] = statements
+        return node
+
+    def inline(self, node, statements, reason):
+        # операторы блока if/else вместо него самого; True, если среди них есть return
+        block = node.block.children
+        self.removed += count_nodes(node) - sum(map(count_nodes, block))
+        token = first_token(node)
+        self.log.append('*' * 20 + f'inlined: {reason}' + (f' at line {token.lineno}' if token else ''))
+        statements.extend(block)
+        return self._returns(block)
+
+    @staticmethod
+    def _else_of(children, index):
+        following = children[index + 1:index + 2]
+        return following[0] if following and type(following[0]) is parser.NodeElseBlock else None
+
+    @staticmethod
+    def _declares(node):
+        return any(isinstance(statement, (parser.NodeDeclaration, parser.NodeMultipleDeclarations))
+                   for statement in node.block.children)
+
+    @staticmethod
+    def _returns(statements):
+        return any(isinstance(statement, parser.NodeReturnStatement) for statement in statements)
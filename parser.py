@@ -1,33 +1,22 @@
 from __future__ import annotations
-from lexer import Lexer, Token
+import contextlib
+import gc
+import itertools
+import operator
+import struct
+import sys
+from array import array
+from lexer import Lexer, Token, TokenBuffer, TokenStream, TokenStreamReader
 
 id_tokens = (Token.ID, Token.STRING_LITERAL_2, Token.STRING_LITERAL_1, Token.FLOAT_LITERAL,
              Token.INT_LITERAL,)
 
 class Node:
+    __slots__ = ()
     _fields = ()
 
-    def __get_class_name(self):
-        c = str(self.__class__)
-        pos_1 = c.find('.') + 1
-        pos_2 = c.find("'", pos_1)
-        return f"{c[pos_1:pos_2]}"
-
     def __repr__(self, level=0, parent_field_name=''):
-        if level == 0:
-            res = ''
-        else:
-            res = '|   ' * level
-            res += "|+-"
-        res += f"{parent_field_name}: {self.__get_class_name()}\n"
-        for field_name, el in iter_child_nodes(self):
-            if isinstance(el, Token):
-                res += '|   ' * (level + 1)
-                res += "|+-"
-                res += f'{field_name}: {el}\n'
-            else:
-                res += el.__repr__(level + 1, field_name)
-        return res
+        return ''.join(iter_dump(self, parent_field_name, level=level))
 
 
 class NodeProgram(Node):
@@ -35,6 +24,7 @@ class NodeProgram(Node):
         self.block = block
 
     _fields = ('block',)
+    __slots__ = _fields
 
 
 class NodeBlock(Node):
@@ -42,6 +32,7 @@ class NodeBlock(Node):
         self.children = children
 
     _fields = ('children',)
+    __slots__ = _fields
 
 
 class NodeElseBlock(Node):
@@ -49,6 +40,7 @@ class NodeElseBlock(Node):
         self.block = block
 
     _fields = ('block', )
+    __slots__ = _fields
 
 
 class NodeDeclaration(Node):
@@ -58,6 +50,7 @@ class NodeDeclaration(Node):
         self.const = const
 
     _fields = ('type', 'name', 'const',)
+    __slots__ = _fields
 
 
 class NodeAssigning(Node):
@@ -66,6 +59,7 @@ class NodeAssigning(Node):
         self.right_side = right_side
 
     _fields = ('left_side', 'right_side')
+    __slots__ = _fields
 
 
 class NodeFunction(Node):
@@ -76,6 +70,7 @@ class NodeFunction(Node):
         self.block = block
 
     _fields = ('ret_type', 'name', 'formal_params', 'block')
+    __slots__ = _fields
 
 
 class NodeSequence(Node):
@@ -83,6 +78,7 @@ class NodeSequence(Node):
         self.members = members
 
     _fields = ('members',)
+    __slots__ = _fields
 
 
 class NodeParams(Node):
@@ -90,6 +86,7 @@ class NodeParams(Node):
         self.params = params
 
     _fields = ('params',)
+    __slots__ = _fields
 
 
 # class NodeMultipleDeclarations(NodeParams):
@@ -97,7 +94,7 @@ class NodeParams(Node):
 
 
 class NodeFormalParams(NodeParams):
-    pass
+    __slots__ = ()
 
 
 class NodeMultipleDeclarations(Node):
@@ -108,10 +105,11 @@ class NodeMultipleDeclarations(Node):
 
     #_fields = ('type', 'names')
     _fields = ('names',)
+    __slots__ = _fields
 
 
 class NodeActualParams(NodeParams):
-    pass
+    __slots__ = ()
 
 
 class NodeIfConstruction(Node):
@@ -121,6 +119,7 @@ class NodeIfConstruction(Node):
         # self.else_block = else_block
 
     _fields = ('condition', 'block')
+    __slots__ = _fields
 
 
 class NodeWhileConstruction(Node):
@@ -129,6 +128,7 @@ class NodeWhileConstruction(Node):
         self.block = block
 
     _fields = ('condition', 'block')
+    __slots__ = _fields
 
 
 class NodeReturnStatement(Node):
@@ -136,6 +136,7 @@ class NodeReturnStatement(Node):
         self.expression = expression
 
     _fields = ('expression',)
+    __slots__ = _fields
 
 
 class NodeLiteral(Node):
@@ -143,18 +144,19 @@ class NodeLiteral(Node):
         self.value = value
 
     _fields = ('value',)
+    __slots__ = _fields
 
 
 class NodeStringLiteral(NodeLiteral):
-    pass
+    __slots__ = ()
 
 
 class NodeIntLiteral(NodeLiteral):
-    pass
+    __slots__ = ()
 
 
 class NodeFloatLiteral(NodeLiteral):
-    pass
+    __slots__ = ()
 
 
 class NodeVar(Node):
@@ -162,6 +164,7 @@ class NodeVar(Node):
         self.name = name
 
     _fields = ('name',)
+    __slots__ = _fields
 
 
 class NodeAtomType(Node):
@@ -169,6 +172,7 @@ class NodeAtomType(Node):
         self.id = _id
 
     _fields = ('id',)
+    __slots__ = _fields
 
 
 class NodeAtomTypeSequence(Node):
@@ -176,6 +180,7 @@ class NodeAtomTypeSequence(Node):
         self.id = _id
 
     _fields = ('id',)
+    __slots__ = _fields
 
 
 class NodeComplexType(Node):
@@ -184,6 +189,7 @@ class NodeComplexType(Node):
         self.size = size
 
     _fields = ('name', 'size')
+    __slots__ = _fields
 
 
 class NodeFunctionCall(Node):
@@ -192,6 +198,7 @@ class NodeFunctionCall(Node):
         self.actual_params = actual_params
 
     _fields = ('name', 'actual_params')
+    __slots__ = _fields
 
 
 class NodeIndexAccess(Node):
@@ -200,20 +207,22 @@ class NodeIndexAccess(Node):
         self.index = index
 
     _fields = ('var', 'index')
+    __slots__ = _fields
 
 class NodeUnaryOperator(Node):
     def __init__(self, operand):
         self.operand = operand
 
     _fields = ('operand',)
+    __slots__ = _fields
 
 
 class NodeUnaryMinus(NodeUnaryOperator):
-    pass
+    __slots__ = ()
 
 
 class NodeNot(NodeUnaryOperator):
-    pass
+    __slots__ = ()
 
 
 class NodeID(Node):
@@ -221,6 +230,7 @@ class NodeID(Node):
         self.name = name
 
     _fields = ('name',)
+    __slots__ = _fields
 
 
 class NodeCin(Node):
@@ -228,12 +238,14 @@ class NodeCin(Node):
         self.variables = variables
 
     _fields = ('variables',)
+    __slots__ = _fields
 
 class NodeCout(Node):
     def __init__(self, variables):
         self.variables = variables
 
     _fields = ('variables',)
+    __slots__ = _fields
 
 class NodeBinaryOperator(Node):
     def __init__(self, left:Token, op:Token, right:Token):
@@ -242,6 +254,7 @@ class NodeBinaryOperator(Node):
         self.right = right
 
     _fields = ('left', 'op', 'right')
+    __slots__ = _fields
 
 
 # class NodeL(NodeBinaryOperator):
@@ -305,20 +318,60 @@ class NodeComment(Node):
         self.comment = _text
 
     _fields = ('comment', )
+    __slots__ = _fields
+
+
+# Приоритеты бинарных операций для разбора выражений по приоритетам (Pratt):
+# чем больше число, тем сильнее операция связывает операнды
+_OR_POWER, _AND_POWER, _RELATION_POWER, _SUM_POWER, _PRODUCT_POWER = range(1, 6)
+_BINDING_POWERS = {
+    Token.OR: _OR_POWER,
+    Token.AND: _AND_POWER,
+    Token.L: _RELATION_POWER, Token.G: _RELATION_POWER, Token.LE: _RELATION_POWER,
+    Token.GE: _RELATION_POWER, Token.EQ: _RELATION_POWER, Token.NEQ: _RELATION_POWER,
+    Token.PLUS: _SUM_POWER, Token.MINUS: _SUM_POWER,
+    Token.ASTERISK: _PRODUCT_POWER, Token.SLASH: _PRODUCT_POWER, Token.PERCENT: _PRODUCT_POWER,
+}
+# правый операнд операции: минимальный приоритет операций внутри него и разрешены ли
+# в нём логические префиксы ! и скобки с условием; справа от сравнения стоит
+# арифметическое выражение, справа от && и || - условие
+_RIGHT_OPERANDS = {
+    _OR_POWER: (_AND_POWER, True),
+    _AND_POWER: (_RELATION_POWER, True),
+    _RELATION_POWER: (_SUM_POWER, False),
+    _SUM_POWER: (_PRODUCT_POWER, False),
+    _PRODUCT_POWER: (_PRODUCT_POWER + 1, False),
+}
+# отложенные на стеке разборы: правый операнд бинарной операции, операнд !,
+# условие в скобках и арифметическое выражение в скобках
+_BINARY_FRAME, _NOT_FRAME, _CONDITION_BR_FRAME, _EXPRESSION_BR_FRAME = range(4)
 
 
 class Parser:
-    def __init__(self, lexer: Lexer):
+    EXPRESSION_ENGINES = ('pratt', 'recursive')
+
+    def __init__(self, lexer: Lexer | TokenStream, expressions='pratt'):
+        if expressions not in self.EXPRESSION_ENGINES:
+            raise ValueError(f"Unknown expression engine '{expressions}', expected one of {self.EXPRESSION_ENGINES}")
+        # переводы строк отбрасываются на стороне источника, до парсера они не доходят
+        if isinstance(lexer, TokenStream):
+            lexer = lexer.reader(skip_newlines=True)
+        if not (isinstance(lexer, TokenStreamReader) and lexer.skip_newlines):
+            lexer = TokenBuffer(lexer)
         self.lexer = lexer
         self.token = None
         #self.token = self.lexer.get_next_token()
+        if expressions == 'pratt':
+            self.condition = self.__condition_pratt
+            self.expression = self.__expression_pratt
 
     def next_token(self):
         self.token = self.lexer.get_next_token()
 
+    def peek(self, n=1) -> Token:
+        return self.lexer.peek(n)
+
     def require(self, *expected_token_name):
-        while self.token.name == Token.NEWLINE:
-            self.next_token()
         if self.token.name not in expected_token_name:
             self.error(f"Ожидается токен {', '.join([Token.token_names[exp_token] for exp_token in expected_token_name])}!")
 
@@ -413,21 +466,7 @@ class Parser:
                 return NodeFloatLiteral(first_token)
             case Token.ID:
                 self.next_token()
-                match self.token.name:
-                    case Token.LBR:
-                        self.next_token()
-                        actual_params = self.actual_params()
-                        self.require(Token.RBR)
-                        self.next_token()
-                        return NodeFunctionCall(first_token, actual_params)
-                    case Token.LSBR:
-                        self.next_token()
-                        index = self.expression()
-                        self.require(Token.RSBR)
-                        self.next_token()
-                        return NodeIndexAccess(NodeVar(first_token), index)
-                    case _:
-                        return NodeVar(first_token)
+                return self.__id_operand(first_token)
             case Token.LBR:
                 self.next_token()
                 expression = self.expression()
@@ -435,6 +474,24 @@ class Parser:
                 self.next_token()
                 return expression
 
+    def __id_operand(self, first_token) -> Node:
+        # операнд, начинающийся с идентификатора first_token, текущий токен - следующий за ним
+        match self.token.name:
+            case Token.LBR:
+                self.next_token()
+                actual_params = self.actual_params()
+                self.require(Token.RBR)
+                self.next_token()
+                return NodeFunctionCall(first_token, actual_params)
+            case Token.LSBR:
+                self.next_token()
+                index = self.expression()
+                self.require(Token.RSBR)
+                self.next_token()
+                return NodeIndexAccess(NodeVar(first_token), index)
+            case _:
+                return NodeVar(first_token)
+
     def factor(self) -> Node:
         match self.token.name:
             case Token.MINUS:
@@ -448,6 +505,7 @@ class Parser:
         op = self.token
         op_name = self.token.name
         while op_name in {Token.ASTERISK, Token.SLASH, Token.PERCENT}:
+            op = self.token
             self.next_token()
             left = NodeBinaryOperator(left, op, self.factor())
             op_name = self.token.name
@@ -458,6 +516,7 @@ class Parser:
         op = self.token
         op_name = self.token.name
         while op_name in {Token.PLUS, Token.MINUS}:
+            op = self.token
             self.next_token()
             left = NodeBinaryOperator(left, op, self.term())
             op_name = self.token.name
@@ -482,6 +541,7 @@ class Parser:
         op_name = self.token.name
         op = self.token
         while op_name in {Token.L, Token.G, Token.LE, Token.GE, Token.EQ, Token.NEQ}:
+            op = self.token
             self.next_token()
             left = NodeBinaryOperator(left, op, self.expression())
             op_name = self.token.name
@@ -492,6 +552,7 @@ class Parser:
         op = self.token
         op_name = self.token.name
         while op_name == Token.AND:
+            op = self.token
             self.next_token()
             # left = NodeAnd(left, self.and_operand())
             left = NodeBinaryOperator(left,op, self.and_operand())
@@ -503,12 +564,94 @@ class Parser:
         op = self.token
         op_name = self.token.name
         while op_name == Token.OR:
+            op = self.token
             self.next_token()
             # left = NodeOr(left, self.or_operand())
             left = NodeBinaryOperator(left, op, self.or_operand())
             op_name = self.token.name
         return left
 
+    def __condition_pratt(self) -> Node:
+        return self.__parse_operators(_OR_POWER, True)
+
+    def __expression_pratt(self) -> Node:
+        return self.__parse_operators(_SUM_POWER, False)
+
+    # Разбор выражения по таблице приоритетов без рекурсии по уровням грамматики:
+    # вместо цепочки condition -> or_operand -> ... -> operand на каждый операнд
+    # отложенные операции и скобки хранятся на явном стеке. Деревья те же, что у
+    # рекурсивного спуска: ! относится к логическому операнду, после условия в скобках
+    # или операнда ! возможны только сравнения, && и ||, унарный минус - только к
+    # ближайшему операнду
+    # Самые частые операнды (переменная, числовой литерал) и переход к следующему
+    # токену разбираются прямо в цикле, без вызовов operand() и next_token()
+    def __parse_operators(self, min_power, logical) -> Node:
+        next_token = self.lexer.get_next_token
+        stack = []
+        push, pop = stack.append, stack.pop
+        while True:
+            # префиксная часть: !, скобки и унарный минус откладываются на стек
+            token = self.token
+            name = token.name
+            if name == Token.ID:
+                self.token = next_token()
+                name = self.token.name
+                left = self.__id_operand(token) if name == Token.LBR or name == Token.LSBR else NodeVar(token)
+            elif name == Token.INT_LITERAL:
+                self.token = next_token()
+                left = NodeIntLiteral(token)
+            elif logical and name == Token.NOT:
+                self.token = next_token()
+                push((_NOT_FRAME, min_power, logical, None, None))
+                min_power = _SUM_POWER
+                continue
+            elif logical and name == Token.LBR:
+                self.token = next_token()
+                push((_CONDITION_BR_FRAME, min_power, logical, None, None))
+                min_power = _OR_POWER
+                continue
+            else:
+                minus = None
+                if name == Token.MINUS:
+                    minus = token
+                    self.token = next_token()
+                if self.token.name == Token.LBR:
+                    self.token = next_token()
+                    push((_EXPRESSION_BR_FRAME, min_power, logical, None, minus))
+                    min_power, logical = _SUM_POWER, False
+                    continue
+                left = self.operand()
+                if minus:
+                    left = NodeUnaryMinus(left)
+            closed = False
+
+            # инфиксная часть: пока текущая операция связывает не слабее min_power,
+            # откладываем её и разбираем правый операнд, иначе сворачиваем стек
+            while True:
+                op = self.token
+                power = _BINDING_POWERS.get(op.name)
+                if power is not None and power >= min_power and not (closed and power > _RELATION_POWER):
+                    self.token = next_token()
+                    push((_BINARY_FRAME, min_power, logical, left, op))
+                    min_power, logical = _RIGHT_OPERANDS[power]
+                    break
+                if not stack:
+                    return left
+                frame, min_power, logical, frame_left, frame_op = pop()
+                # после операнда ! и условия в скобках арифметика не продолжается, как и
+                # после бинарной операции, правый операнд которой был таким
+                if frame == _BINARY_FRAME:
+                    left = NodeBinaryOperator(frame_left, frame_op, left)
+                elif frame == _NOT_FRAME:
+                    left = NodeNot(left)
+                    closed = True
+                else:
+                    self.require(Token.RBR)
+                    self.next_token()
+                    if frame_op:
+                        left = NodeUnaryMinus(left)
+                    closed = frame == _CONDITION_BR_FRAME
+
     def type(self) -> Node:
         _id = self.token
         self.next_token()
@@ -591,9 +734,9 @@ class Parser:
                             self.next_token()
                             # начинаем разбирать тело
                             block = self.block()
-                            # после разбора тела функции мы должны встретить закрывающую скобку }
+                            # после разбора тела функции мы должны встретить закрывающую скобку },
+                            # её, как и ; после оператора, пропускает вызывающий
                             self.require(Token.RCBR)
-                            self.next_token()
                             return NodeFunction(first_token, name, formal_params, block)
                         elif self.token.name in {Token.COMMA, Token.ASSIGN}:
                             return self.multiple_declarations(first_token, name, const=const_token)
@@ -719,15 +862,9 @@ class Parser:
                         return NodeFunctionCall(first_token, actual_params)
                     case _:
                         self.error("Ожидалось объявление константы и присваивание!")
+            # текст комментария целиком в токене DSLASH, его пропускает вызывающий
             case Token.DSLASH:
-                comment = self.token
-                self.next_token()
-                while self.token.name != Token.NEWLINE:
-                    self.next_token()
-                return NodeComment(comment)
-            case Token.NEWLINE:
-                self.next_token()
-                return None
+                return NodeComment(self.token)
 
 
     def get_while_if_else_body(self):
@@ -742,6 +879,27 @@ class Parser:
         self.require(Token.RCBR)
         return block, condition
 
+    def program_statement(self) -> Node | None:
+        # один оператор верхнего уровня программы вместе с завершающей ";",
+        # после него текущим становится первый токен следующего оператора
+        statement_to_add = self.statement()
+        if not statement_to_add:
+            return None
+        # функции не нужна ;
+
+        match statement_to_add:
+            case NodeComment():
+                pass
+                # print('Комментариям не нужна ";"')
+            case NodeFunction() | NodeWhileConstruction() | NodeIfConstruction() | NodeElseBlock():
+                pass
+                # print('Блокам не нужна ";"')
+            case _:
+                self.require(Token.SEMI)
+
+        self.next_token()
+        return statement_to_add
+
     def parse(self) -> Node:
         if not self.token:
             self.token = self.lexer.get_next_token()
@@ -749,24 +907,12 @@ class Parser:
             self.error("Пустой файл!")
         else:
             statements = []
-            while self.token.name != Token.EOF:
-                statement_to_add = self.statement()
-                if not statement_to_add:
-                    continue
-                statements.append(statement_to_add)
-                # функции не нужна ;
-
-                match statement_to_add:
-                    case NodeComment():
-                        pass
-                        # print('Комментариям не нужна ";"')
-                    case NodeFunction() | NodeWhileConstruction() | NodeIfConstruction() | NodeElseBlock():
-                        pass
-                        # print('Блокам не нужна ";"')
-                    case _:
-                        self.require(Token.SEMI)
-
-                self.next_token()
+            with _gc_paused():
+                while self.token.name != Token.EOF:
+                    statement_to_add = self.program_statement()
+                    if not statement_to_add:
+                        continue
+                    statements.append(statement_to_add)
             return NodeProgram(statements)
 
 
@@ -791,3 +937,410 @@ def iter_child_nodes(node):
             for item in field:
                 if isinstance(item, Node):
                     yield name, item
+
+
+def walk(node, field_name=''):
+    # Обход дерева в прямом порядке на явном стеке, без ограничения глубины рекурсии:
+    # отдаёт (глубина, имя поля, узел, родитель) для узла и всех его потомков
+    stack = [(0, field_name, node, None)]
+    while stack:
+        item = stack.pop()
+        yield item
+        depth, _, node, _ = item
+        if isinstance(node, Node):
+            children = [(depth + 1, name, child, node) for name, child in iter_child_nodes(node)]
+            children.reverse()
+            stack.extend(children)
+
+
+def iter_dump(node, field_name='', max_depth=None, level=0):
+    # Построчный дамп дерева в формате Node.__repr__ за один проход по явному стеку.
+    # Узлы глубже max_depth (считая от node) не выводятся, у обрезанного узла в
+    # конце строки ' ...'; level - отступ самого node
+    prefixes = ['']
+    stack = [(level, field_name, node)]
+    while stack:
+        depth, name, el = stack.pop()
+        while len(prefixes) <= depth:
+            prefixes.append('|   ' * len(prefixes) + '|+-')
+        if isinstance(el, Token):
+            yield f'{prefixes[depth]}{name}: {el}\n'
+            continue
+        children = list(iter_child_nodes(el))
+        if children and max_depth is not None and depth - level >= max_depth:
+            yield f'{prefixes[depth]}{name}: {type(el).__name__} ...\n'
+            continue
+        yield f'{prefixes[depth]}{name}: {type(el).__name__}\n'
+        depth += 1
+        for child_name, child in reversed(children):
+            stack.append((depth, child_name, child))
+
+
+def dump(node, file=None, max_depth=None):
+    # пишет дамп дерева в file (по умолчанию sys.stdout) по мере обхода, не собирая его в строку
+    if file is None:
+        file = sys.stdout
+    file.writelines(iter_dump(node, max_depth=max_depth))
+
+
+# Двоичный формат AST (serialize/deserialize): после сигнатуры идут секции
+# <длина uint32><байты>. Значения в дереве пронумерованы общей таблицей: None,
+# False, True, затем токены, затем узлы, сгруппированные по классам, затем списки;
+# поля узлов и элементы списков хранятся номерами в этой таблице.
+#  - таблица классов узлов: строки '<класс> <поля...>' и число узлов каждого класса;
+#  - таблица строк (значения токенов) и номер корня;
+#  - токены колонками: вид, номер значения в таблице строк (0 - None), строка, позиция;
+#  - длины списков, для каждого класса по колонке на поле, элементы списков подряд.
+# При загрузке все узлы и списки сначала создаются пустыми, поэтому поля заполняются
+# целыми колонками через map, без разбора записей по одной
+AST_SIGNATURE = b'CPPAST\x01'
+_AST_CONSTANTS = (None, False, True)
+_TOKEN_COLUMNS = ('Bname', 'Ivalue', 'Ilineno', 'ipos')
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    # сотни тысяч новых объектов подряд запускают циклический сборщик снова и снова,
+    # хотя циклов среди них нет
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _ast_section(data):
+    return struct.pack('<I', len(data)) + data
+
+
+def _ast_array(typecode, values):
+    column = array(typecode, values)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return _ast_section(column.tobytes())
+
+
+def serialize(node) -> bytes:
+    # AST (узел, список или токен) в двоичном формате, см. AST_SIGNATURE
+    with _gc_paused():
+        return _serialize(node)
+
+
+def _serialize(node):
+    groups = {}
+    lists = []
+    tokens = []
+    # id объекта -> (группа, номер в группе); токены - номер в tokens
+    places = {}
+    token_ids = {}
+    stack = [node]
+    while stack:
+        el = stack.pop()
+        key = id(el)
+        if key in places or key in token_ids:
+            continue
+        if isinstance(el, Node):
+            group = groups.setdefault(type(el), [])
+            items = [getattr(el, field, None) for field in el._fields]
+        elif isinstance(el, list):
+            group = lists
+            items = el
+        elif isinstance(el, Token):
+            token_ids[key] = len(tokens)
+            tokens.append(el)
+            continue
+        elif el is None or el is False or el is True:
+            continue
+        else:
+            raise TypeError(f'Cannot serialize {type(el).__name__} in AST')
+        places[key] = group, len(group)
+        group.append(el)
+        stack.extend(reversed(items))
+
+    first_token = len(_AST_CONSTANTS)
+    bases = {}
+    base = first_token + len(tokens)
+    for group in (*groups.values(), lists):
+        bases[id(group)] = base
+        base += len(group)
+
+    def ref(value):
+        if value is None or value is False or value is True:
+            return _AST_CONSTANTS.index(value)
+        key = id(value)
+        if key in token_ids:
+            return first_token + token_ids[key]
+        group, index = places[key]
+        return bases[id(group)] + index
+
+    strings = {}
+    kind_table = '\n'.join(' '.join((node_type.__name__,) + node_type._fields) for node_type in groups)
+    sections = [_ast_section(kind_table.encode()),
+                _ast_array('I', map(len, groups.values())),
+                None,
+                _ast_section(struct.pack('<I', ref(node)))]
+    for column in _TOKEN_COLUMNS:
+        typecode, field = column[0], column[1:]
+        if field == 'value':
+            values = (0 if token.value is None else strings.setdefault(token.value, len(strings) + 1)
+                      for token in tokens)
+        else:
+            values = map(operator.attrgetter(field), tokens)
+        sections.append(_ast_array(typecode, values))
+    sections[2] = _ast_section('\0'.join(strings).encode())
+    sections.append(_ast_array('I', map(len, lists)))
+    for node_type, group in groups.items():
+        for field in node_type._fields:
+            sections.append(_ast_array('I', (ref(getattr(el, field, None)) for el in group)))
+    sections.append(_ast_array('I', (ref(item) for el in lists for item in el)))
+    return AST_SIGNATURE + b''.join(sections)
+
+
+def deserialize(data: bytes):
+    # AST из двоичного формата serialize; классы узлов берутся из этого модуля и
+    # должны иметь те же поля, что при сохранении
+    with _gc_paused():
+        return _deserialize(data)
+
+
+def _deserialize(data):
+    if not data.startswith(AST_SIGNATURE):
+        raise ValueError('Not a serialized AST')
+    view = memoryview(data)
+    offset = len(AST_SIGNATURE)
+
+    def section(typecode=None):
+        nonlocal offset
+        if offset + 4 > len(view):
+            raise ValueError('Truncated serialized AST')
+        size, = struct.unpack_from('<I', view, offset)
+        offset += 4
+        if offset + size > len(view):
+            raise ValueError('Truncated serialized AST')
+        chunk = view[offset:offset + size]
+        offset += size
+        if typecode is None:
+            return bytes(chunk).decode()
+        column = array(typecode)
+        column.frombytes(chunk)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    kind_table = section()
+    counts = section('I')
+    strings = [None]
+    string_table = section()
+    if string_table:
+        strings.extend(string_table.split('\0'))
+    root, = section('I')
+
+    kinds = []
+    for line in kind_table.split('\n') if kind_table else ():
+        class_name, *fields = line.split(' ')
+        node_type = globals().get(class_name)
+        if not (isinstance(node_type, type) and issubclass(node_type, Node)) or list(node_type._fields) != fields:
+            raise ValueError(f"Node '{line}' does not match the parser")
+        kinds.append(node_type)
+
+    # токены и узлы создаются без __init__, слоты заполняются дескрипторами целыми
+    # колонками (у подклассов дескриптор слота находится в базовом классе)
+    table = list(_AST_CONSTANTS)
+    token_count = None
+    for column in _TOKEN_COLUMNS:
+        values = section(column[0])
+        if column == 'Ivalue':
+            values = map(strings.__getitem__, values)
+        if token_count is None:
+            token_count = len(values)
+            tokens = list(map(Token.__new__, itertools.repeat(Token, token_count)))
+        list(map(getattr(Token, column[1:]).__set__, tokens, values))
+    table.extend(tokens)
+    groups = []
+    for node_type, count in zip(kinds, counts):
+        group = list(map(node_type.__new__, itertools.repeat(node_type, count)))
+        groups.append(group)
+        table.extend(group)
+    lengths = section('I')
+    lists = [[] for _ in lengths]
+    table.extend(lists)
+
+    value_of = table.__getitem__
+    for node_type, group in zip(kinds, groups):
+        for field in node_type._fields:
+            list(map(getattr(node_type, field).__set__, group, map(value_of, section('I'))))
+    items = list(map(value_of, section('I')))
+    start = 0
+    for el, length in zip(lists, lengths):
+        el.extend(items[start:start + length])
+        start += length
+    return table[root]
+
+
+class EnterFields:
+    # обработчик enter_ для NodeWalker, который возвращает перечисленные поля узла
+    # в этом порядке: enter_NodeBinaryOperator = EnterFields('left', 'right')
+    def __init__(self, *fields):
+        self.fields = fields
+        self.getter = operator.attrgetter(*fields)
+
+    def children(self, node):
+        return (self.getter(node),) if len(self.fields) == 1 else self.getter(node)
+
+    def __call__(self, walker, node):
+        return self.children(node)
+
+
+class NodeWalker:
+    # Обход AST с обработчиками входа и выхода для каждого типа элементов.
+    # visit спускается рекурсивно, пока глубина не превышает recursion_depth: на
+    # обычных неглубоких деревьях это быстрее всего, а более глубокие поддеревья
+    # обходит walk на явном стеке, так что глубина дерева не ограничена пределом рекурсии.
+    # При входе в элемент дерева (узел, список, токен) вызывается enter_<имя типа>(node),
+    # по умолчанию generic_enter; он возвращает последовательность дочерних элементов
+    # для обхода: None - все поля узла или элементы списка, () - не спускаться.
+    # Обработчик, который только возвращает (), лучше задавать как skip_children, а
+    # который возвращает некоторые поля узла - как EnterFields с их именами: такие
+    # элементы обходятся без его вызова.
+    # После дочерних вызывается leave_<имя типа>(node, values), по умолчанию
+    # generic_leave, со списком их результатов, его результат получает родитель.
+    # Для элементов другого типа (например, None в поле узла) без своего enter_
+    # обработчика generic_enter выбрасывает исключение.
+    # План обхода каждого типа (обработчики и способ получить дочерние элементы)
+    # вычисляется один раз; у каждого подкласса свой кэш, так как он может
+    # переопределять обработчики и generic_enter/generic_leave.
+    # Если visit_counts - словарь, в нём считается, сколько раз обход входил в
+    # элементы каждого типа (для instrumentation.PipelineStats); такой обход всегда
+    # идёт через walk
+    _plans = {}
+    visit_counts = None
+    # уровней рекурсии visit до перехода на явный стек; вместе с кадрами обработчиков
+    # это заметно меньше предела рекурсии по умолчанию (1000)
+    recursion_depth = 150
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._plans = {}
+        cls._visitors = _VisitorTable(cls)
+
+    @classmethod
+    def _find_plan(cls, node_type):
+        name = node_type.__name__
+        enter = getattr(cls, 'enter_' + name, cls.generic_enter)
+        leave = getattr(cls, 'leave_' + name, cls.generic_leave)
+        # children возвращает последовательность дочерних элементов
+        if issubclass(node_type, Node):
+            getter = operator.attrgetter(*node_type._fields) if node_type._fields else None
+            if len(node_type._fields) == 1:
+                children = lambda node: (getter(node),)
+            else:
+                children = getter
+        elif issubclass(node_type, list):
+            children = tuple
+        elif issubclass(node_type, Token):
+            children = None
+        else:
+            children = None
+            if enter is NodeWalker.generic_enter:
+                enter = NodeWalker._unknown_element
+        # обработчики по умолчанию ничего не делают, их можно не вызывать
+        if enter is NodeWalker.generic_enter:
+            enter = None
+        elif enter is NodeWalker.skip_children:
+            enter = children = None
+        elif isinstance(enter, EnterFields):
+            children, enter = enter.children, None
+        if leave is NodeWalker.generic_leave:
+            leave = None
+        plan = cls._plans[node_type] = (enter, leave, children)
+        cls._visitors[node_type] = _recursive_visit(plan, cls._visitors)
+        return plan
+
+    def generic_enter(self, node):
+        return None
+
+    def generic_leave(self, node, values):
+        return None
+
+    def skip_children(self, node):
+        return ()
+
+    def _unknown_element(self, node):
+        raise Exception('No visit_{} method'.format(type(node).__name__))
+
+    def walk(self, node):
+        plans = self._plans
+        counts = self.visit_counts
+        values = []
+        # на стеке элементы дерева, в которые ещё не входили, и тройки (leave, элемент, n) -
+        # элементы, ждущие leave после своих n дочерних (сами элементы дерева не кортежи)
+        stack = [node]
+        while stack:
+            item = stack.pop()
+            if type(item) is tuple:
+                leave, node, count = item
+                node_values = values[-count:]
+                del values[-count:]
+            else:
+                node = item
+                enter, leave, children_of = plans.get(type(node)) or self._find_plan(type(node))
+                if counts is not None:
+                    counts[type(node)] = counts.get(type(node), 0) + 1
+                children = enter(self, node) if enter else None
+                if children is None and children_of:
+                    children = children_of(node)
+                if children:
+                    stack.append((leave, node, len(children)))
+                    stack.extend(reversed(children))
+                    continue
+                node_values = ()
+            values.append(leave(self, node, node_values) if leave else None)
+        return values.pop()
+
+    def visit(self, node):
+        if self.visit_counts is not None:
+            return self.walk(node)
+        return self._visitors[type(node)](self, node, self.recursion_depth)
+
+
+def _recursive_visit(plan, visitors):
+    # функция рекурсивного обхода элементов одного типа для NodeWalker.visit: те же
+    # вызовы, что у walk, по тому же плану; дочерние элементы обходятся функциями
+    # своих типов из visitors, на глубине depth == 0 - через walk
+    enter, leave, children_of = plan
+
+    def visit(walker, node, depth):
+        children = enter(walker, node) if enter else None
+        if children is None and children_of:
+            children = children_of(node)
+        if not children:
+            return leave(walker, node, ()) if leave else None
+        values = []
+        append = values.append
+        if depth:
+            depth -= 1
+            for child in children:
+                append(visitors[type(child)](walker, child, depth))
+        else:
+            walk = walker.walk
+            for child in children:
+                append(walk(child))
+        return leave(walker, node, values) if leave else None
+    return visit
+
+
+class _VisitorTable(dict):
+    # функции visit по типам элементов для подкласса NodeWalker; тип, которого ещё
+    # нет в таблице, получает план и функцию при первом обращении
+    def __init__(self, walker_class):
+        super().__init__()
+        self.walker_class = walker_class
+
+    def __missing__(self, node_type):
+        self.walker_class._find_plan(node_type)
+        return self[node_type]
+
+
+NodeWalker._visitors = _VisitorTable(NodeWalker)
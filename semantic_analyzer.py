@@ -9,6 +9,8 @@ class Symbol():
         self.name = name
         self.type = _type
         self.hit_count = 0;
+        # узлы NodeVar/NodeID, которые ссылаются на переменную блока (для остальных None)
+        self.references = None
 
 class BuiltinTypeSymbol(Symbol):
     def __init__(self, name):
@@ -24,6 +26,9 @@ class BuiltinTypeSymbol(Symbol):
 class VarSymbol(Symbol):
     def __init__(self, name, _type):
         super().__init__(name, _type)
+        # имя в секции var Pascal: у переменной блока, которая перекрывает другую
+        # переменную функции, оно отличается от name (см. SemanticAnalyzer.name_block_variables)
+        self.pascal_name = name
 
 
     def __str__(self):
@@ -56,20 +61,23 @@ class FunctionSymbol(Symbol):
 
 
 # -------------------------------- Symbol Table
+BUILTIN_TYPES = ('int', 'float', 'char', 'string')
+
+
 class ScopedSymbolTable(object):
-    def __init__(self, scope_name, scope_level, enclosing_scope=None):
+    def __init__(self, scope_name, scope_level, enclosing_scope=None, block=False):
         self._symbols: typing.Dict[str, Symbol]
         self._symbols = dict()
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
         self.nested_scopes = dict()
+        # область блока if/while/else внутри функции
+        self.block = block
 
     def _init_builtins(self):
-        self.insert(BuiltinTypeSymbol('int'))
-        self.insert(BuiltinTypeSymbol('float'))
-        self.insert(BuiltinTypeSymbol('char'))
-        self.insert(BuiltinTypeSymbol('string'))
+        for type_name in BUILTIN_TYPES:
+            self.insert(BuiltinTypeSymbol(type_name))
 
     def __str__(self):
         h1 = 'SCOPE (SCOPED SYMBOL TABLE)'
@@ -127,26 +135,92 @@ class ScopedSymbolTable(object):
             return self.enclosing_scope.lookup(name)
 
 
-class NodeVisitor(object):
-    def visit(self, node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
-
-    def generic_visit(self, node):
-        if isinstance(node, parser.Node):
-            for field in node._fields:
-                self.visit(getattr(node, field))
+class SymbolTable(object):
+    # Разрешение имён для всех областей видимости сразу: каждому объявлению
+    # присваивается плотный номер (symbol.id, индекс в self.symbols), а имя
+    # ищется в одном словаре имя -> стек (номер области, символ) видимых
+    # объявлений, поэтому lookup не зависит от глубины вложенности областей.
+    # ScopedSymbolTable остаются представлениями отдельных областей: в них те же
+    # символы, по ним транслятор строит секции var.
+    # Области блоков (block=True) открываются внутри функций для if/while/else
+    def __init__(self):
+        self.symbols: typing.List[Symbol]
+        self.symbols = []
+        self._bindings: typing.Dict[str, typing.List[typing.Tuple[int, Symbol]]]
+        self._bindings = dict()
+        # открытые области, последняя - текущая
+        self._scopes: typing.List[ScopedSymbolTable]
+        self._scopes = []
+        # номера в _scopes открытых областей, не являющихся блоками (программа, функции)
+        self._frames = []
+
+    @property
+    def current_scope(self):
+        return self._scopes[-1] if self._scopes else None
+
+    def open_scope(self, scope_name, block=False):
+        enclosing_scope = self.current_scope
+        scope = ScopedSymbolTable(
+            scope_name=scope_name,
+            scope_level=len(self._scopes),
+            enclosing_scope=enclosing_scope,
+            block=block,
+        )
+        if enclosing_scope is not None:
+            enclosing_scope.nested_scopes[scope_name] = scope
+        if not block:
+            self._frames.append(len(self._scopes))
+        self._scopes.append(scope)
+        return scope
+
+    def close_scope(self):
+        # снимает со стеков имён только объявления закрываемой области
+        scope = self._scopes.pop()
+        if not scope.block:
+            self._frames.pop()
+        bindings = self._bindings
+        for name in scope._symbols:
+            stack = bindings[name]
+            stack.pop()
+            if not stack:
+                del bindings[name]
+        return self.current_scope
 
+    def insert(self, symbol):
+        depth = len(self._scopes) - 1
+        symbol.id = len(self.symbols)
+        self.symbols.append(symbol)
+        stack = self._bindings.setdefault(symbol.name, [])
+        # повторное объявление в той же области заменяет прежнее, как в ScopedSymbolTable
+        if stack and stack[-1][0] == depth:
+            stack[-1] = (depth, symbol)
         else:
-            raise Exception('No visit_{} method'.format(type(node).__name__))
+            stack.append((depth, symbol))
+        self._scopes[-1].insert(symbol)
 
+    def lookup(self, name, current_scope_only=False, count=False):
+        stack = self._bindings.get(name)
+        if not stack:
+            return None
+        depth, symbol = stack[-1]
+        if current_scope_only and depth != len(self._scopes) - 1:
+            return None
+        # как и ScopedSymbolTable.lookup, считаем только обращения из той же функции
+        # (из её блоков тоже)
+        if count and depth >= self._frames[-1]:
+            symbol.hit_count += 1
+        return symbol
 
 
-class SemanticAnalyzer(NodeVisitor):
+class SemanticAnalyzer(parser.NodeWalker):
+    # обходит AST без рекурсии: действия при входе в узел выполняются в том же
+    # порядке, что и при рекурсивном обходе, при выходе из функций и программы
+    # восстанавливается объемлющая область видимости
     def __init__(self, verbose=False):
         #self.scope = ScopedSymbolTable(scope_name='global', scope_level=1)
+        self.symbols = SymbolTable()
         self.current_scope = None
+        self._block_count = 0
         self.error_count = 0
         self.errors = []
         self.scopes = dict()
@@ -160,106 +234,162 @@ class SemanticAnalyzer(NodeVisitor):
         if self.verbose:
             print(error_msg)
 
-    def visit_NodeProgram(self, node: parser.NodeProgram):
+    def enter_NodeProgram(self, node: parser.NodeProgram):
         #print('ENTER scope: global')
-        global_scope = ScopedSymbolTable(
-            scope_name='global',
-            scope_level=0,
-            enclosing_scope=self.current_scope, # None
-        )
+        global_scope = self.symbols.open_scope('global')
         self.current_scope = global_scope
         self.scopes['global'] = global_scope
-        global_scope._init_builtins() # init built-in types just once in global scope
+        # init built-in types just once in global scope
+        for type_name in BUILTIN_TYPES:
+            self.symbols.insert(BuiltinTypeSymbol(type_name))
 
         # visit subtree
-        self.visit(node.block)
+        return (node.block,)
 
+    def leave_NodeProgram(self, node: parser.NodeProgram, values):
         #print(global_scope)
 
-        self.current_scope = self.current_scope.enclosing_scope
+        self.current_scope = self.symbols.close_scope()
         if not self.scopes.get('main', None):
             self.error("No 'main' function found", 0,0)
         #print('LEAVE scope: global')
 
 
-    def visit_NodeFunction(self, node: parser.NodeFunction):
+    def enter_NodeFunction(self, node: parser.NodeFunction):
         func_name = node.name.value
         func_ret_type = node.ret_type.value
         func_symbol = FunctionSymbol(func_name, ret_type=func_ret_type)
-        self.current_scope.insert(func_symbol)
+        self.symbols.insert(func_symbol)
 
         #print(f'ENTER scope: {func_name}')
         # Scope for parameters and local variables
 
-        function_scope = ScopedSymbolTable(
-            scope_name=func_name,
-            scope_level=self.current_scope.scope_level + 1,
-            enclosing_scope=self.current_scope,
-        )
-        self.current_scope.nested_scopes[func_name] = function_scope
+        function_scope = self.symbols.open_scope(func_name)
         self.current_scope = function_scope
         self.scopes[func_name] = function_scope
 
         # Insert parameters into the procedure scope
         for param in node.formal_params.params:
-            param_type = self.current_scope.lookup(param.type.value, count=True)
+            param_type = self.symbols.lookup(param.type.value, count=True)
             if not param_type:
                 self.error(f'Undefined type {param.type.value}', param.type.lineno, param.type.pos)
             param_name = param.name.value
             var_symbol = FormalVarSymbol(param_name, param_type)
-            self.current_scope.insert(var_symbol)
+            self.symbols.insert(var_symbol)
             func_symbol.params.append(var_symbol)
 
-        self.visit(node.block)
+        return (node.block,)
 
+    def leave_NodeFunction(self, node: parser.NodeFunction, values):
         #print(function_scope)
+        self.name_block_variables(self.current_scope)
 
-        self.current_scope = self.current_scope.enclosing_scope
+        self.current_scope = self.symbols.close_scope()
         #print(f'LEAVE scope: {func_name}')
 
-    def visit_VarDecl(self, node):
+    def open_block(self, kind):
+        # своя область для блока if/while/else; условие в ней ничего не объявляет,
+        # поэтому её можно открыть уже при входе в конструкцию
+        self._block_count += 1
+        self.current_scope = self.symbols.open_scope(f'{kind}#{self._block_count}', block=True)
+
+    @staticmethod
+    def name_block_variables(function_scope):
+        # В Pascal у функции одна секция var, и переменные блоков попадают в неё.
+        # Переменная блока делит переменную Pascal с одноимёнными (без учёта регистра,
+        # как в Pascal) переменными того же типа, если их время жизни не пересекается
+        # (другие блоки, объявления функции после блока). Иначе, например, если она
+        # перекрывает переменную объемлющей области, она получает имя name_1, name_2, ...
+        slots = {}
+        for symbol in function_scope._symbols.values():
+            if isinstance(symbol, (VarSymbol, FormalVarSymbol)):
+                slots.setdefault(symbol.name.lower(), []).append(symbol)
+        block_symbols = []
+        scopes = [scope for scope in function_scope.nested_scopes.values() if scope.block]
+        while scopes:
+            scope = scopes.pop()
+            block_symbols.extend(symbol for symbol in scope._symbols.values() if isinstance(symbol, VarSymbol))
+            scopes.extend(nested for nested in scope.nested_scopes.values() if nested.block)
+        block_symbols.sort(key=lambda symbol: symbol.id)
+
+        for symbol in block_symbols:
+            name, suffix = symbol.name, 0
+            # области, в которых видны объявленные раньше переменные
+            enclosing = None
+            while True:
+                members = slots.setdefault(name.lower(), [])
+                if members and enclosing is None:
+                    enclosing = {function_scope}
+                    scope = symbol.scope
+                    while scope is not function_scope:
+                        enclosing.add(scope)
+                        scope = scope.enclosing_scope
+                if all(member.type is symbol.type and isinstance(member, VarSymbol)
+                       and not (member.id < symbol.id and member.scope in enclosing) for member in members):
+                    members.append(symbol)
+                    break
+                suffix += 1
+                name = f'{symbol.name}_{suffix}'
+            symbol.pascal_name = name
+            if name == symbol.name:
+                symbol.references = None
+
+    def enter_NodeIfConstruction(self, node: parser.NodeIfConstruction):
+        self.open_block('if')
+
+    def enter_NodeWhileConstruction(self, node: parser.NodeWhileConstruction):
+        self.open_block('while')
+
+    def enter_NodeElseBlock(self, node: parser.NodeElseBlock):
+        self.open_block('else')
+
+    def leave_NodeIfConstruction(self, node: parser.NodeIfConstruction, values):
+        self.current_scope = self.symbols.close_scope()
+
+    leave_NodeWhileConstruction = leave_NodeIfConstruction
+    leave_NodeElseBlock = leave_NodeIfConstruction
+
+    def enter_VarDecl(self, node):
         type_name = node.type_node.value
-        type_symbol = self.current_scope.lookup(type_name, count=True)
+        type_symbol = self.symbols.lookup(type_name, count=True)
 
         # We have all the information we need to create a variable symbol.
         # Create the symbol and insert it into the symbol table.
         var_name = node.var_node.value
         var_symbol = VarSymbol(var_name, type_symbol)
 
-        self.current_scope.insert(var_symbol)
+        self.symbols.insert(var_symbol)
+        return ()
 
-
-    def visit_NodeDeclaration(self, node: Token):
+    def enter_NodeDeclaration(self, node: Token):
         type_name = node.type.value
-        type_symbol = self.current_scope.lookup(type_name, count=True)
+        type_symbol = self.symbols.lookup(type_name, count=True)
 
         var_name = node.name.value
         var_symbol = VarSymbol(var_name, type_symbol)
 
         # Signal an error if the table already has a symbol with the same name
-        if self.current_scope.lookup(var_name, current_scope_only=True, count = False):
+        if self.symbols.lookup(var_name, current_scope_only=True, count = False):
             self.error(f"Повторное объявление '{var_name}'",node.name.lineno,node.name.pos)
 
-        self.current_scope.insert(var_symbol)
+        if self.current_scope.block:
+            var_symbol.references = []
+        self.symbols.insert(var_symbol)
+        return ()
 
-    def visit_NodeVar(self, node):
+    def enter_NodeVar(self, node):
         var_name = node.name.value
-        var_symbol = self.current_scope.lookup(var_name, count=True)
+        var_symbol = self.symbols.lookup(var_name, count=True)
         if var_symbol is None:
             self.error(f"Идентификатор не найден '{var_name}'", node.name.lineno,node.name.pos)
+        elif var_symbol.references is not None:
+            var_symbol.references.append(node)
+        return ()
 
     # todo semantic chech on call and declaration params
-    visit_NodeID = visit_NodeVar
-
-    visit_NodeFunctionCall = visit_NodeVar
-
-    def visit_list(self, node):
-        for el in node:
-            self.visit(el)
+    enter_NodeID = enter_NodeVar
 
-    def visit_Token(selfself, node):
-        #print(node)
-        pass
+    enter_NodeFunctionCall = enter_NodeVar
 
 if __name__ == '__main__':
     with open("file.cpp", 'r', encoding='utf8') as f:
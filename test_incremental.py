@@ -0,0 +1,44 @@
+import os
+import unittest
+
+from incremental import IncrementalDocument
+from lexer import tokenize
+from parser import Parser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def read_sample(name):
+    with open(os.path.join(HERE, name), encoding='utf8') as f:
+        return f.read()
+
+
+class EditAtEndOfFileTest(unittest.TestCase):
+    # правки после последнего оператора: исходники примеров кончаются на '}' без
+    # перевода строки, и оператор должен заканчиваться на EOF, а не на '}'
+    def assert_matches_full_parse(self, document):
+        fresh = IncrementalDocument(document.content)
+        self.assertEqual(repr(document.tree), repr(Parser(tokenize(document.content)).parse()))
+        self.assertEqual(document.spans, fresh.spans)
+
+    def test_samples_end_without_newline(self):
+        for name in ('file.cpp', 'file_Lite.cpp'):
+            with self.subTest(name):
+                content = read_sample(name)
+                self.assertTrue(content.endswith('}'))
+                document = IncrementalDocument(content)
+                self.assertEqual(document.spans[-1][1], len(document.tokens) - 1)
+                document.edit(len(content), 0, '\n')
+                self.assert_matches_full_parse(document)
+                document.edit(len(document.content), 0, 'int z;\n')
+                self.assert_matches_full_parse(document)
+
+    def test_edit_after_last_brace(self):
+        content = 'int x;\nvoid main()\n{\n    x = 1;\n}'
+        document = IncrementalDocument(content)
+        document.edit(len(content), 0, ' // end')
+        self.assert_matches_full_parse(document)
+
+
+if __name__ == '__main__':
+    unittest.main()
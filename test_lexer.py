@@ -0,0 +1,35 @@
+import unittest
+
+from lexer import Lexer, Token
+
+
+def whitespace_source(size):
+    # длинные отступы и комментарии: рекурсивный автомат тратит по кадру стека на символ
+    line = '\t' * 500 + ' ' * 2000 + 'x = x + 1;' + ' ' * 1000 + '// ' + 'comment ' * 200 + '\n'
+    return 'int x;\n' + line * (size // len(line) + 1)
+
+
+def lex(content, engine):
+    lexer = Lexer(content, engine=engine)
+    tokens = []
+    while True:
+        token = lexer.get_next_token()
+        tokens.append((token.name, token.value, token.lineno, token.pos))
+        if token.name == Token.EOF:
+            return tokens
+
+
+class IterativeEngineTest(unittest.TestCase):
+    # движок 'iterative' - автомат 'fsm' без рекурсии
+    def test_megabyte_of_whitespace_and_comments(self):
+        content = whitespace_source(2_000_000)
+        self.assertGreater(len(content), 2_000_000)
+        with self.assertRaises(RecursionError):
+            lex(content, 'fsm')
+        tokens = lex(content, 'iterative')
+        self.assertEqual(tokens, lex(content, 'table'))
+        self.assertEqual(sum(name == Token.NEWLINE for name, *_ in tokens), content.count('\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
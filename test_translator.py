@@ -0,0 +1,62 @@
+import io
+import unittest
+
+from cpp2pas_translator import translate_source
+
+
+def translate(body, optimize=False):
+    translator, analyzer = translate_source(io.StringIO('void main()\n{\n' + body + '}'), optimize=optimize)
+    return translator.output, analyzer.errors
+
+
+class UnaryMinusTest(unittest.TestCase):
+    # операнд унарного минуса и отрицательный правый операнд берутся в скобки
+    def assert_translates(self, statement, expected, optimize=False):
+        output, errors = translate(f'int a;\nint b;\n{statement}\n', optimize)
+        self.assertEqual(errors, [])
+        self.assertIn(expected, output.splitlines())
+
+    def test_binary_operand(self):
+        self.assert_translates('a = -(a + 1);', '   a := -(a + 1);')
+        self.assert_translates('b = 2 * -(a - b);', '   b := 2 * (-(a - b));')
+        self.assert_translates('b = -(3 + 2) * b;', '   b := -(3 + 2) * b;')
+
+    def test_negative_right_operand(self):
+        self.assert_translates('a = a - -b;', '   a := a - (-b);')
+        self.assert_translates('a = a - -5;', '   a := a - (-5);', optimize=True)
+        self.assert_translates('a = a * -2.5;', '   a := a * (-2.5);', optimize=True)
+        # правый операнд начинается с отрицательного: 'a - -3 * b' в Pascal недопустимо
+        self.assert_translates('a = a - (-3 * b);', '   a := a - (-3 * b);')
+        self.assert_translates('if (a > -3) {\na = 1;\n}', '   if (a > -3) then')
+
+    def test_only_right_operand(self):
+        # скобки только вокруг отрицательного операнда, а не всей правой части
+        self.assert_translates('if (2 * 1 != -a + 1 - b) {\na = 1;\n}', '   if 2 * 1 != -a + 1 - b then')
+
+
+class InlineTest(unittest.TestCase):
+    SHADOWING = ('int x = 1;\n'
+                 'if (1 < 2) {\nint x = 5;\nx = x + 1;\n}\n'
+                 'if (1 > 2) {\nx = 3;\n}\nelse {\nfloat x = 2.5;\ncout << x;\n}\n'
+                 'cout << x;\n')
+
+    def test_block_with_declarations_is_kept(self):
+        plain, _ = translate(self.SHADOWING)
+        optimized, errors = translate(self.SHADOWING, optimize=True)
+        self.assertEqual(errors, [])
+        self.assertEqual(optimized, plain)
+        self.assertIn('      x_1 := x_1 + 1;', optimized.splitlines())
+
+    def test_block_without_declarations_is_inlined(self):
+        output, errors = translate('int x;\nint y;\nx = 1;\nif (2 > 1) {\nx = x + 2;\n}\nif (1 > 2) {\ny = 1;\n}\n',
+                                   optimize=True)
+        self.assertEqual(errors, [])
+        lines = output.splitlines()
+        self.assertIn('   x := x + 2;', lines)
+        # y использовалась только в удалённом if
+        self.assertNotIn('var y: integer;', lines)
+        self.assertNotIn('if', output.replace('{END OF translated}', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+
+import parser
+from cpp2pas_translator import SourceToSourceTranslator
+from lexer import Token
+from semantic_analyzer import SemanticAnalyzer
+
+# глубина деревьев: во много раз больше предела рекурсии интерпретатора
+DEPTH = 100_000
+
+
+def var():
+    return parser.NodeVar(Token(Token.ID, 'a', 1, 1))
+
+
+def one():
+    return parser.NodeIntLiteral(Token(Token.INT_LITERAL, '1', 1, 1))
+
+
+def program(statements):
+    # int a; void main() { statements }
+    def token(name, value):
+        return Token(name, value, 1, 1)
+    main = parser.NodeFunction(token(Token.ID, 'void'), token(Token.ID, 'main'), parser.NodeFormalParams([]),
+                               parser.NodeBlock(statements))
+    return parser.NodeProgram([parser.NodeDeclaration(token(Token.ID, 'int'), token(Token.ID, 'a')), main])
+
+
+def else_if_chain(depth):
+    # if (a > 1) { a = 1; } else { if (a > 1) { a = 1; } else { ... } }
+    statements = [parser.NodeAssigning(var(), one())]
+    for _ in range(depth):
+        condition = parser.NodeBinaryOperator(var(), Token(Token.G, '>', 1, 1), one())
+        statements = [parser.NodeIfConstruction(condition, parser.NodeBlock([parser.NodeAssigning(var(), one())])),
+                      parser.NodeElseBlock(parser.NodeBlock(statements))]
+    return program(statements)
+
+
+def deep_expression(depth):
+    # a = a + a + ... + a: цепочка бинарных операций, вложенных влево
+    expression = var()
+    for _ in range(depth):
+        expression = parser.NodeBinaryOperator(expression, Token(Token.PLUS, '+', 1, 1), var())
+    return program([parser.NodeAssigning(var(), expression)])
+
+
+class NodeCounter(parser.NodeWalker):
+    # число узлов, токенов, списков и None поддерева, собранное из значений детей
+    enter_NoneType = parser.NodeWalker.skip_children
+
+    def generic_leave(self, node, values):
+        return 1 + sum(values)
+
+
+class DeepTreeTest(unittest.TestCase):
+    # обход, анализатор и транслятор на деревьях глубже предела рекурсии
+    @classmethod
+    def setUpClass(cls):
+        cls.trees = {'else if': else_if_chain(DEPTH), 'expression': deep_expression(DEPTH)}
+
+    def test_visit_and_walk(self):
+        for name, tree in self.trees.items():
+            with self.subTest(name):
+                count = NodeCounter().visit(tree)
+                self.assertGreater(count, DEPTH)
+                self.assertEqual(NodeCounter().walk(tree), count)
+                walker = NodeCounter()
+                walker.visit_counts = {}
+                self.assertEqual(walker.visit(tree), count)
+                self.assertEqual(sum(walker.visit_counts.values()), count)
+
+    def translate(self, tree):
+        analyzer = SemanticAnalyzer()
+        analyzer.visit(tree)
+        self.assertEqual(analyzer.errors, [])
+        translator = SourceToSourceTranslator(analyzer.scopes)
+        translator.visit(tree)
+        return translator.output
+
+    def test_else_if_chain(self):
+        output = self.translate(self.trees['else if'])
+        self.assertEqual(output.count('\n   else if (a > 1) then\n'), DEPTH - 1)
+        self.assertTrue(output.endswith('\n   else  \n   begin\n      a := 1;\n   end;\nend. {END OF translated}'))
+
+    def test_expression(self):
+        output = self.translate(self.trees['expression'])
+        self.assertIn('   a := ' + ' + '.join(['a'] * (DEPTH + 1)) + ';', output.splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import cpp2pas_translator
+import lexer
+import optimizer
+import parser
+import semantic_analyzer
+
+DEFAULT_MAX_SIZE = 256 * 2 ** 20
+# после вытеснения кэш занимает не больше этой доли max_size, чтобы не сканировать
+# каталог на каждой записи
+EVICT_TO = 0.9
+ENTRY_SUFFIX = '.json'
+
+_translator_version = None
+
+
+def translator_version():
+    # хэш исходников всех стадий трансляции: после любой их правки старые записи
+    # кэша перестают находиться
+    global _translator_version
+    if _translator_version is None:
+        digest = hashlib.sha256()
+        for module in (lexer, parser, semantic_analyzer, optimizer, cpp2pas_translator):
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        _translator_version = digest.hexdigest()
+    return _translator_version
+
+
+class CachedTranslation:
+    # Результат трансляции из кэша: текст на Pascal, семантические ошибки и журнал
+    # оптимизации. Подменяет и транслятор (output, log), и анализатор (errors,
+    # error_count) там, где process_file возвращает их пару
+    def __init__(self, output, errors, log):
+        self.output = output
+        self.errors = errors
+        self.log = log
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self):
+        return (f'попаданий {self.hits}, промахов {self.misses} ({self.hit_rate:.0%}), '
+                f'записано {self.stores}, вытеснено {self.evictions}')
+
+
+class TranslationCache:
+    # Кэш результатов трансляции в каталоге: ключ - sha256 от байтов исходника,
+    # версии транслятора и опций, запись - JSON-файл <ключ[:2]>/<ключ>.json.
+    # Запись пишется во временный файл и переименовывается (os.replace), поэтому
+    # параллельные процессы видят либо старую, либо новую запись целиком.
+    # Время последнего обращения - mtime файла: при попадании оно обновляется, а
+    # когда размер кэша превышает max_size, удаляются самые давние записи (LRU).
+    # Размер отслеживается приблизительно: каталог сканируется при первой записи и
+    # при превышении лимита, записи других процессов учитываются при сканировании
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = CacheStats()
+        self._size = None
+
+    def key(self, source: bytes, optimize=True, verbose=False):
+        digest = hashlib.sha256()
+        digest.update(source)
+        digest.update(f'\0{translator_version()}\0optimize={optimize}\0verbose={verbose}'.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            # нет записи, её только что вытеснил другой процесс или она повреждена
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return CachedTranslation(entry['output'], entry['errors'], entry['log'])
+
+    def put(self, key, output, errors, log):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        data = json.dumps({'output': output, 'errors': errors, 'log': log}, ensure_ascii=False)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf8') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self.stats.stores += 1
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self.entries())
+        else:
+            self._size += os.path.getsize(path)
+        if self._size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        # (mtime, размер, путь) всех записей
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(ENTRY_SUFFIX):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    result.append((stat.st_mtime, stat.st_size, entry.path))
+        return result
+
+    def evict(self):
+        # удаляет самые давние записи, пока кэш не станет меньше EVICT_TO * max_size
+        entries = self.entries()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        limit = self.max_size * EVICT_TO
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # уже удалена другим процессом
+                pass
+            else:
+                self.stats.evictions += 1
+            size -= entry_size
+        self._size = size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._size = 0